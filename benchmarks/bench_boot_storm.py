@@ -0,0 +1,177 @@
+"""
+Boot-storm benchmark of the hub ConnectionManager.
+
+Simulates a CORE scenario booting: N nodes connect to the hub at the same instant, each obtaining
+a node id (HUB_NODE_ID_REQ, as in system_init), then opening its logging and agent sessions.  The
+time until all N nodes are registered is reported for each listen backlog given.
+
+Run from a path where the emews package is importable, for example:
+  PYTHONPATH=src python benchmarks/bench_boot_storm.py -n 200 -b 5 1024
+
+Created on Oct 17, 2026
+"""
+import argparse
+import logging
+import random
+import resource
+import socket
+import struct
+import threading
+import time
+
+import emews.base.connectionmanager
+import emews.base.enums
+import emews.base.logger
+import emews.base.netclient
+import emews.base.sysprop
+import emews.base.thread_dispatcher
+
+
+def _raise_fd_limit(num_fds):
+    """Raise the soft fd limit (if needed and allowed), return the resulting soft limit."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < num_fds:
+        new_soft = num_fds if hard == resource.RLIM_INFINITY else min(num_fds, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (new_soft, hard))
+        soft = new_soft
+
+    return soft
+
+
+def _start_hub(port, backlog):
+    """Start a hub ConnectionManager in a (daemon) thread, return it."""
+    sys_prop = emews.base.sysprop.SysProp(
+        node_name='hub', node_id=1, root_path='', is_hub=True, local=False)
+    comm_config = {
+        'port': port,
+        'connect_timeout': 5,
+        'response_timeout': 30,
+        'connect_max_attempts': 10,
+        'reconnect_backoff_base': 0.1,
+        'reconnect_backoff_max': 10,
+        'circuit_failure_threshold': 10,
+        'circuit_reset_timeout': 30,
+        'service_id_lease_max': 64,
+        'listen_backlog': backlog,
+        'unix_socket_path': None,
+        'wire_protocol': 2,
+        'hub_multiplex': True,
+        'read_ahead_size': 65536,
+        'poll_backend': 'auto',
+        'session_idle_timeout': -1,
+        'session_read_timeout': 30,
+        'session_write_timeout': 30,
+        'session_buffer_limit': 1048576,
+        'global_buffer_limit': 67108864,
+        'max_field_size': 1048576,
+        'offload_threads': 4,
+        'offload_queue_size': 256,
+        'pool_max_idle': 4,
+        'pool_idle_timeout': 60,
+        'raise_on_servicebuilder_exceptions': False,
+        'halt_on_service_exceptions': False,
+    }
+
+    thread_dispatcher = emews.base.thread_dispatcher.ThreadDispatcher(
+        {'thread_shutdown_wait': 1, 'halt_on_service_exceptions': False, 'service_start_delay': -1},
+        _inject={'sys': sys_prop})
+    net_client = emews.base.netclient.NetClient(
+        comm_config, '127.0.0.1', _inject={'sys': sys_prop})
+    conn_manager = emews.base.connectionmanager.ConnectionManager(
+        comm_config, thread_dispatcher, net_client, _inject={'sys': sys_prop})
+
+    hub_thread = threading.Thread(target=conn_manager.start)
+    hub_thread.daemon = True
+    hub_thread.start()
+
+    return conn_manager
+
+
+def _boot_node(port, start_event, timeout, results, index):
+    """Register a single node with the hub, store (latency, attempts, socks) in results."""
+    start_event.wait()
+    start_time = time.time()
+    attempts = 0
+    socks = []
+
+    while True:
+        attempts += 1
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(('127.0.0.1', port))
+            sock.sendall(struct.pack('>HLH', emews.base.enums.net_protocols.NET_HUB, 0,
+                                     emews.base.enums.hub_protocols.HUB_NODE_ID_REQ))
+            node_id = struct.unpack('>L', sock.recv(4))[0]
+        except (socket.error, struct.error):
+            sock.close()
+            continue
+
+        sock.close()
+        break
+
+    for net_protocol in (emews.base.enums.net_protocols.NET_LOGGING,
+                         emews.base.enums.net_protocols.NET_AGENT):
+        # persistent sessions opened by each node after it is registered
+        sock = socket.create_connection(('127.0.0.1', port), timeout)
+        sock.sendall(struct.pack('>HL', net_protocol, node_id))
+        socks.append(sock)
+
+    results[index] = (time.time() - start_time, attempts, socks)
+
+
+def run(num_nodes, backlog, timeout):
+    """Run one boot storm, return (seconds until all registered, max latency, total attempts)."""
+    port = random.randint(40000, 60000)
+    conn_manager = _start_hub(port, backlog)
+    time.sleep(0.2)
+
+    start_event = threading.Event()
+    results = [None] * num_nodes
+    node_threads = []
+    for index in xrange(num_nodes):
+        node_thread = threading.Thread(
+            target=_boot_node, args=(port, start_event, timeout, results, index))
+        node_thread.daemon = True
+        node_thread.start()
+        node_threads.append(node_thread)
+
+    time.sleep(0.2)
+    start_time = time.time()
+    start_event.set()
+    for node_thread in node_threads:
+        node_thread.join()
+    elapsed = time.time() - start_time
+
+    conn_manager.stop()
+    for result in results:
+        for sock in result[2]:
+            sock.close()
+
+    return (elapsed, max(result[0] for result in results), sum(result[1] for result in results))
+
+
+def main():
+    """Run the benchmark for each backlog given."""
+    parser = argparse.ArgumentParser(description='eMews hub boot-storm benchmark')
+    parser.add_argument("-n", "--nodes", type=int, default=200,
+                        help="number of nodes booting at once (default: 200)")
+    parser.add_argument("-b", "--backlogs", type=int, nargs='+', default=[5, 1024],
+                        help="listen backlogs to benchmark (default: 5 1024)")
+    parser.add_argument("-t", "--timeout", type=float, default=5.0,
+                        help="client connect timeout per attempt, seconds (default: 5)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    emews.base.logger._base_logger = logging.LoggerAdapter(logging.getLogger('emews.bench'), {})
+    _raise_fd_limit(8 * args.nodes + 64)
+
+    print "%-8s %8s %18s %18s %10s" % ('backlog', 'nodes', 'all registered (s)', 'max latency (s)',
+                                       'attempts')
+    for backlog in args.backlogs:
+        elapsed, max_latency, attempts = run(args.nodes, backlog, args.timeout)
+        print "%-8d %8d %18.3f %18.3f %10d" % (backlog, args.nodes, elapsed, max_latency, attempts)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+Microbenchmark of the NetProto wire codecs.
+
+- encode: client side, building a query (request id and values) for a protocol, both with the
+  compiled NetProto codec and the legacy way (format string built per query by build_query)
+- decode: server side, NetServ parsing pipelined requests from a receive buffer, field by field, as
+  the ConnectionManager drives it (the handler itself does nothing but acknowledge)
+
+Both are reported in frames (requests) per second, for a fixed width protocol and for a protocol
+with a string field (the AGENT_TELL layout).
+
+Run from a path where the emews package is importable, for example:
+  PYTHONPATH=src python benchmarks/bench_codecs.py
+
+Created on Oct 17, 2026
+"""
+import argparse
+import logging
+import struct
+import time
+
+import emews.base.baseserv
+import emews.base.enums
+import emews.base.logger
+import emews.base.netclient
+import emews.base.netserv
+import emews.base.sysprop
+import emews.base.thread_dispatcher
+
+PROTOCOLS = [
+    ('LLL', [1, 2, 3]),
+    ('LsL', [1, 'crawl_site', 1234]),
+]
+
+
+def _encode_legacy(protocol, val_list):
+    """Encode a query building the format string on each call."""
+    send_vals = [protocol.request_id]
+    send_vals.extend(val_list)
+    query_format_str, send_vals = emews.base.baseserv.build_query(
+        'H%s' % protocol.format_string, send_vals)
+    return struct.pack(query_format_str, *send_vals)
+
+
+def bench_encode(encode_fn, protocol, val_list, num_frames):
+    """Return encoded frames per second."""
+    start_time = time.time()
+    for _ in xrange(num_frames):
+        encode_fn(protocol, val_list)
+
+    return num_frames / (time.time() - start_time)
+
+
+def bench_decode(net_serv, protocol, val_list, num_frames):
+    """Return decoded frames per second (NetServ driven over a buffer of pipelined frames)."""
+    handler = emews.base.baseserv.Handler(protocol, None)
+    handler.callback = lambda session_id, *args: (emews.base.enums.net_state.STATE_ACK, handler)
+    handler.protocol = emews.base.baseserv.NetProto('', type_return='H')
+
+    # the request id is not part of the handler's fields (QueryServ consumes it)
+    frame = protocol.encode_query(val_list)[2:]
+    recv_view = memoryview(bytearray(frame * num_frames))
+
+    net_serv.handle_init(1, 0x7f000001)
+    ret_tup = net_serv._new_handler_invocation(1, handler)
+
+    start = 0
+    start_time = time.time()
+    end = len(recv_view)
+    while end - start >= ret_tup[1]:
+        expected_bytes = ret_tup[1]
+        ret_tup = ret_tup[0](1, recv_view, start)
+        start += expected_bytes
+    elapsed = time.time() - start_time
+
+    net_serv.handle_close(1)
+
+    return num_frames / elapsed
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description='eMews protocol codec microbenchmark')
+    parser.add_argument("-n", "--frames", type=int, default=200000,
+                        help="frames per measurement (default: 200000)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    emews.base.logger._base_logger = logging.LoggerAdapter(logging.getLogger('emews.bench'), {})
+
+    sys_prop = emews.base.sysprop.SysProp(
+        node_name='bench', node_id=2, root_path='', is_hub=False, local=False)
+    thread_dispatcher = emews.base.thread_dispatcher.ThreadDispatcher(
+        {'thread_shutdown_wait': 1, 'halt_on_service_exceptions': False, 'service_start_delay': -1},
+        _inject={'sys': sys_prop})
+    net_client = emews.base.netclient.NetClient(
+        {'port': 32518, 'connect_timeout': 1, 'response_timeout': 1, 'connect_max_attempts': 1,
+         'wire_protocol': 2, 'hub_multiplex': True, 'pool_max_idle': 0, 'pool_idle_timeout': 0,
+         'poll_backend': 'auto', 'reconnect_backoff_base': 0.1, 'reconnect_backoff_max': 10,
+         'circuit_failure_threshold': 0, 'circuit_reset_timeout': 30, 'service_id_lease_max': 0},
+        '127.0.0.1',
+        _inject={'sys': sys_prop})
+    net_serv = emews.base.netserv.NetServ(
+        {'raise_on_servicebuilder_exceptions': False, 'offload_threads': 0,
+         'offload_queue_size': 0}, thread_dispatcher, net_client,
+        _inject={'sys': sys_prop})
+
+    print "%-8s %24s %24s %18s" % ('format', 'legacy encode frames/s', 'compiled encode frames/s',
+                                   'decode frames/s')
+    for format_str, val_list in PROTOCOLS:
+        protocol = emews.base.baseserv.NetProto(
+            format_str, type_return='H', proto_id=emews.base.enums.net_protocols.NET_AGENT,
+            request_id=emews.base.enums.agent_protocols.AGENT_TELL)
+        print "%-8s %24.0f %24.0f %18.0f" % (
+            format_str,
+            bench_encode(_encode_legacy, protocol, val_list, args.frames),
+            bench_encode(lambda proto, vals: proto.encode_query(vals), protocol, val_list,
+                         args.frames),
+            bench_decode(net_serv, protocol, val_list, args.frames))
+
+
+if __name__ == '__main__':
+    main()
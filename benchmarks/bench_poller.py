@@ -0,0 +1,109 @@
+"""
+Benchmark of the ConnectionManager poll backends (select vs epoll).
+
+Each session is one end of a socketpair registered with the poller under test.  In 'idle' mode a
+single random session becomes readable per loop iteration (the common hub case: many persistent,
+mostly quiet sessions).  In 'active' mode every session is readable on every iteration.  Reported
+times are per poll loop iteration, and per ready event.
+
+Run from a path where the emews package is importable, for example:
+  PYTHONPATH=src python benchmarks/bench_poller.py
+
+Created on Oct 17, 2026
+"""
+import argparse
+import random
+import resource
+import socket
+import time
+
+import emews.base.poller
+
+
+def _raise_fd_limit(num_fds):
+    """Raise the soft fd limit (if needed and allowed), return the resulting soft limit."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < num_fds:
+        new_soft = num_fds if hard == resource.RLIM_INFINITY else min(num_fds, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (new_soft, hard))
+        soft = new_soft
+
+    return soft
+
+
+def run(backend, num_sessions, mode, iterations):
+    """Run one benchmark configuration, return (usec per iteration, usec per event) or None."""
+    poller = emews.base.poller.get_poller(backend)
+    pairs = []
+    readers = {}
+
+    try:
+        for _ in xrange(num_sessions):
+            serv_sock, client_sock = socket.socketpair()
+            serv_sock.setblocking(0)
+            pairs.append((serv_sock, client_sock))
+            try:
+                poller.register(serv_sock.fileno(), emews.base.poller.PollEvents.POLL_READ)
+            except ValueError:
+                # backend cannot manage this many fds
+                return None
+            readers[serv_sock.fileno()] = serv_sock
+
+        num_events = 0
+        start_time = time.time()
+        for _ in xrange(iterations):
+            if mode == 'idle':
+                pairs[random.randrange(num_sessions)][1].send('x')
+            else:
+                for _, client_sock in pairs:
+                    client_sock.send('x')
+
+            pending = 1 if mode == 'idle' else num_sessions
+            while pending:
+                for fd, _ in poller.poll():
+                    readers[fd].recv(64)
+                    pending -= 1
+                    num_events += 1
+        elapsed = time.time() - start_time
+    finally:
+        poller.close()
+        for serv_sock, client_sock in pairs:
+            serv_sock.close()
+            client_sock.close()
+
+    return (elapsed * 1e6 / iterations, elapsed * 1e6 / num_events)
+
+
+def main():
+    """Run the benchmark matrix."""
+    parser = argparse.ArgumentParser(description='eMews poll backend benchmark')
+    parser.add_argument("-s", "--sessions", type=int, nargs='+', default=[100, 1000, 5000],
+                        help="session counts to benchmark (default: 100 1000 5000)")
+    parser.add_argument("-i", "--iterations", type=int, default=2000,
+                        help="poll loop iterations per idle run (active runs use 1/10th)")
+    parser.add_argument("-b", "--backends", nargs='+', default=['select', 'epoll'],
+                        help="poll backends to benchmark (default: select epoll)")
+    args = parser.parse_args()
+
+    fd_limit = _raise_fd_limit(2 * max(args.sessions) + 64)
+
+    print "%-8s %8s %8s %16s %16s" % ('backend', 'sessions', 'mode', 'usec/iteration', 'usec/event')
+    for num_sessions in args.sessions:
+        if 2 * num_sessions + 64 > fd_limit:
+            print "skipping %d sessions: fd limit is %d" % (num_sessions, fd_limit)
+            continue
+
+        for mode in ('idle', 'active'):
+            iterations = args.iterations if mode == 'idle' else max(1, args.iterations / 10)
+            for backend in args.backends:
+                result = run(backend, num_sessions, mode, iterations)
+                if result is None:
+                    print "%-8s %8d %8s %16s %16s" % (
+                        backend, num_sessions, mode, 'unsupported', 'unsupported')
+                else:
+                    print "%-8s %8d %8s %16.1f %16.2f" % (
+                        backend, num_sessions, mode, result[0], result[1])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,439 @@
+"""
+Protocol layer microbenchmark and fuzz harness of the hub NetServ / ConnectionManager.
+
+Each session is one end of a socketpair handed to a hub ConnectionManager (its poll loop is not
+run, the session is driven directly as if it were readable).  Synthetic byte streams are written to
+the other end, and the responses drained, for every net protocol:
+- hub_id: node id request (HUB_NODE_ID_REQ, ends the session)
+- agent_ask / agent_tell: agent evidence and observation requests (SiteCrawlerAgent environment)
+- logging: pickled log records, as sent by DistLogger
+- spawn: service launch request (SPAWNER_LAUNCH_SERVICE, of a service which does not exist)
+
+Requests are delivered in three modes:
+- single: one request written and processed at a time
+- pipelined: many requests written (and read by the ConnectionManager) at once
+- fragmented: the request stream delivered a few bytes at a time
+Requests ending their session (hub_id) cannot be pipelined, each of them is a new session
+(its setup and teardown are part of the cost per frame).
+
+Reported per request (frame), for each wire protocol version:
+- ns/frame: wall time
+- objs/frame: GC-tracked objects (containers) left allocated per frame, with the cyclic collector
+  disabled.  Objects freed by reference counting are not counted, so this shows garbage only the
+  collector reclaims (reference cycles) and state retained per request.  Python 2 has no
+  allocation counter outside of debug builds.
+- check: 'ok' if the number of handler invocations is the number of frames sent
+
+With --fuzz, valid session streams are randomly mutated (bytes flipped, truncated, duplicated,
+inserted) and delivered in random fragments instead.  The ConnectionManager buffer accounting and
+session bookkeeping are checked after every fragment, and exceptions raised out of the
+ConnectionManager are reported by type.  The exit status is non-zero if an invariant fails.
+
+Run from a path where the emews package is importable, for example:
+  PYTHONPATH=src python benchmarks/bench_protocols.py
+  PYTHONPATH=src python benchmarks/bench_protocols.py --fuzz 2000 --seed 1
+
+Created on Oct 17, 2026
+"""
+import argparse
+import collections
+import errno
+import gc
+import logging
+import os
+import pickle
+import random
+import socket
+import sys
+import time
+
+import emews
+import emews.base.baseserv
+import emews.base.connectionmanager
+import emews.base.enums
+import emews.base.logger
+import emews.base.netclient
+import emews.base.netserv
+import emews.base.sysprop
+import emews.base.thread_dispatcher
+
+SCENARIOS = ('hub_id', 'agent_ask', 'agent_tell', 'logging', 'spawn')
+MODES = ('single', 'pipelined', 'fragmented')
+PIPELINE_CHUNK_SIZE = 32768  # max bytes written at once in pipelined mode
+FRAGMENT_SIZE = 7            # bytes written at once in fragmented mode
+ENV_NAME = 'SiteCrawlerAgent'
+
+
+class Scenario(object):
+    """Byte streams of a protocol scenario, for a wire protocol version."""
+
+    __slots__ = ('name', 'proto_id', 'setup', 'frame', 'ends_session')
+
+    def __init__(self, name, wire_protocol):
+        """Constructor."""
+        self.name = name
+        protocols = emews.base.baseserv.BaseServ.protocols
+        agent_protos = protocols[emews.base.enums.net_protocols.NET_AGENT]
+        framed = wire_protocol == 2
+        requests = []  # (protocol, val_list) of the setup requests
+        self.ends_session = False
+
+        if name == 'hub_id':
+            self.proto_id = emews.base.enums.net_protocols.NET_HUB
+            request = (protocols[self.proto_id][emews.base.enums.hub_protocols.HUB_NODE_ID_REQ],
+                       [])
+            self.ends_session = True
+        elif name == 'agent_ask':
+            self.proto_id = emews.base.enums.net_protocols.NET_AGENT
+            requests.append((agent_protos[emews.base.enums.agent_protocols.AGENT_ENV_ID],
+                             [ENV_NAME]))
+            request = (agent_protos[emews.base.enums.agent_protocols.AGENT_ASK_ARRAY],
+                       [1, 'viral_links'])
+        elif name == 'agent_tell':
+            self.proto_id = emews.base.enums.net_protocols.NET_AGENT
+            requests.append((agent_protos[emews.base.enums.agent_protocols.AGENT_ENV_ID],
+                             [ENV_NAME]))
+            requests.append((agent_protos[emews.base.enums.agent_protocols.AGENT_TELL],
+                             [1, 'crawl_site', 1234]))
+            request = (agent_protos[emews.base.enums.agent_protocols.AGENT_TELL],
+                       [1, 'link_clicked', 3])
+        elif name == 'logging':
+            self.proto_id = emews.base.enums.net_protocols.NET_LOGGING
+            record = logging.LogRecord('bench', logging.INFO, __file__, 1, 'record %d', (42,),
+                                       None)
+            record_data = pickle.dumps(record.__dict__, 1)
+            frame = emews.base.baseserv.FRAME_LEN_STRUCT.pack(len(record_data)) + record_data
+            self.frame = emews.base.baseserv.encode_frame(frame) if framed else frame
+            request = None
+        elif name == 'spawn':
+            self.proto_id = emews.base.enums.net_protocols.NET_SPAWN
+            request = (protocols[self.proto_id][
+                emews.base.enums.spawner_protocols.SPAWNER_LAUNCH_SERVICE],
+                       ['BenchNoService', 'bench.yml'])
+        else:
+            raise ValueError("Unknown scenario: %s" % name)
+
+        header_proto_id = self.proto_id
+        if framed:
+            header_proto_id |= emews.base.enums.net_flags.NET_FLAG_V2
+        self.setup = emews.base.baseserv.HEADER_STRUCT.pack(header_proto_id, 0) + ''.join(
+            protocol.encode_query_frame(vals) if framed else protocol.encode_query(vals)
+            for protocol, vals in requests)
+
+        if request is not None:
+            self.frame = request[0].encode_query_frame(request[1]) if framed else \
+                request[0].encode_query(request[1])
+
+
+class Harness(object):
+    """A hub ConnectionManager whose sessions are socketpairs driven by the caller."""
+
+    __slots__ = ('conn_manager', 'net_cache')
+
+    def __init__(self):
+        """Constructor."""
+        sys_prop = emews.base.sysprop.SysProp(
+            node_name='hub', node_id=1, root_path=os.path.dirname(emews.__file__), is_hub=True,
+            local=False)
+        comm_config = {
+            'port': 32518,
+            'connect_timeout': 1,
+            'response_timeout': 1,
+            'connect_max_attempts': 1,
+            'reconnect_backoff_base': 0.1,
+            'reconnect_backoff_max': 10,
+            'circuit_failure_threshold': 0,
+            'circuit_reset_timeout': 30,
+            'service_id_lease_max': 64,
+            'listen_backlog': 1024,
+            'unix_socket_path': None,
+            'wire_protocol': 2,
+            'hub_multiplex': False,
+            'read_ahead_size': 65536,
+            'poll_backend': 'auto',
+            'session_idle_timeout': -1,  # the poll loop (and its timers) is not run
+            'session_read_timeout': -1,
+            'session_write_timeout': -1,
+            'session_buffer_limit': 1048576,
+            'global_buffer_limit': 67108864,
+            'max_field_size': 1048576,
+            'offload_threads': 0,  # handlers run inline, the protocol layer is measured
+            'offload_queue_size': 0,
+            'pool_max_idle': 0,
+            'pool_idle_timeout': 0,
+            'raise_on_servicebuilder_exceptions': False,
+            'halt_on_service_exceptions': False,
+        }
+
+        thread_dispatcher = emews.base.thread_dispatcher.ThreadDispatcher(
+            {'thread_shutdown_wait': 1, 'halt_on_service_exceptions': False,
+             'service_start_delay': -1},
+            _inject={'sys': sys_prop})
+        net_client = emews.base.netclient.NetClient(
+            comm_config, '127.0.0.1', _inject={'sys': sys_prop})
+        self.conn_manager = emews.base.connectionmanager.ConnectionManager(
+            comm_config, thread_dispatcher, net_client, _inject={'sys': sys_prop})
+        self.net_cache = self.conn_manager._net_serv._net_cache
+
+    def open_session(self):
+        """Return (sock state, client socket) of a new session."""
+        serv_sock, client_sock = socket.socketpair()
+        serv_sock.setblocking(0)
+        client_sock.setblocking(0)
+        self.conn_manager._accept_connection(serv_sock, None)
+
+        return self.conn_manager._socks[serv_sock.fileno()], client_sock
+
+    def is_open(self, sock_state):
+        """Return True if the session is still managed."""
+        sock = sock_state[emews.base.connectionmanager.SockState.SOCK_SOCKET]
+        try:
+            return self.conn_manager._socks.get(sock.fileno(), None) is sock_state
+        except socket.error:
+            return False
+
+    def close_session(self, sock_state, client_sock):
+        """Close a session (if the server has not already)."""
+        if self.is_open(sock_state):
+            self.conn_manager._close_socket(
+                sock_state[emews.base.connectionmanager.SockState.SOCK_SOCKET])
+        client_sock.close()
+
+    def feed(self, sock_state, client_sock, data):
+        """Deliver data to the session, and drain its responses.  Returns False once closed."""
+        if not self.is_open(sock_state):
+            return False
+
+        client_sock.sendall(data)
+        self.conn_manager._readable_socket(sock_state)
+        _drain(client_sock)
+
+        return self.is_open(sock_state)
+
+    def handler_calls(self, proto_id):
+        """Return the number of handler invocations so far of a net protocol."""
+        return int(self.net_cache.traffic()[0][proto_id][
+            emews.base.netserv.TrafficStats.STAT_HANDLER_CALLS])
+
+    def check_invariants(self):
+        """Return a list of broken invariants of the ConnectionManager bookkeeping."""
+        errors = []
+        conn_manager = self.conn_manager
+        buffered = sum(sock_state[emews.base.connectionmanager.SockState.SOCK_SEND_BYTES] +
+                       sock_state[emews.base.connectionmanager.SockState.SOCK_RECV_BYTES]
+                       for sock_state in conn_manager._socks.itervalues())
+        if buffered != conn_manager._buffered_bytes:
+            errors.append("buffered bytes: %d accounted, %d held by sessions" % (
+                conn_manager._buffered_bytes, buffered))
+
+        sessions = set(sock_state[emews.base.connectionmanager.SockState.SOCK_SESSION_ID]
+                       for sock_state in conn_manager._socks.itervalues())
+        orphans = [session_id for session_id in self.net_cache.session
+                   if session_id < emews.base.netserv.NetServ.CHANNEL_SESSION_ID_BASE and
+                   session_id not in sessions]
+        if orphans:
+            errors.append("sessions left in the net cache: %s" % orphans)
+
+        return errors
+
+
+def _drain(client_sock):
+    """Read all responses available on a (non-blocking) client socket."""
+    while True:
+        try:
+            if not client_sock.recv(65536):
+                return
+        except socket.error as ex:
+            if ex.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            raise
+
+
+def _chunks(data, chunk_size):
+    """Return data split in chunks of chunk_size bytes."""
+    return [data[offset:offset + chunk_size] for offset in xrange(0, len(data), chunk_size)]
+
+
+def run(harness, scenario, mode, num_frames):
+    """Run one benchmark configuration, return (ns per frame, objs per frame, check) or None."""
+    if mode == 'pipelined' and scenario.ends_session:
+        return None
+
+    calls_before = harness.handler_calls(scenario.proto_id)
+    if not scenario.ends_session:
+        sock_state, client_sock = harness.open_session()
+        harness.feed(sock_state, client_sock, scenario.setup)
+        calls_before = harness.handler_calls(scenario.proto_id)
+
+        if mode == 'single':
+            chunks = [scenario.frame] * num_frames
+        elif mode == 'pipelined':
+            frames_per_chunk = max(1, min(num_frames, PIPELINE_CHUNK_SIZE / len(scenario.frame)))
+            chunks = [scenario.frame * frames_per_chunk] * (num_frames / frames_per_chunk)
+            num_frames = frames_per_chunk * len(chunks)
+        else:
+            chunks = _chunks(scenario.frame * num_frames, FRAGMENT_SIZE)
+    elif mode == 'single':
+        chunks = [scenario.setup + scenario.frame]
+    else:
+        chunks = _chunks(scenario.setup + scenario.frame, FRAGMENT_SIZE)
+
+    gc.collect()
+    gc.disable()
+    try:
+        num_objs = gc.get_count()[0]
+        start_time = time.time()
+        if scenario.ends_session:
+            for _ in xrange(num_frames):
+                sock_state, client_sock = harness.open_session()
+                for chunk in chunks:
+                    harness.feed(sock_state, client_sock, chunk)
+                harness.close_session(sock_state, client_sock)
+        else:
+            for chunk in chunks:
+                harness.feed(sock_state, client_sock, chunk)
+        elapsed = time.time() - start_time
+        num_objs = gc.get_count()[0] - num_objs
+    finally:
+        gc.enable()
+
+    if not scenario.ends_session:
+        harness.close_session(sock_state, client_sock)
+
+    num_calls = harness.handler_calls(scenario.proto_id) - calls_before
+    # QueryServ sessions invoke the query (request id) handler before the request handler
+    calls_per_frame = 1 if scenario.name == 'logging' else 2
+    check = 'ok' if num_calls == calls_per_frame * num_frames else \
+        'FAIL (%d calls)' % num_calls
+
+    return (elapsed * 1e9 / num_frames, float(num_objs) / num_frames, check)
+
+
+def _mutate(rnd, data):
+    """Return data randomly mutated."""
+    data = bytearray(data)
+    for _ in xrange(rnd.randint(1, 4)):
+        operation = rnd.randrange(5)
+        pos = rnd.randrange(len(data)) if data else 0
+        if operation == 0 and data:
+            data[pos] ^= 1 << rnd.randrange(8)
+        elif operation == 1 and data:
+            data[pos] = rnd.randrange(256)
+        elif operation == 2:
+            del data[rnd.randrange(len(data) + 1):]
+        elif operation == 3:
+            data[pos:pos] = data[pos:pos + rnd.randint(1, 16)]
+        else:
+            data[pos:pos] = bytearray(rnd.randrange(256) for _ in xrange(rnd.randint(1, 8)))
+
+    return str(data)
+
+
+def fuzz(harness, iterations, seed, wire_protocols):
+    """
+    Run the fuzz harness, return the number of failures.
+
+    Handler exceptions end their session (see NetServ._run_handler), so an exception raised out of
+    the ConnectionManager is a failure, as is a broken invariant.
+    """
+    rnd = random.Random(seed)
+    scenarios = [Scenario(name, wire_protocol)
+                 for name in SCENARIOS for wire_protocol in wire_protocols]
+    exceptions = collections.Counter()  # [exception type]: count
+    examples = {}  # [exception type]: first exception message
+    num_closed = 0
+    num_failures = 0
+
+    for iteration in xrange(iterations):
+        scenario = rnd.choice(scenarios)
+        data = _mutate(rnd, scenario.setup + scenario.frame * rnd.randint(1, 4))
+        sock_state, client_sock = harness.open_session()
+
+        offset = 0
+        while offset < len(data):
+            chunk_size = rnd.randint(1, 64)
+            try:
+                if not harness.feed(sock_state, client_sock, data[offset:offset + chunk_size]):
+                    num_closed += 1
+                    break
+            except Exception as ex:
+                # raised out of the ConnectionManager
+                exceptions[ex.__class__.__name__] += 1
+                examples.setdefault(ex.__class__.__name__, repr(str(ex)))
+                num_failures += 1
+                print "iteration %d (seed %d, %s): %s: %s" % (
+                    iteration, seed, scenario.name, ex.__class__.__name__, ex)
+                break
+            finally:
+                errors = harness.check_invariants()
+                if errors:
+                    num_failures += 1
+                    print "iteration %d (seed %d, %s): %s" % (
+                        iteration, seed, scenario.name, '; '.join(errors))
+            offset += chunk_size
+
+        harness.close_session(sock_state, client_sock)
+
+    errors = harness.check_invariants()
+    if errors or harness.conn_manager._buffered_bytes:
+        num_failures += 1
+        print "after all sessions closed: %s (buffered bytes: %d)" % (
+            '; '.join(errors), harness.conn_manager._buffered_bytes)
+
+    print "%d sessions, %d closed by the server, %d failures" % (
+        iterations, num_closed, num_failures)
+    for name, count in exceptions.most_common():
+        print "%6d x %s (first: %s)" % (count, name, examples[name])
+
+    return num_failures
+
+
+def main():
+    """Run the benchmark matrix (or the fuzz harness)."""
+    parser = argparse.ArgumentParser(description='eMews protocol layer benchmark')
+    parser.add_argument("-n", "--frames", type=int, default=20000,
+                        help="frames per measurement (default: 20000, fragmented mode and "
+                        "session ending scenarios use 1/10th)")
+    parser.add_argument("-s", "--scenarios", nargs='+', default=list(SCENARIOS),
+                        choices=SCENARIOS, help="scenarios to benchmark (default: all)")
+    parser.add_argument("-m", "--modes", nargs='+', default=list(MODES), choices=MODES,
+                        help="delivery modes to benchmark (default: all)")
+    parser.add_argument("-w", "--wire", type=int, nargs='+', default=[1, 2], choices=[1, 2],
+                        help="wire protocol versions to benchmark (default: 1 2)")
+    parser.add_argument("--fuzz", type=int, default=0, metavar='SESSIONS',
+                        help="run the fuzz harness over this many sessions instead")
+    parser.add_argument("--seed", type=int, default=0, help="fuzz harness random seed")
+    args = parser.parse_args()
+
+    # handler output (warnings on malformed data, handled log records) is not shown
+    bench_logger = logging.getLogger('emews.bench')
+    bench_logger.addHandler(logging.NullHandler())
+    bench_logger.propagate = False
+    emews.base.logger._base_logger = logging.LoggerAdapter(bench_logger, {})
+
+    harness = Harness()
+
+    if args.fuzz:
+        sys.exit(1 if fuzz(harness, args.fuzz, args.seed, args.wire) else 0)
+
+    print "%-11s %4s %-10s %8s %12s %11s %6s" % (
+        'scenario', 'wire', 'mode', 'frames', 'ns/frame', 'objs/frame', 'check')
+    for name in args.scenarios:
+        for wire_protocol in args.wire:
+            scenario = Scenario(name, wire_protocol)
+            for mode in args.modes:
+                num_frames = args.frames
+                if mode == 'fragmented' or scenario.ends_session:
+                    num_frames = max(1, num_frames / 10)
+
+                result = run(harness, scenario, mode, num_frames)
+                if result is None:
+                    print "%-11s %4d %-10s %8s %12s %11s %6s" % (
+                        name, wire_protocol, mode, '-', '-', '-', '-')
+                else:
+                    print "%-11s %4d %-10s %8d %12.0f %11.3f %6s" % (
+                        name, wire_protocol, mode, num_frames, result[0], result[1], result[2])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,748 @@
+"""
+Asynchronous client requests, run by a single I/O thread per node.
+
+Requests may be submitted from any thread, and return a ClientFuture right away.  The I/O thread
+owns the connections: a single pipelined session per destination address, server protocol and node
+id, shared by all requests to them.  Requests are written as soon as they are submitted, and
+responses are matched to their requests as they arrive, so any number of requests may be outstanding
+at once.  Connections are established without blocking the I/O thread.  If a connection is lost (or
+no response arrives in time) while requests are outstanding, they are re-sent on a new connection
+(backing off if lost again), up to max_attempts times each.  Requests which may have reached the
+server are only re-sent if marked idempotent, the others fail.  Sessions ended by the server are
+re-established on the next request.
+
+Created on Oct 17, 2026
+"""
+import errno
+import fcntl
+import os
+import socket
+import struct
+import threading
+import time
+
+import emews.base.baseobject
+import emews.base.baseserv
+import emews.base.logger
+import emews.base.poller
+
+_FUTURE_LOCK = threading.Lock()  # guards the completion of all futures (held briefly)
+
+
+class ClientFuture(object):
+    """
+    Result of an asynchronous request.
+
+    Callbacks are called with the future once it is done, from the thread completing it (usually
+    the I/O thread of AsyncClient), so they should not block.  Callbacks added once the future is
+    done are called right away.
+    """
+
+    __slots__ = ('_done', '_result', '_exception', '_callbacks', '_event')
+
+    def __init__(self):
+        """Constructor."""
+        self._done = False
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+        self._event = None  # created by the first thread waiting on the future
+
+    def done(self):
+        """Return True if the future is done."""
+        return self._done
+
+    def _wait(self, timeout):
+        """Wait until the future is done.  Raises socket.timeout if not done within timeout."""
+        if self._done:
+            return
+
+        with _FUTURE_LOCK:
+            if not self._done and self._event is None:
+                self._event = threading.Event()
+            event = self._event
+
+        if event is not None:
+            event.wait(timeout)
+
+        if not self._done:
+            raise socket.timeout("Request not done within %s seconds." % timeout)
+
+    def result(self, timeout=None):
+        """
+        Return the result, waiting up to timeout seconds (None waits until done).
+
+        Raises the exception of the request if it failed.
+        """
+        self._wait(timeout)
+        if self._exception is not None:
+            raise self._exception
+
+        return self._result
+
+    def exception(self, timeout=None):
+        """Return the exception of the request (None if it succeeded), see result()."""
+        self._wait(timeout)
+        return self._exception
+
+    def add_done_callback(self, fn):
+        """Add a callable, called with the future once it is done."""
+        with _FUTURE_LOCK:
+            if not self._done:
+                self._callbacks.append(fn)
+                return
+
+        self._run_callback(fn)
+
+    def chain(self, fn):
+        """
+        Return a new future, done with fn(result) once this future is done.
+
+        If this future failed, or fn raises, the new future fails with the exception.
+        """
+        chained = ClientFuture()
+
+        def _chain_done(future):
+            """Complete the chained future."""
+            if future._exception is not None:
+                chained.set_exception(future._exception)
+                return
+
+            try:
+                result = fn(future._result)
+            except StandardError as ex:
+                chained.set_exception(ex)
+                return
+
+            chained.set_result(result)
+
+        self.add_done_callback(_chain_done)
+        return chained
+
+    def set_result(self, result):
+        """Complete the future with a result."""
+        self._complete(result, None)
+
+    def set_exception(self, exception):
+        """Complete the future with an exception."""
+        self._complete(None, exception)
+
+    def _complete(self, result, exception):
+        """Complete the future, waking up waiting threads and calling callbacks."""
+        with _FUTURE_LOCK:
+            if self._done:
+                raise ValueError("Future is already done.")
+
+            self._result = result
+            self._exception = exception
+            self._done = True
+            callbacks = self._callbacks
+            self._callbacks = None
+            event = self._event
+
+        if event is not None:
+            event.set()
+
+        for fn in callbacks:
+            self._run_callback(fn)
+
+    def _run_callback(self, fn):
+        """Call a callback, logging any exception it raises."""
+        try:
+            fn(self)
+        except StandardError:
+            emews.base.logger.get_logger().exception("Exception raised by a request callback.")
+
+
+class AsyncRequest(object):
+    """A submitted request, until its response is received."""
+
+    __slots__ = ('protocol', 'query', 'idempotent', 'future', 'attempts', 'offset')
+
+    def __init__(self, protocol, query, idempotent=False):
+        """Constructor."""
+        self.protocol = protocol
+        self.query = query  # encoded request (not framed)
+        self.idempotent = idempotent  # may be re-sent once it may have reached the server
+        self.future = ClientFuture()
+        self.attempts = 0  # connections lost while outstanding
+        self.offset = 0  # offset of the request in the data queued on its connection
+
+    @property
+    def has_response(self):
+        """Return True if the server responds to the request."""
+        return self.protocol.return_type is not None and self.protocol.return_type != ''
+
+
+class AsyncConnection(object):
+    """A pipelined session of the I/O thread."""
+
+    __slots__ = ('key', 'sock', 'fd', 'connecting', 'send_buf', 'queued_bytes', 'sent_bytes',
+                 'recv_buf', 'pending', 'unsent', 'next_seq_id', 'resp_seq_id', 'last_active',
+                 'want_write')
+
+    def __init__(self, key, sock, header, connecting):
+        """Constructor."""
+        self.key = key
+        self.sock = sock
+        self.fd = sock.fileno()
+        self.connecting = connecting  # connection not established yet
+        self.send_buf = bytearray(header)  # session header, then requests not sent yet
+        self.queued_bytes = len(header)  # bytes queued to send since connecting
+        self.sent_bytes = 0  # bytes sent since connecting
+        self.recv_buf = bytearray()  # responses received, not complete yet
+        self.pending = {}  # [seq id]: request waiting on its response
+        self.unsent = []   # requests without a response, done once sent
+        self.next_seq_id = 0
+        self.resp_seq_id = 0  # seq id of the next response (v1 sessions, responses are in order)
+        self.last_active = time.time()  # last send progress or receive (request timeouts)
+        self.want_write = False  # fd polled for writes
+
+    @property
+    def outstanding(self):
+        """Return True if requests are outstanding (not sent, or waiting on their response)."""
+        return bool(self.pending or self.unsent)
+
+
+class AsyncClient(emews.base.baseobject.BaseObject):
+    """Classdocs."""
+
+    __slots__ = ('_sock_addr', '_session_header', '_framed', '_poll_backend', '_timeout',
+                 '_response_timeout', '_max_attempts', '_breakers', '_new_backoff', '_lock',
+                 '_submitted', '_retry', '_backoffs', '_closed', '_thread', '_wakeup_r',
+                 '_wakeup_w', '_poller', '_conns', '_fd_conns')
+
+    RECV_SIZE = 65536  # bytes read per recv()
+
+    def __init__(self, sock_addr, session_header, framed, poll_backend, timeout, response_timeout,
+                 max_attempts, breakers, new_backoff):
+        """
+        Constructor.
+
+        sock_addr is a callable given a destination address, returning the (socket family, socket
+        address) to connect to.  session_header is a callable given a server protocol and node id,
+        returning the header of a pipelined session.  timeout bounds connecting, and
+        response_timeout waiting on responses without any progress (-1 waits until the connection
+        is lost).  breakers are the CircuitBreakers of the NetClient (failed and lost connections
+        are failures of their node), and new_backoff is a callable returning a new
+        ReconnectBackoff.  The I/O thread is started on the first request.
+        """
+        super(AsyncClient, self).__init__()
+
+        self._sock_addr = sock_addr
+        self._session_header = session_header
+        self._framed = framed
+        self._poll_backend = poll_backend
+        self._timeout = timeout  # seconds to wait on connecting before giving up
+        self._response_timeout = response_timeout  # seconds to wait on responses (-1: no limit)
+        self._max_attempts = max_attempts
+        self._breakers = breakers
+        self._new_backoff = new_backoff
+
+        self._lock = threading.Lock()
+        self._submitted = []  # (key, request) submitted, not yet taken by the I/O thread
+        self._closed = False
+        self._thread = None
+
+        # I/O thread state
+        self._retry = []  # (time to re-send, key, request), their connection was lost
+        self._backoffs = {}  # [key]: ReconnectBackoff, connection lost since the last response
+        self._wakeup_r = None
+        self._wakeup_w = None
+        self._poller = None
+        self._conns = {}  # [key]: AsyncConnection
+        self._fd_conns = {}  # [fd]: AsyncConnection
+
+    def query(self, key, protocol, val_list, callback=None, idempotent=False):
+        """
+        Submit a request, return its ClientFuture.
+
+        key is the (destination address, server protocol, node id) of the session to send the
+        request on.  callback, if given, is added to the future (see ClientFuture).  If idempotent,
+        the request may be re-sent once it may have reached the server (its connection lost, or no
+        response in time), otherwise it fails then.
+        """
+        request = AsyncRequest(protocol, protocol.encode_query(val_list), idempotent)
+        if callback is not None:
+            request.future.add_done_callback(callback)
+
+        with self._lock:
+            if self._closed:
+                raise socket.error("Asynchronous client is closed.")
+
+            if self._thread is None:
+                self._start()
+
+            self._submitted.append((key, request))
+            if len(self._submitted) == 1:
+                # the I/O thread takes all submitted requests on a wakeup
+                self._wakeup()
+
+        return request.future
+
+    def _start(self):
+        """Start the I/O thread (self._lock held)."""
+        self._poller = emews.base.poller.get_poller(self._poll_backend)
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        for fd in (self._wakeup_r, self._wakeup_w):
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self._poller.register(self._wakeup_r, emews.base.poller.PollEvents.POLL_READ)
+
+        self._thread = threading.Thread(target=self._run, name='NetClient-IO')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _wakeup(self):
+        """Wake up the I/O thread (self._lock held, so the wakeup pipe is not closed meanwhile)."""
+        if self._wakeup_w is None:
+            # I/O thread shut down
+            return
+
+        try:
+            os.write(self._wakeup_w, '\0')
+        except OSError as ex:
+            if ex.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+    def close(self):
+        """Stop the I/O thread, failing all outstanding requests, and close its connections."""
+        with self._lock:
+            if self._closed:
+                return
+
+            self._closed = True
+            thread = self._thread
+            if thread is not None:
+                self._wakeup()
+
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(self._timeout)
+
+    def _run(self):
+        """I/O thread: send requests as submitted, and complete them as their responses arrive."""
+        try:
+            while True:
+                with self._lock:
+                    submitted = self._submitted
+                    self._submitted = []
+                    if self._closed:
+                        break
+
+                if self._retry:
+                    submitted = self._due_retries() + submitted
+
+                if submitted:
+                    self._send_requests(submitted)
+
+                for fd, events in self._poller.poll(self._poll_timeout()):
+                    if fd == self._wakeup_r:
+                        self._drain_wakeup()
+                        continue
+
+                    conn = self._fd_conns.get(fd, None)
+                    if conn is not None and conn.connecting:
+                        self._finish_connect(conn)
+                        continue
+
+                    if conn is not None and events & (emews.base.poller.PollEvents.POLL_READ |
+                                                      emews.base.poller.PollEvents.POLL_ERROR):
+                        self._read(conn)
+
+                    conn = self._fd_conns.get(fd, None)
+                    if conn is not None and events & emews.base.poller.PollEvents.POLL_WRITE:
+                        self._flush(conn)
+
+                self._check_timeouts()
+        except StandardError:
+            self.logger.exception("Asynchronous client I/O thread failed.")
+            with self._lock:
+                self._closed = True
+        finally:
+            self._shutdown()
+
+    def _due_retries(self):
+        """Return the (key, request) to re-send now, in the order their connections were lost."""
+        now = time.time()
+        due = [(key, request) for retry_time, key, request in self._retry if retry_time <= now]
+        if due:
+            self._retry = [retry for retry in self._retry if retry[0] > now]
+
+        return due
+
+    def _drain_wakeup(self):
+        """Read all wakeup bytes."""
+        try:
+            while os.read(self._wakeup_r, 4096):
+                pass
+        except OSError as ex:
+            if ex.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+    def _send_requests(self, submitted):
+        """Add requests to the send buffers of their connections, and send them."""
+        flush_conns = []
+        rejected = {}  # [key]: exception, keys whose circuit is open
+        connect_errors = {}  # [key]: (exception, requests), keys which could not be connected to
+        for key, request in submitted:
+            conn = self._conns.get(key, None)
+            if conn is None:
+                if key in rejected:
+                    request.future.set_exception(rejected[key])
+                    continue
+                elif key in connect_errors:
+                    connect_errors[key][1].append(request)
+                    continue
+
+                try:
+                    conn = self._open(key)
+                except socket.error as ex:
+                    connect_errors[key] = (ex, [request])
+                    continue
+                except IOError as ex:
+                    rejected[key] = ex
+                    request.future.set_exception(ex)
+                    continue
+
+            if not conn.outstanding:
+                conn.last_active = time.time()
+
+            if request.has_response:
+                seq_id = conn.next_seq_id
+                conn.next_seq_id = (seq_id + 1) & 0xffffffff
+                conn.pending[seq_id] = request
+            else:
+                # v1 sessions count responses, so requests without one don't take a seq id
+                seq_id = conn.next_seq_id if self._framed else None
+                if self._framed:
+                    conn.next_seq_id = (seq_id + 1) & 0xffffffff
+                conn.unsent.append(request)
+
+            request.offset = conn.queued_bytes
+            if self._framed:
+                data = emews.base.baseserv.encode_frame(request.query, seq_id)
+            else:
+                data = request.query
+            conn.send_buf.extend(data)
+            conn.queued_bytes += len(data)
+
+            if conn not in flush_conns:
+                flush_conns.append(conn)
+
+        for key, (ex, requests) in connect_errors.iteritems():
+            self.logger.debug("Could not connect to node at address %s: %s", str(key[0]), ex)
+            self._requests_lost(key, requests, ex)
+
+        # requests submitted together are sent together
+        for conn in flush_conns:
+            if self._fd_conns.get(conn.fd, None) is conn and conn.send_buf and \
+                    not conn.connecting:
+                self._flush(conn)
+
+    def _open(self, key):
+        """
+        Return a new connection for key (destination address, server protocol, node id).
+
+        The connection is established without blocking: until it is, the socket is polled for
+        writes (see _finish_connect).  Raises IOError if the circuit of the node is open, or
+        socket.error if the connection attempt failed right away.
+        """
+        addr, serv_proto, node_id = key
+        if not self._breakers.allow(addr):
+            raise IOError("Circuit to node at address %s is open, not connecting." % str(addr))
+
+        sock_family, sock_addr = self._sock_addr(addr)
+        sock = socket.socket(sock_family, socket.SOCK_STREAM)
+        sock.setblocking(0)
+        if sock_family == socket.AF_INET:
+            # requests are sent as submitted, don't let Nagle hold them back
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        err = sock.connect_ex(sock_addr)
+        if err not in (0, errno.EINPROGRESS):
+            sock.close()
+            self._breakers.count('connect_failures')
+            raise socket.error(err, os.strerror(err))
+
+        conn = AsyncConnection(key, sock, self._session_header(serv_proto, node_id), err != 0)
+        self._conns[key] = conn
+        self._fd_conns[conn.fd] = conn
+
+        if conn.connecting:
+            conn.want_write = True
+            self._poller.register(conn.fd, emews.base.poller.PollEvents.POLL_WRITE)
+        else:
+            self._poller.register(conn.fd, emews.base.poller.PollEvents.POLL_READ)
+            self.logger.debug("Asynchronous session established to node address '%s'.", str(addr))
+
+        return conn
+
+    def _finish_connect(self, conn):
+        """The socket of a connection being established is ready, send its requests if connected."""
+        err = conn.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if err:
+            self._breakers.count('connect_failures')
+            self._conn_lost(conn, socket.error(err, os.strerror(err)))
+            return
+
+        conn.connecting = False
+        conn.want_write = False
+        self._poller.modify(conn.fd, emews.base.poller.PollEvents.POLL_READ)
+        self.logger.debug("Asynchronous session established to node address '%s'.",
+                          str(conn.key[0]))
+        self._flush(conn)
+
+    def _flush(self, conn):
+        """Send as much of the send buffer as the socket accepts."""
+        try:
+            sent = conn.sock.send(conn.send_buf)
+        except socket.error as ex:
+            if ex.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                self._conn_lost(conn, ex)
+                return
+            sent = 0
+
+        if sent:
+            del conn.send_buf[:sent]
+            conn.sent_bytes += sent
+            conn.last_active = time.time()
+
+        want_write = bool(conn.send_buf)
+        if want_write != conn.want_write:
+            conn.want_write = want_write
+            self._poller.modify(conn.fd, emews.base.poller.PollEvents.POLL_READ |
+                                (emews.base.poller.PollEvents.POLL_WRITE if want_write else 0))
+
+        if not want_write and conn.unsent:
+            unsent = conn.unsent
+            conn.unsent = []
+            for request in unsent:
+                request.future.set_result(None)
+
+    def _read(self, conn):
+        """Receive responses of the connection, completing their requests."""
+        try:
+            data = conn.sock.recv(AsyncClient.RECV_SIZE)
+        except socket.error as ex:
+            if ex.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                self._conn_lost(conn, ex)
+            return
+
+        if not data:
+            self._conn_lost(conn, None)
+            return
+
+        conn.last_active = time.time()
+        conn.recv_buf.extend(data)
+        if conn.key in self._backoffs:
+            del self._backoffs[conn.key]
+
+        try:
+            if self._framed:
+                consumed = self._read_frames(conn)
+            else:
+                consumed = self._read_responses(conn)
+        except struct.error as ex:
+            self._conn_lost(conn, socket.error("Unexpected response data: %s" % ex))
+            return
+
+        if consumed:
+            del conn.recv_buf[:consumed]
+            self._breakers.success(conn.key[0])
+
+    def _read_frames(self, conn):
+        """Complete the requests of all v2 response frames received, return the bytes consumed."""
+        recv_buf = conn.recv_buf
+        recv_view = memoryview(recv_buf)
+        len_size = emews.base.baseserv.FRAME_LEN_STRUCT.size
+        seq_size = emews.base.baseserv.SEQ_ID_STRUCT.size
+        offset = 0
+        while len(recv_buf) - offset >= len_size:
+            frame_end = offset + len_size + \
+                emews.base.baseserv.FRAME_LEN_STRUCT.unpack_from(recv_buf, offset)[0]
+            if len(recv_buf) < frame_end:
+                break
+
+            seq_id = emews.base.baseserv.SEQ_ID_STRUCT.unpack_from(recv_buf, offset + len_size)[0]
+            request = conn.pending.pop(seq_id, None)
+            if request is None:
+                raise struct.error("response to unknown sequence id %d" % seq_id)
+
+            self._complete(request, recv_view[offset + len_size + seq_size:frame_end])
+            offset = frame_end
+
+        return offset
+
+    def _read_responses(self, conn):
+        """Complete the requests of all v1 responses received, return the bytes consumed."""
+        recv_buf = conn.recv_buf
+        recv_view = memoryview(recv_buf)
+        offset = 0
+        while conn.resp_seq_id in conn.pending:
+            protocol = conn.pending[conn.resp_seq_id].protocol
+            if protocol.return_struct is not None:
+                resp_start = offset
+                resp_end = offset + protocol.return_struct.size
+            else:
+                if protocol.return_array:
+                    len_struct = emews.base.baseserv.ARRAY_LEN_STRUCT
+                    item_size = emews.base.baseserv.ARRAY_ITEM_SIZE
+                else:
+                    len_struct = emews.base.baseserv.STR_LEN_STRUCT
+                    item_size = 1
+
+                if len(recv_buf) - offset < len_struct.size:
+                    break
+                resp_start = offset + len_struct.size
+                resp_end = resp_start + len_struct.unpack_from(recv_buf, offset)[0] * item_size
+
+            if len(recv_buf) < resp_end:
+                break
+
+            request = conn.pending.pop(conn.resp_seq_id)
+            conn.resp_seq_id = (conn.resp_seq_id + 1) & 0xffffffff
+            self._complete(request, recv_view[resp_start:resp_end])
+            offset = resp_end
+
+        if offset < len(recv_buf) and not conn.pending:
+            raise struct.error("response received without a request")
+
+        return offset
+
+    def _complete(self, request, data):
+        """Complete a request with its response (data is a memoryview of the receive buffer)."""
+        try:
+            result = request.protocol.decode_return(data)
+        except struct.error as ex:
+            self.logger.warning("Asynchronous request: unexpected data format from: %s", ex)
+            request.future.set_exception(ex)
+            return
+
+        request.future.set_result(result)
+
+    def _conn_lost(self, conn, ex):
+        """
+        Close a connection, re-sending outstanding requests (ex is None if closed remotely).
+
+        This includes connections which could not be established.
+        """
+        self._poller.unregister(conn.fd)
+        del self._fd_conns[conn.fd]
+        if self._conns.get(conn.key, None) is conn:
+            del self._conns[conn.key]
+
+        conn.sock.close()
+
+        if not conn.outstanding:
+            # session ended (or timed out) by the server
+            self.logger.debug("Asynchronous session to node address '%s' closed remotely.",
+                              str(conn.key[0]))
+            return
+
+        requests = [conn.pending[seq_id] for seq_id in sorted(conn.pending)] + conn.unsent
+        if ex is None:
+            ex = socket.error("Connection closed remotely.")
+
+        if conn.connecting:
+            self.logger.debug("Could not connect to node at address %s: %s", str(conn.key[0]), ex)
+        else:
+            self.logger.info(
+                "Asynchronous session to node address '%s' lost with %d requests outstanding: %s",
+                str(conn.key[0]), len(requests), ex)
+
+        self._requests_lost(conn.key, requests, ex, conn.sent_bytes)
+
+    def _requests_lost(self, key, requests, ex, sent_bytes=0):
+        """
+        Re-send the requests of a connection lost (or not established), or fail them with ex.
+
+        Requests starting before sent_bytes (bytes of the connection sent) may have reached the
+        server, and are only re-sent if idempotent.
+        """
+        self._breakers.failure(key[0])
+
+        retries = []
+        for request in requests:
+            request.attempts += 1
+            if request.attempts >= self._max_attempts or \
+                    (not request.idempotent and request.offset < sent_bytes):
+                request.future.set_exception(ex)
+            else:
+                retries.append(request)
+
+        if not retries:
+            return
+
+        # the first re-send is immediate (the session may have been ended by the server), later
+        # ones back off until a response is received
+        backoff = self._backoffs.get(key, None)
+        if backoff is None:
+            self._backoffs[key] = self._new_backoff()
+            retry_time = time.time()
+        else:
+            delay = backoff.next_delay()
+            self._breakers.count('backoff_time', delay)
+            retry_time = time.time() + delay
+
+        self._breakers.count('reconnects')
+        self._retry.extend((retry_time, key, request) for request in retries)
+
+    def _poll_timeout(self):
+        """Return the seconds until the next request timeout or re-send (None if none)."""
+        next_timeout = None
+        for conn in self._conns.itervalues():
+            conn_timeout = self._conn_timeout(conn)
+            if conn.outstanding and conn_timeout >= 0 and (
+                    next_timeout is None or conn.last_active + conn_timeout < next_timeout):
+                next_timeout = conn.last_active + conn_timeout
+
+        for retry_time, _, _ in self._retry:
+            if next_timeout is None or retry_time < next_timeout:
+                next_timeout = retry_time
+
+        if next_timeout is None:
+            return None
+
+        return max(0, next_timeout - time.time())
+
+    def _conn_timeout(self, conn):
+        """Return the seconds a connection may go without progress (-1 if no limit)."""
+        return self._timeout if conn.connecting else self._response_timeout
+
+    def _check_timeouts(self):
+        """Drop connections which have had requests outstanding without any progress in time."""
+        now = time.time()
+        for conn in self._conns.values():
+            conn_timeout = self._conn_timeout(conn)
+            if conn.outstanding and 0 <= conn_timeout <= now - conn.last_active:
+                self._conn_lost(conn, socket.timeout(
+                    "%s in %s seconds." % ("Not connected" if conn.connecting else "No response",
+                                           conn_timeout)))
+
+    def _shutdown(self):
+        """Fail all outstanding requests, and close all connections (I/O thread)."""
+        with self._lock:
+            self._closed = True
+            submitted = self._submitted
+            self._submitted = []
+
+            # closed while holding the lock, so no request submitted meanwhile writes to it
+            os.close(self._wakeup_r)
+            os.close(self._wakeup_w)
+            self._wakeup_w = None
+
+        requests = [request for _, request in submitted]
+        requests.extend(request for _, _, request in self._retry)
+        self._retry = []
+        for conn in self._conns.values():
+            requests.extend(conn.pending.itervalues())
+            requests.extend(conn.unsent)
+            conn.sock.close()
+
+        self._conns.clear()
+        self._fd_conns.clear()
+        self._poller.close()
+
+        closed_ex = socket.error("Asynchronous client is closed.")
+        for request in requests:
+            if not request.future.done():
+                request.future.set_exception(closed_ex)
@@ -5,9 +5,50 @@ Created on Apr 2, 2019
 @author: Brian Ricks
 """
 from abc import abstractmethod
+import array
+import struct
+import sys
 
 import emews.base.baseobject
 
+HEADER_STRUCT = struct.Struct('>HL')   # session header: net protocol id, node id
+STR_LEN_STRUCT = struct.Struct('>H')   # length of a string response
+FRAME_LEN_STRUCT = struct.Struct('>L')  # length of a v2 frame (request or response)
+SEQ_ID_STRUCT = struct.Struct('>L')    # sequence id of a v2 frame (pipelined sessions)
+FRAME_SEQ_STRUCT = struct.Struct('>LL')  # length and sequence id of a v2 frame
+CHANNEL_ID_STRUCT = struct.Struct('>H')  # channel id of a multiplexed (NET_MUX) frame
+MUX_HEADER_STRUCT = struct.Struct('>LH')  # length and channel id of a multiplexed frame
+CHANNEL_OPEN_FLAG = 0x8000  # channel id flag of the multiplexed frame opening the channel
+CHANNEL_CLOSE_FLAG = 0x8000  # channel id flag of the (server) multiplexed frame closing the channel
+BATCH_REQUEST_ID = 0xffff  # request id of a batch request (v2 QueryServ sessions)
+BATCH_HEADER_STRUCT = struct.Struct('>HH')  # batch request: BATCH_REQUEST_ID, number of requests
+BATCH_COUNT_STRUCT = struct.Struct('>H')  # batch response: number of responses
+ARRAY_LEN_STRUCT = struct.Struct('>L')  # number of items of a packed array (type 'a')
+ARRAY_ITEM_SIZE = 4  # bytes per packed array item on the wire (big endian)
+# array.array typecode of packed array items (unsigned 32 bit, the size of C types varies)
+ARRAY_TYPECODE = 'I' if array.array('I').itemsize == ARRAY_ITEM_SIZE else 'L'
+assert array.array(ARRAY_TYPECODE).itemsize == ARRAY_ITEM_SIZE
+_ARRAY_BYTESWAP = sys.byteorder == 'little'  # array items are packed in native byte order
+
+
+def encode_array(vals):
+    """Return an iterable of unsigned ints as a packed array (big endian uint32 items)."""
+    arr = array.array(ARRAY_TYPECODE, vals)
+    if _ARRAY_BYTESWAP:
+        arr.byteswap()
+
+    return arr.tostring()
+
+
+def decode_array(data):
+    """Return the array.array of unsigned ints packed in data (see encode_array)."""
+    arr = array.array(ARRAY_TYPECODE)
+    arr.fromstring(data)
+    if _ARRAY_BYTESWAP:
+        arr.byteswap()
+
+    return arr
+
 
 def calculate_recv_len(format_str):
     """Calculate the number of bytes we should expected to receive."""
@@ -21,14 +62,38 @@ def calculate_recv_len(format_str):
             recv_len += 4
         elif type_chr == 'Q' or type_chr == 'q' or type_chr == 'd':
             recv_len += 8
-        elif type_chr == 's':
-            raise AttributeError("Format type 's' in string '%s' cannot be present to calculate length" % format_str)
+        elif type_chr == 's' or type_chr == 'a':
+            raise AttributeError("Format type '%s' in string '%s' cannot be present to calculate length" % (type_chr, format_str))
         else:
             raise AttributeError("Format type '%s' in string '%s' not supported" % type_chr, format_str)
 
     return recv_len
 
 
+def encode_frame(data, seq_id=None):
+    """Return data as a v2 frame (tagged with seq_id if given)."""
+    if seq_id is not None:
+        return FRAME_SEQ_STRUCT.pack(len(data) + SEQ_ID_STRUCT.size, seq_id) + data
+
+    return FRAME_LEN_STRUCT.pack(len(data)) + data
+
+
+def encode_batch_frame(queries, seq_id=None):
+    """
+    Return a batch request of queries, a list of (NetProto, val_list), as a v2 frame.
+
+    A batch request holds the BATCH_HEADER_STRUCT, followed by each request (request id and
+    values) prefixed by its length (FRAME_LEN_STRUCT).  The batch response holds the number of
+    responses (BATCH_COUNT_STRUCT), followed by each response as a v2 frame (see
+    NetProto.encode_return_frame).
+    """
+    batch_parts = [BATCH_HEADER_STRUCT.pack(BATCH_REQUEST_ID, len(queries))]
+    for protocol, val_list in queries:
+        batch_parts.append(protocol.encode_query_frame(val_list))
+
+    return encode_frame(''.join(batch_parts), seq_id)
+
+
 def build_query(proto_format_string, value_list):
     """Build the query type string from a NetProto format string and values."""
     if len(proto_format_string) != len(value_list):
@@ -40,6 +105,11 @@ def build_query(proto_format_string, value_list):
         if format_type == 's':
             query_type_str += 'L' + str(len(val)) + 's'  # 4 bytes for str len
             query_vals.append(len(val))
+        elif format_type == 'a':
+            query_type_str += 'L' + str(len(val)) + 'I'  # 4 bytes for the number of items
+            query_vals.append(len(val))
+            query_vals.extend(val)
+            continue
         else:
             query_type_str += format_type
 
@@ -49,9 +119,28 @@ def build_query(proto_format_string, value_list):
 
 
 class NetProto(object):
-    """Specification for a server protocol."""
-
-    __slots__ = ('proto_id', 'request_id', '_type_str', '_type_ret', '_len')
+    """
+    Specification for a server protocol.
+
+    The protocol is compiled on construction (that is, when the servers build their protocols) into
+    precompiled struct.Struct codecs, which both the client and the server side reuse:
+    - recv_segments: server side decoding, list of (Struct, recv_len) per fixed width segment.  A
+      segment followed by a variable length field ends with the field length ('L'), and is
+      followed by a (None, item size) entry for the field itself (its recv_len is only known once
+      the length is in).  Variable length fields are strings ('s', item size 1), and packed
+      arrays of unsigned ints ('a', see encode_array), whose length is their number of items.
+    - encode_query(): client side encoding of a request (request id and values)
+    - encode_return() / return_struct: encoding / decoding of the response
+    - decode(), encode_query_frame(), encode_return_frame(): v2 framing, where each request and
+      response is a single frame prefixed by its total length (FRAME_LEN_STRUCT).  A v2 request
+      frame holds the same fields as a v1 request, and is decoded as a whole.  A v2 string
+      (array) response is not prefixed by its length (the frame length is used instead).  On
+      pipelined sessions, the frame length is followed by the sequence id of the request
+      (SEQ_ID_STRUCT), which is echoed in the response frame.
+    """
+
+    __slots__ = ('proto_id', 'request_id', '_type_str', '_type_ret', '_len', 'recv_segments',
+                 '_query_struct', '_query_segments', '_query_tail', 'return_struct', 'return_array')
 
     def __init__(self, type_string, type_return=None, proto_id=-1, request_id=-1):
         """Constructor."""
@@ -61,6 +150,151 @@ class NetProto(object):
         self._type_ret = type_return
         self._len = len(type_string)
 
+        # server side: split the format string if any type is 's' (string) or 'a' (packed array)
+        self.recv_segments = []
+        cur_format_str = ''
+        for type_chr in type_string:
+            if type_chr == 's' or type_chr == 'a':
+                self.recv_segments.append(
+                    (struct.Struct('>%sL' % cur_format_str), calculate_recv_len(cur_format_str) + 4))
+                # we don't know the recv_len yet
+                self.recv_segments.append((None, 1 if type_chr == 's' else ARRAY_ITEM_SIZE))
+                cur_format_str = ''
+            else:
+                cur_format_str += type_chr
+
+        if cur_format_str != '':
+            self.recv_segments.append(
+                (struct.Struct('>%s' % cur_format_str), calculate_recv_len(cur_format_str)))
+
+        # client side: the query is the request id followed by the protocol values
+        if 's' not in type_string and 'a' not in type_string:
+            self._query_struct = struct.Struct('>H%s' % type_string)
+            self._query_segments = ()
+            self._query_tail = None
+        else:
+            # one (Struct, num values, is array) segment per variable length field, packing the
+            # (fixed width) values before the field and the field length
+            self._query_struct = None
+            query_segments = []
+            cur_format_str = ''
+            for type_chr in type_string:
+                if type_chr == 's' or type_chr == 'a':
+                    query_segments.append((
+                        struct.Struct('>%s%sL' % ('' if query_segments else 'H', cur_format_str)),
+                        len(cur_format_str), type_chr == 'a'))
+                    cur_format_str = ''
+                else:
+                    cur_format_str += type_chr
+
+            self._query_segments = tuple(query_segments)
+            self._query_tail = struct.Struct('>%s' % cur_format_str) if cur_format_str else None
+
+        # response
+        self.return_array = type_return == 'a'
+        if type_return is None or type_return == '' or type_return == 's' or self.return_array:
+            # string (array) responses are prefixed by STR_LEN_STRUCT (ARRAY_LEN_STRUCT)
+            self.return_struct = None
+        else:
+            self.return_struct = struct.Struct('>%s' % type_return)
+
+    def encode_query(self, val_list):
+        """Return the encoded request (request id and the values given)."""
+        if self._query_struct is not None:
+            return self._query_struct.pack(self.request_id, *val_list)
+
+        if len(val_list) != self._len:
+            raise AttributeError("protocol format string len differs from value_list len")
+
+        query_parts = []
+        vals = [self.request_id]  # the request id is packed by the first segment
+        val_index = 0
+        for query_struct, num_vals, is_array in self._query_segments:
+            str_index = val_index + num_vals
+            vals.extend(val_list[val_index:str_index])
+            vals.append(len(val_list[str_index]))
+            query_parts.append(query_struct.pack(*vals))
+            if is_array:
+                query_parts.append(encode_array(val_list[str_index]))
+            else:
+                query_parts.append(val_list[str_index])
+            vals = []
+            val_index = str_index + 1
+
+        if self._query_tail is not None:
+            query_parts.append(self._query_tail.pack(*val_list[val_index:]))
+
+        return ''.join(query_parts)
+
+    def encode_query_frame(self, val_list, seq_id=None):
+        """Return the encoded request as a v2 frame (tagged with seq_id if given)."""
+        return encode_frame(self.encode_query(val_list), seq_id)
+
+    def decode(self, buf, offset, end):
+        """
+        Decode all protocol fields held in buf[offset:end] (buf is a buffer view).
+
+        Returns (list of values, offset after the last field).  Raises struct.error if the fields
+        do not fit.
+        """
+        vals = []
+        for recv_struct, recv_len in self.recv_segments:
+            if recv_struct is None:
+                # string or packed array (recv_len is the item size), its length is the last
+                # value unpacked
+                item_size = recv_len
+                recv_len = vals.pop() * item_size
+                if offset + recv_len > end:
+                    raise struct.error("field of %d bytes exceeds the frame" % recv_len)
+                if item_size == 1:
+                    vals.append(buf[offset:offset + recv_len].tobytes())
+                else:
+                    vals.append(decode_array(buf[offset:offset + recv_len].tobytes()))
+            else:
+                if offset + recv_len > end:
+                    raise struct.error("field of %d bytes exceeds the frame" % recv_len)
+                vals.extend(recv_struct.unpack_from(buf, offset))
+
+            offset += recv_len
+
+        return (vals, offset)
+
+    def encode_return_frame(self, ret_val, seq_id=None):
+        """Return the encoded response value as a v2 frame (tagged with seq_id if given)."""
+        if self.return_struct is not None:
+            ret_val = self.return_struct.pack(ret_val)
+        elif self.return_array:
+            ret_val = encode_array(ret_val)
+
+        return encode_frame(ret_val, seq_id)
+
+    def decode_return(self, data):
+        """
+        Return the response value decoded from data, a string or memoryview.
+
+        Raises struct.error if malformed.
+        """
+        if self.return_struct is None:
+            if isinstance(data, memoryview):
+                data = data.tobytes()
+            if self.return_array:
+                if len(data) % ARRAY_ITEM_SIZE:
+                    raise struct.error("packed array of %d bytes" % len(data))
+                return decode_array(data)
+            return data
+
+        return self.return_struct.unpack(data)[0]
+
+    def encode_return(self, ret_val):
+        """Return the encoded response value."""
+        if self.return_struct is None:
+            if self.return_array:
+                return ARRAY_LEN_STRUCT.pack(len(ret_val)) + encode_array(ret_val)
+            # string return type - len needs to be part of this
+            return STR_LEN_STRUCT.pack(len(ret_val)) + ret_val
+
+        return self.return_struct.pack(ret_val)
+
     @property
     def return_type(self):
         """Return the return type."""
@@ -83,27 +317,21 @@ class NetProto(object):
 class Handler(object):
     """Container for handler data."""
 
-    __slots__ = ('callback', 'recv_types', 'protocol')
+    __slots__ = ('callback', 'recv_types', 'protocol', 'offload')
 
-    def __init__(self, protocol, callback):
-        """Constructor."""
+    def __init__(self, protocol, callback, offload=False):
+        """
+        Constructor.
+
+        If offload is True, the callback may block (for example, building services or importing
+        modules), and is run in the offload pool rather than on the reactor thread.
+        """
         self.callback = callback  # callback to invoke once data is fully received
-        self.recv_types = []  # tuples of (struct unpack type string, recv_len)
+        # tuples of (struct.Struct, recv_len), (None, item size) for strings and packed arrays
+        # (see NetProto.recv_segments)
+        self.recv_types = protocol.recv_segments
         self.protocol = protocol
-
-        # split the format string if any type is 's' (string type)
-        cur_format_str = ''
-        for type_chr in protocol._type_str:
-            if type_chr == 's':
-                self.recv_types.append(
-                    ('>%sL' % cur_format_str, calculate_recv_len(cur_format_str) + 4))
-                cur_format_str = ''
-                self.recv_types.append(('s', 0))  # we don't know the recv_len yet (also why no '>')
-            else:
-                cur_format_str += type_chr
-
-        if cur_format_str != '':
-            self.recv_types.append(('>%s' % cur_format_str, calculate_recv_len(cur_format_str)))
+        self.offload = offload
 
 
 class BaseServ(emews.base.baseobject.BaseObject):
@@ -4,12 +4,21 @@ Manages all backend connections between eMews nodes and the Hub node.
 Created on Feb 21, 2019
 @author: Brian Ricks
 """
+import collections
+import errno
+import fcntl
+import os
 import select
 import socket
+import stat
 import struct
+import threading
+import time
 
 import emews.base.baseobject
 import emews.base.netserv
+import emews.base.poller
+import emews.base.timer_wheel
 
 
 class SockState(object):
@@ -17,38 +26,135 @@ class SockState(object):
 
     __slots__ = ()
 
-    ENUM_SIZE = 4
+    ENUM_SIZE = 17
 
     SOCK_SESSION_ID = 0
     SOCK_NEXT_CB = 1
     SOCK_EXPECTED_BYTES = 2
-    SOCK_BUFFER = 3
+    SOCK_BUFFER = 3         # receive buffer (bytearray, reused for the lifetime of the session)
+    SOCK_SOCKET = 4
+    SOCK_VIEW = 5           # memoryview of the receive buffer
+    SOCK_RECV_BYTES = 6     # number of unprocessed bytes held at the start of the buffer
+    SOCK_SEND_QUEUE = 7     # queue (deque) of data buffers to be sent
+    SOCK_SEND_OFFSET = 8    # bytes of the first buffer in the send queue already sent
+    SOCK_POLL_EVENTS = 9    # poll events the socket is currently registered for
+    SOCK_LAST_ACTIVE = 10   # time of the last data received or sent
+    SOCK_READ_START = 11    # time the partial field held in the buffer started to arrive
+    SOCK_WRITE_START = 12   # time of the last send progress (or data queued to an empty queue)
+    SOCK_TIMER_TICK = 13    # tick of the session's timer in the timer wheel (None if not armed)
+    SOCK_SEND_BYTES = 14    # total bytes held in the send queue (not yet sent)
+    SOCK_STATS = 15         # traffic counters of the session (array, owned by NetServ)
+    SOCK_OFFLOAD_JOB = 16   # offloaded handler job the session is suspended on (None if not)
 
 
 class ConnectionManager(emews.base.baseobject.BaseObject):
     """Classdocs."""
 
-    __slots__ = ('_port', '_socks', '_listener_sock', '_net_serv', '_pending_ids', '_cb',
-                 '_r_socks', '_w_socks', '_e_socks', '_conn_id')
+    RECV_BUFFER_SIZE = 4096      # initial per session receive buffer size
+    RECV_BUFFER_MAX_SIZE = 65536  # receive buffers grown larger than this are shrunk after use
+    SEND_IOV_MAX = 1024          # max number of buffers per vectored send
+    HAS_SENDMSG = hasattr(socket.socket, 'sendmsg')  # scatter/gather sends (Python >= 3.3)
+    TIMER_TICK = 1.0             # resolution (seconds) of session timeouts
+    TIMER_SLOTS = 512            # timer wheel slots
+    LOOPBACK_ADDR = 0x7f000001   # source address given to sessions of the AF_UNIX listener
+
+    __slots__ = ('_port', '_socks', '_listener_socks', '_net_serv', '_pending_ids', '_cb',
+                 '_poller', '_conn_id', '_read_buffer', '_read_view', '_hub_workers', '_timers',
+                 '_now', '_idle_timeout', '_read_timeout', '_write_timeout', '_listen_backlog',
+                 '_unix_path', '_session_buffer_limit', '_global_buffer_limit', '_max_field_size',
+                 '_buffered_bytes', '_num_closed_over_limit', '_paused', '_offload_fd',
+                 '_suspended', '_wakeup_r', '_wakeup_w', '_wakeup_lock')
+
+    def __init__(self, config, thread_dispatcher, net_client, hub_workers=None):
+        """
+        Constructor.
 
-    def __init__(self, config, thread_dispatcher, net_client):
-        """Constructor."""
+        hub_workers is given if the hub runs multiple reactor processes (HubWorkers object).  The
+        listener then binds using SO_REUSEPORT.
+        """
         super(ConnectionManager, self).__init__()
 
         self._conn_id = 0
 
         self._port = config['port']
+        self._listen_backlog = config['listen_backlog']
+        self._unix_path = config['unix_socket_path']  # AF_UNIX listener for local clients
 
-        self._socks = {}  # accepted sockets
+        self._socks = {}  # [fd]: sock state of accepted sockets
         self._pending_ids = {}  # FDs (socks) that are pending an established connection
-        self._listener_sock = None  # listener socket (will be instantiated on start())
+        self._listener_socks = {}  # [fd]: listener socket (instantiated on start())
+        self._hub_workers = hub_workers
 
         self._net_serv = emews.base.netserv.NetServ(
-            config, thread_dispatcher, net_client, _inject={'sys': self.sys})
-
-        self._r_socks = []  # list of socket objects to manage for a readable state
-        self._w_socks = []  # list of socket objects to manage for a writable state
-        self._e_socks = []  # list of socket objects to manage for an exceptional state
+            config, thread_dispatcher, net_client, hub_workers, self.stats,
+            _inject={'sys': self.sys})
+
+        # readiness backend (select or epoll)
+        self._poller = emews.base.poller.get_poller(config['poll_backend'])
+        self.logger.debug("Using '%s' poll backend.", self._poller.name)
+
+        # stop() may be called from another thread: it wakes up the poll loop through this pipe,
+        # and the loop closes the sockets as it exits (the lock guards the pipe from being closed
+        # while written to)
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        for fd in (self._wakeup_r, self._wakeup_w):
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self._wakeup_lock = threading.RLock()
+
+        # Read-ahead buffer shared by all sessions.  When a session has no partial data pending,
+        # a large chunk is read into this buffer and every complete field/frame is processed from
+        # it; only the (partial) remainder is copied to the session's own buffer.
+        self._read_buffer = bytearray(config['read_ahead_size'])
+        self._read_view = memoryview(self._read_buffer)
+
+        # Session timeouts (negative values disable them).  Each session has at most one armed
+        # timer in the wheel; on expiry the actual deadline is recomputed from the session's
+        # timestamps, so traffic only updates a timestamp and never touches the wheel.
+        self._idle_timeout = config['session_idle_timeout']
+        self._read_timeout = config['session_read_timeout']
+        self._write_timeout = config['session_write_timeout']
+        self._now = time.time()  # time of the current poll loop iteration
+        self._timers = emews.base.timer_wheel.TimerWheel(
+            ConnectionManager.TIMER_TICK, ConnectionManager.TIMER_SLOTS, self._now)
+
+        # Memory caps.  Sessions announcing a field larger than max_field_size are closed.  A
+        # session stops being read (TCP backpressure) while the bytes it buffers (received and not
+        # yet processed, plus queued outgoing data) exceed the session limit, or while all sessions
+        # together buffer more than the global limit (see _over_buffer_limit).  Reading resumes as
+        # the queued data is sent, or once the global buffered bytes are back under the limit.
+        self._session_buffer_limit = config['session_buffer_limit']
+        self._global_buffer_limit = config['global_buffer_limit']
+        self._max_field_size = config['max_field_size']
+        self._buffered_bytes = 0  # bytes buffered (received and queued to send) by all sessions
+        self._num_closed_over_limit = 0  # sessions closed for announcing an oversized field
+        self._paused = {}  # [fd]: sock state of a session not read due to the buffer limits
+
+        # Sessions suspended while an offloaded handler runs are neither read nor processed.  The
+        # offload pool wakes up the poll loop through its wakeup fd once handlers complete.
+        self._offload_fd = self._net_serv.offload_fd
+        self._suspended = {}  # [OffloadJob]: sock state of the session suspended on it
+
+    def stats(self):
+        """Return a dict of session and buffer statistics, including the buffer limits."""
+        num_paused = 0
+        send_bytes = 0
+        for sock_state in self._socks.itervalues():
+            send_bytes += sock_state[SockState.SOCK_SEND_BYTES]
+            if self._is_paused(sock_state):
+                num_paused += 1
+
+        return {
+            'sessions': len(self._socks),
+            'paused_sessions': num_paused,
+            'buffered_bytes': self._buffered_bytes,
+            'send_buffered_bytes': send_bytes,
+            'recv_buffered_bytes': self._buffered_bytes - send_bytes,
+            'session_buffer_limit': self._session_buffer_limit,
+            'global_buffer_limit': self._global_buffer_limit,
+            'max_field_size': self._max_field_size,
+            'closed_over_limit': self._num_closed_over_limit,
+            'suspended_sessions': len(self._suspended),
+        }
 
     def _get_new_session_id(self):
         """Return a new connection id."""
@@ -56,23 +162,28 @@ class ConnectionManager(emews.base.baseobject.BaseObject):
         return self._conn_id
 
     def _close_socket(self, sock):
-        """Close the passed socket.  Should not be used on listener sockets."""
+        """Close the passed socket."""
         try:
-            self._w_socks.remove(sock)
-        except ValueError:
-            pass
-
-        try:
-            self._r_socks.remove(sock)
-        except ValueError:
-            pass
+            fd = sock.fileno()
+        except socket.error:
+            # already closed
+            return
 
-        self._e_socks.remove(sock)
+        self._poller.unregister(fd)
 
-        if sock in self._socks:
-            session_id = self._socks[sock][SockState.SOCK_SESSION_ID]
+        if fd in self._socks:
+            sock_state = self._socks[fd]
+            session_id = sock_state[SockState.SOCK_SESSION_ID]
             self._net_serv.handle_close(session_id)
-            del self._socks[sock]
+            del self._socks[fd]
+
+            self._buffered_bytes -= sock_state[SockState.SOCK_SEND_BYTES] + \
+                sock_state[SockState.SOCK_RECV_BYTES]
+            self._paused.pop(fd, None)
+
+            if sock_state[SockState.SOCK_OFFLOAD_JOB] is not None:
+                # the job's result is discarded once it completes
+                del self._suspended[sock_state[SockState.SOCK_OFFLOAD_JOB]]
 
             if session_id in self._pending_ids:
                 # connection could not be established
@@ -92,147 +203,506 @@ class ConnectionManager(emews.base.baseobject.BaseObject):
         # create listener socket for the ConnectionManager
         self._setup_listener()
 
+        if self._offload_fd is not None:
+            self._poller.register(self._offload_fd, emews.base.poller.PollEvents.POLL_READ)
+        self._poller.register(self._wakeup_r, emews.base.poller.PollEvents.POLL_READ)
+
         while not self._interrupted:
             try:
-                r_sock_list, w_sock_list, e_sock_list = select.select(
-                    self._r_socks, self._w_socks, self._e_socks)
-            except select.error:
+                ready_list = self._poller.poll(self._timers.next_timeout(time.time()))
+            except (IOError, OSError, ValueError, select.error):
+                # (select.error is not an OSError on Python 2)
                 if not self._interrupted:
-                    self.logger.error("Select error while blocking on managed sockets.")
+                    self.logger.error("Poll error while blocking on managed sockets.")
                     raise
-                # if run in the main thread, a KeyboardInterrupt should unblock select
-                self.logger.debug("Select unblocked by interrupt.")
+                # if run in the main thread, a KeyboardInterrupt should unblock the poller
+                self.logger.debug("Poll unblocked by interrupt.")
                 break
 
-            for w_sock in w_sock_list:
-                # writable sockets
-                self._writable_socket(w_sock)
+            self._now = time.time()
+
+            for fd, events in ready_list:
+                if fd in self._listener_socks:
+                    self._accept_connections(self._listener_socks[fd])
+                    continue
+
+                if fd == self._offload_fd:
+                    self._resume_sessions()
+                    continue
+
+                if fd == self._wakeup_r:
+                    # woken up by stop()
+                    continue
+
+                sock_state = self._socks.get(fd, None)
+                if sock_state is None:
+                    # socket closed while processing an earlier event in this batch
+                    continue
+
+                if sock_state[SockState.SOCK_OFFLOAD_JOB] is not None:
+                    # Suspended session: its handler is still running, so a hang up (or error,
+                    # reported even for fds polled for no events) is handled once resumed.
+                    continue
+
+                if events & emews.base.poller.PollEvents.POLL_ERROR:
+                    # exceptional sockets
+                    self._exceptional_socket(sock_state)
+                    continue
 
-            for r_sock in r_sock_list:
-                # readable sockets
-                self._readable_socket(r_sock)
+                if events & emews.base.poller.PollEvents.POLL_WRITE:
+                    # writable sockets
+                    self._writable_socket(sock_state)
 
-            for e_sock in e_sock_list:
-                # exceptional sockets
-                self._exceptional_socket(e_sock)
+                if events & emews.base.poller.PollEvents.POLL_READ and fd in self._socks and \
+                        sock_state[SockState.SOCK_POLL_EVENTS] & \
+                        emews.base.poller.PollEvents.POLL_READ:
+                    # readable sockets (sessions are readable while writes are pending, paused
+                    # sessions are not read even if a hang up is reported)
+                    self._readable_socket(sock_state)
+
+            if self._paused and self._buffered_bytes <= self._global_buffer_limit:
+                self._resume_paused()
+
+            if self._timers:
+                self._expire_sessions()
+
+        # shutdown the listener sockets first
+        for listener_sock in self._listener_socks.values():
+            if listener_sock.family == socket.AF_UNIX:
+                self._remove_unix_path()
+            self._close_socket(listener_sock)
+
+        for sock_state in self._socks.values():
+            # shut down all managed sockets
+            self._close_socket(sock_state[SockState.SOCK_SOCKET])
+
+        self._poller.close()
+        self._net_serv.close()
+
+        with self._wakeup_lock:
+            os.close(self._wakeup_r)
+            os.close(self._wakeup_w)
+            self._wakeup_w = None
 
     def stop(self):
-        """Stop the ConnectionManager."""
+        """Stop the ConnectionManager (the poll loop closes the sockets as it exits)."""
         self.logger.debug("Stopping ConnectionManager ...")
         self.interrupt()
 
-        # shutdown the listener socket first
-        self._close_socket(self._listener_sock)
+        with self._wakeup_lock:
+            if self._wakeup_w is None:
+                # poll loop exited already
+                return
 
-        for sock in self._socks.keys():
-            # shut down all managed sockets
-            self._close_socket(sock)
+            try:
+                os.write(self._wakeup_w, '\0')
+            except OSError as ex:
+                if ex.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
 
-    def _readable_socket(self, sock):
-        """Given a socket in a readable state, do something with it."""
-        if sock is self._listener_sock:
-            # listener socket, accept incoming connection
+    def _accept_connections(self, listener_sock):
+        """
+        Listener socket is readable, accept all pending incoming connections.
+
+        Connections are accepted until the accept queue is drained (EAGAIN), so a burst of
+        connecting nodes does not overflow the listen backlog.
+        """
+        while True:
             try:
-                acc_sock, src_addr = sock.accept()
-                acc_sock.setblocking(0)
+                acc_sock, src_addr = listener_sock.accept()
             except socket.error as ex:
-                # ignore the exception, but dump the new connection
+                if ex.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    # accept queue drained
+                    return
+                if ex.args[0] in (errno.EINTR, errno.ECONNABORTED):
+                    # connection aborted before being accepted, try the next one
+                    continue
+                # ignore the exception (for example, out of fds), remaining connections wait
                 self.logger.warning("Socket exception while accepting connection: %s", ex)
                 return
 
-            session_id = self._get_new_session_id()
-            self.logger.debug("Connection established from %s, assigned session id: %d",
-                              src_addr, session_id)
-            self._r_socks.append(acc_sock)
-            self._e_socks.append(acc_sock)
+            try:
+                acc_sock.setblocking(0)
+            except socket.error as ex:
+                # dump the new connection
+                self.logger.warning("Socket exception while accepting connection: %s", ex)
+                acc_sock.close()
+                continue
+
+            self._accept_connection(acc_sock, src_addr)
+
+    def _accept_connection(self, acc_sock, src_addr):
+        """Manage a newly accepted connection."""
+
+        session_id = self._get_new_session_id()
+        self.logger.debug("Connection established from %s, assigned session id: %d",
+                          src_addr, session_id)
+
+        try:
+            self._poller.register(acc_sock.fileno(), emews.base.poller.PollEvents.POLL_READ)
+        except ValueError as ex:
+            # poll backend cannot manage this fd (select fd ceiling)
+            self.logger.warning("Session id %d: cannot manage socket, dropping connection: %s",
+                                session_id, ex)
+            acc_sock.close()
+            return
 
-            self._net_serv.handle_init(
+        if acc_sock.family == socket.AF_UNIX:
+            # local client (no address), treated as connecting from the loopback address
+            session_stats = self._net_serv.handle_init(
+                session_id, ConnectionManager.LOOPBACK_ADDR)
+        else:
+            session_stats = self._net_serv.handle_init(
                 session_id, struct.unpack(">I", socket.inet_aton(src_addr[0]))[0])
 
-            sock_state = [None] * SockState.ENUM_SIZE
-            sock_state[SockState.SOCK_SESSION_ID] = session_id
-            sock_state[SockState.SOCK_NEXT_CB] = self._net_serv.handle_connection
-            sock_state[SockState.SOCK_EXPECTED_BYTES] = 6
-            sock_state[SockState.SOCK_BUFFER] = ""
+        sock_state = [None] * SockState.ENUM_SIZE
+        sock_state[SockState.SOCK_SESSION_ID] = session_id
+        sock_state[SockState.SOCK_NEXT_CB] = self._net_serv.handle_connection
+        sock_state[SockState.SOCK_EXPECTED_BYTES] = 6
+        sock_state[SockState.SOCK_BUFFER] = bytearray(ConnectionManager.RECV_BUFFER_SIZE)
+        sock_state[SockState.SOCK_SOCKET] = acc_sock
+        sock_state[SockState.SOCK_VIEW] = memoryview(sock_state[SockState.SOCK_BUFFER])
+        sock_state[SockState.SOCK_RECV_BYTES] = 0
+        sock_state[SockState.SOCK_SEND_QUEUE] = collections.deque()
+        sock_state[SockState.SOCK_SEND_OFFSET] = 0
+        sock_state[SockState.SOCK_POLL_EVENTS] = emews.base.poller.PollEvents.POLL_READ
+        sock_state[SockState.SOCK_LAST_ACTIVE] = self._now
+        sock_state[SockState.SOCK_READ_START] = self._now
+        sock_state[SockState.SOCK_WRITE_START] = self._now
+        sock_state[SockState.SOCK_TIMER_TICK] = None
+        sock_state[SockState.SOCK_SEND_BYTES] = 0
+        sock_state[SockState.SOCK_STATS] = session_stats
+        sock_state[SockState.SOCK_OFFLOAD_JOB] = None
+
+        self._socks[acc_sock.fileno()] = sock_state
+        self._arm_timer(sock_state)
+
+    def _readable_socket(self, sock_state):
+        """Given a socket in a readable state, do something with it."""
+        sock = sock_state[SockState.SOCK_SOCKET]
+        recv_bytes = sock_state[SockState.SOCK_RECV_BYTES]
 
-            self._socks[acc_sock] = sock_state
+        if recv_bytes:
+            # partial data pending, read ahead into the session buffer after it
+            self._reserve_buffer(sock_state, sock_state[SockState.SOCK_EXPECTED_BYTES])
+            recv_view = sock_state[SockState.SOCK_VIEW]
         else:
-            # readable socket we are managing
-            sock_state = self._socks[sock]
+            recv_view = self._read_view
 
-            if sock_state[SockState.SOCK_EXPECTED_BYTES] > 8192:
-                # larger than 8KB buffer
-                self.logger.warning(
-                    "Excessive receive buffer size requested of %d bytes for session id: %d",
-                    sock_state[SockState.SOCK_EXPECTED_BYTES],
-                    sock_state[SockState.SOCK_SESSION_ID])
+        try:
+            num_bytes = sock.recv_into(recv_view[recv_bytes:], len(recv_view) - recv_bytes)
+        except socket.error:
+            self.logger.warning(
+                "Socket error when receiving data, closing socket (session %d) ...",
+                sock_state[SockState.SOCK_SESSION_ID])
+            self._close_socket(sock)
+            return
 
-            try:
-                chunk = sock.recv(sock_state[SockState.SOCK_EXPECTED_BYTES])
-            except socket.error:
-                self.logger.warning(
-                    "Socket error when receiving data, closing socket (session %d) ...",
-                    sock_state[SockState.SOCK_SESSION_ID])
-                self._close_socket(sock)
-                return
+        if not num_bytes:
+            # zero length chunk, connection probably closed
+            self.logger.debug("Connection closed remotely, closing socket (session %d) ...",
+                              sock_state[SockState.SOCK_SESSION_ID])
+            self._close_socket(sock)
+            return
 
-            if not len(chunk):
-                # zero length chunk, connection probably closed
-                self.logger.debug("Connection closed remotely, closing socket (session %d) ...",
-                                  sock_state[SockState.SOCK_SESSION_ID])
-                self._close_socket(sock)
-                return
+        sock_state[SockState.SOCK_LAST_ACTIVE] = self._now
+        sock_state[SockState.SOCK_STATS][emews.base.netserv.TrafficStats.STAT_BYTES_IN] += num_bytes
+        self._process_buffer(sock_state, recv_view, recv_bytes + num_bytes)
 
-            if len(chunk) < sock_state[SockState.SOCK_EXPECTED_BYTES]:
-                # num bytes recv is less than what is expected.
-                sock_state[SockState.SOCK_EXPECTED_BYTES] = \
-                    sock_state[SockState.SOCK_EXPECTED_BYTES] - len(chunk)  # bytes remaining
-                sock_state[SockState.SOCK_BUFFER] = sock_state[SockState.SOCK_BUFFER] + chunk
-                return
+    def _reserve_buffer(self, sock_state, num_bytes):
+        """Make sure the session buffer can hold num_bytes, keeping any pending bytes."""
+        if num_bytes <= len(sock_state[SockState.SOCK_BUFFER]):
+            return
+
+        recv_bytes = sock_state[SockState.SOCK_RECV_BYTES]
+        new_buffer = bytearray(max(num_bytes, 2 * len(sock_state[SockState.SOCK_BUFFER])))
+        new_buffer[:recv_bytes] = sock_state[SockState.SOCK_VIEW][:recv_bytes]
+        sock_state[SockState.SOCK_BUFFER] = new_buffer
+        sock_state[SockState.SOCK_VIEW] = memoryview(new_buffer)
+
+    def _process_buffer(self, sock_state, recv_view, end):
+        """
+        Invoke the session callbacks for every complete field buffered in recv_view[:end].
 
-            # received all expected bytes
-            chunk = sock_state[SockState.SOCK_BUFFER] + chunk
-            sock_state[SockState.SOCK_BUFFER] = ""  # clear cache
+        Callbacks unpack directly from the buffer view, starting at the given offset.  Any
+        remaining partial field is kept at the start of the session buffer.  Data to be sent is
+        queued, and the queue is flushed once all buffered fields are processed.  If a callback
+        offloads its handler, processing stops (the session is suspended) until the handler
+        completes (see _resume_sessions).
+        """
+        stats = sock_state[SockState.SOCK_STATS]
+        start = 0
+
+        while end - start >= sock_state[SockState.SOCK_EXPECTED_BYTES] and \
+                sock_state[SockState.SOCK_NEXT_CB] is not None:
+            expected_bytes = sock_state[SockState.SOCK_EXPECTED_BYTES]
 
             try:
                 # read cb: returns (cb, buf) for read mode, (cb, buf, data) for write mode
                 ret_tup = sock_state[SockState.SOCK_NEXT_CB](
-                    sock_state[SockState.SOCK_SESSION_ID], chunk)
+                    sock_state[SockState.SOCK_SESSION_ID], recv_view, start)
             except StandardError as ex:
                 self.logger.error("Session handler '%s' threw exception: %s.",
                                   sock_state[SockState.SOCK_NEXT_CB], ex)
                 raise
 
-            # handle ret_tup
-            if ret_tup[0] is None and len(ret_tup) == 2:
-                # close the socket (not write mode)
-                self._close_socket(sock)
+            start += expected_bytes
+            stats[emews.base.netserv.TrafficStats.STAT_FRAMES_IN] += 1
+
+            if len(ret_tup) == 1:
+                # offloaded handler: suspend the session, keeping any further data buffered
+                sock_state[SockState.SOCK_OFFLOAD_JOB] = ret_tup[0]
+                self._suspended[ret_tup[0]] = sock_state
+                break
+
+            process_state = self._handle_ret_tup(sock_state, ret_tup)
+            if process_state is None:
+                # socket closed
                 return
+            elif not process_state:
+                break
+
+        # keep the remaining bytes (if any) at the start of the session buffer
+        remaining = end - start
+        if recv_view is not sock_state[SockState.SOCK_VIEW]:
+            # read-ahead buffer: copy the remainder to the session buffer
+            if remaining:
+                sock_state[SockState.SOCK_RECV_BYTES] = 0
+                self._reserve_buffer(sock_state, remaining)
+                sock_state[SockState.SOCK_BUFFER][:remaining] = recv_view[start:end]
+        elif start:
+            if len(recv_view) > ConnectionManager.RECV_BUFFER_MAX_SIZE and \
+                    remaining <= ConnectionManager.RECV_BUFFER_SIZE:
+                # don't hold on to an oversized buffer once the large field has been processed
+                sock_state[SockState.SOCK_BUFFER] = bytearray(ConnectionManager.RECV_BUFFER_SIZE)
+                sock_state[SockState.SOCK_VIEW] = memoryview(sock_state[SockState.SOCK_BUFFER])
+
+            # copy (regions may overlap)
+            sock_state[SockState.SOCK_BUFFER][:remaining] = recv_view[start:end].tobytes()
+
+        new_field = remaining and (start or recv_view is not sock_state[SockState.SOCK_VIEW])
+        self._buffered_bytes += remaining - sock_state[SockState.SOCK_RECV_BYTES]
+        sock_state[SockState.SOCK_RECV_BYTES] = remaining
+
+        if new_field:
+            # a new partial field started arriving (armed once the bytes pending are recorded)
+            sock_state[SockState.SOCK_READ_START] = self._now
+            self._arm_timer(sock_state)
+
+        if sock_state[SockState.SOCK_SEND_QUEUE]:
+            # the socket is most likely writable, so attempt to send right away
+            self._writable_socket(sock_state)
+        elif sock_state[SockState.SOCK_OFFLOAD_JOB] is not None:
+            self._set_poll_events(sock_state, 0)
+        else:
+            self._set_read_events(sock_state, 0)
+
+    def _handle_ret_tup(self, sock_state, ret_tup):
+        """
+        Handle the tuple returned by a session callback.
+
+        Returns True if buffered fields should keep being processed, False if not (the session
+        ends once the data queued is sent), or None if the socket was closed.
+        """
+        if ret_tup[0] is None and len(ret_tup) == 2:
+            # close the socket (not write mode)
+            self._close_socket(sock_state[SockState.SOCK_SOCKET])
+            return None
+
+        sock_state[SockState.SOCK_NEXT_CB] = ret_tup[0]  # next cb
+        sock_state[SockState.SOCK_EXPECTED_BYTES] = ret_tup[1]  # next expected bytes
+
+        if ret_tup[1] > self._max_field_size:
+            self.logger.warning(
+                "Session id %d announced a field of %d bytes (max field size: %d), "
+                "closing socket ...", sock_state[SockState.SOCK_SESSION_ID], ret_tup[1],
+                self._max_field_size)
+            self._num_closed_over_limit += 1
+            self._close_socket(sock_state[SockState.SOCK_SOCKET])
+            return None
+
+        if len(ret_tup) == 3:
+            # write mode: queue the data to be sent, and keep processing buffered fields
+            stats = sock_state[SockState.SOCK_STATS]
+            if not sock_state[SockState.SOCK_SEND_QUEUE]:
+                sock_state[SockState.SOCK_WRITE_START] = self._now
+            sock_state[SockState.SOCK_SEND_QUEUE].append(ret_tup[2])
+            sock_state[SockState.SOCK_SEND_BYTES] += len(ret_tup[2])
+            self._buffered_bytes += len(ret_tup[2])
+            stats[emews.base.netserv.TrafficStats.STAT_FRAMES_OUT] += 1
+            stats[emews.base.netserv.TrafficStats.STAT_BYTES_OUT] += len(ret_tup[2])
+
+            if ret_tup[0] is None:
+                # session ends once the queued data is sent, ignore any further data
+                return False
+
+        return True
+
+    def _resume_sessions(self):
+        """
+        Resume the sessions whose offloaded handlers completed.
+
+        The result of each handler is handed back to its session's callback chain (exceptions
+        raised by the handler are raised here, as they would have been inline), then any data
+        buffered while the session was suspended is processed.
+        """
+        for job in self._net_serv.offloaded_jobs():
+            sock_state = self._suspended.pop(job, None)
+            if sock_state is None:
+                # session closed while suspended
+                continue
 
-            sock_state[SockState.SOCK_NEXT_CB] = ret_tup[0]  # next cb
-            sock_state[SockState.SOCK_EXPECTED_BYTES] = ret_tup[1]  # next expected bytes
+            sock_state[SockState.SOCK_OFFLOAD_JOB] = None
+            sock_state[SockState.SOCK_LAST_ACTIVE] = self._now
+            sock_state[SockState.SOCK_READ_START] = self._now
+
+            try:
+                ret_tup = job.resume(job.result())
+            except StandardError as ex:
+                self.logger.error("Offloaded session handler '%s' threw exception: %s.",
+                                  job.fn, ex)
+                raise
+
+            process_state = self._handle_ret_tup(sock_state, ret_tup)
+            if process_state is None:
+                continue
+            elif process_state:
+                self._process_buffer(sock_state, sock_state[SockState.SOCK_VIEW],
+                                     sock_state[SockState.SOCK_RECV_BYTES])
+            else:
+                self._writable_socket(sock_state)
+
+    def _set_poll_events(self, sock_state, events):
+        """Change the poll events of a managed socket (if they differ from the current ones)."""
+        if sock_state[SockState.SOCK_POLL_EVENTS] != events:
+            sock_state[SockState.SOCK_POLL_EVENTS] = events
+            self._poller.modify(sock_state[SockState.SOCK_SOCKET].fileno(), events)
+
+    @staticmethod
+    def _is_paused(sock_state):
+        """Return True if the session is not being read due to the buffer limits."""
+        return sock_state[SockState.SOCK_NEXT_CB] is not None and \
+            sock_state[SockState.SOCK_OFFLOAD_JOB] is None and \
+            not sock_state[SockState.SOCK_POLL_EVENTS] & emews.base.poller.PollEvents.POLL_READ
+
+    def _over_buffer_limit(self, sock_state):
+        """
+        Return True if the session should stop being read (backpressure).
+
+        Bytes received and not yet processed count towards the limits, along with the data queued
+        to send.  A session holding nothing but a partial field keeps being read, as its bytes are
+        only released once the field completes (they are capped by max_field_size).
+        """
+        send_bytes = sock_state[SockState.SOCK_SEND_BYTES]
+        if not send_bytes and sock_state[SockState.SOCK_RECV_BYTES]:
+            return False
+
+        return send_bytes + sock_state[SockState.SOCK_RECV_BYTES] > self._session_buffer_limit or \
+            self._buffered_bytes > self._global_buffer_limit
+
+    def _set_read_events(self, sock_state, events):
+        """
+        Poll a session for reads (along with the given events), unless over the buffer limits.
+
+        Paused sessions are resumed as their queued data is sent (see _writable_socket), or once
+        the global buffered bytes are back under the limit (see _resume_paused).
+        """
+        fd = sock_state[SockState.SOCK_SOCKET].fileno()
+        if self._over_buffer_limit(sock_state):
+            self._paused[fd] = sock_state
+        else:
+            self._paused.pop(fd, None)
+            events |= emews.base.poller.PollEvents.POLL_READ
+
+        self._set_poll_events(sock_state, events)
+
+    def _resume_paused(self):
+        """Resume reading the paused sessions no longer over the buffer limits."""
+        for sock_state in self._paused.values():
+            self._set_read_events(
+                sock_state, emews.base.poller.PollEvents.POLL_WRITE
+                if sock_state[SockState.SOCK_SEND_QUEUE] else 0)
+
+    @staticmethod
+    def _send_buffers(sock, send_queue, send_offset):
+        """
+        Send the queued buffers one at a time, return the number of bytes sent.
+
+        Used if sendmsg() is not available (Python 2).  The buffers are sent in place (no copy),
+        rather than coalesced into a single buffer, which would copy all queued data on each send.
+        Sending stops at the first partial send.  Raises socket.error if no bytes could be sent.
+        """
+        bytes_sent = 0
+        for index in xrange(min(len(send_queue), ConnectionManager.SEND_IOV_MAX)):
+            data = memoryview(send_queue[index])[send_offset if index == 0 else 0:]
+            try:
+                sent = sock.send(data)
+            except socket.error:
+                if not bytes_sent:
+                    raise
+                # not writable anymore (or failed), the next writable event tells
+                break
 
-            if len(ret_tup) == 3:
-                # write mode
-                sock_state[SockState.SOCK_BUFFER] = ret_tup[2]  # data to be sent
+            bytes_sent += sent
+            if sent < len(data):
+                break
 
-                self._r_socks.remove(sock)
-                self._w_socks.append(sock)
+        return bytes_sent
 
-    def _writable_socket(self, sock):
+    def _writable_socket(self, sock_state):
         """
         Given a socket in a writable state, do something with it.
 
-        Send whatever data is returned from the socket's associated callback, and
-        then switch the socket from being writable to readable.
+        Send as much of the queued data as possible, in a single vectored send if sendmsg() is
+        available (see _send_buffers otherwise).  The socket remains readable while data is queued.
+        Once the queue is empty, stop managing the socket for a writable state, or close it if the
+        session has ended.
         """
-        sock_state = self._socks[sock]
+        sock = sock_state[SockState.SOCK_SOCKET]
+        send_queue = sock_state[SockState.SOCK_SEND_QUEUE]
+        send_offset = sock_state[SockState.SOCK_SEND_OFFSET]
 
-        bytes_sent = sock.send(sock_state[SockState.SOCK_BUFFER])
+        try:
+            if ConnectionManager.HAS_SENDMSG and len(send_queue) > 1:
+                # scatter/gather send of the queued buffers
+                buffers = [memoryview(send_queue[0])[send_offset:]]
+                for index in xrange(1, min(len(send_queue), ConnectionManager.SEND_IOV_MAX)):
+                    buffers.append(send_queue[index])
+                bytes_sent = sock.sendmsg(buffers)
+            else:
+                bytes_sent = self._send_buffers(sock, send_queue, send_offset)
+        except socket.error as ex:
+            if ex.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                # not writable after all, wait until it is
+                bytes_sent = 0
+            else:
+                self.logger.warning(
+                    "Socket error when sending data, closing socket (session %d): %s",
+                    sock_state[SockState.SOCK_SESSION_ID], ex)
+                self._close_socket(sock)
+                return
 
-        if bytes_sent < len(sock_state[SockState.SOCK_BUFFER]):
-            # not all bytes were sent - remove those bytes sent
-            sock_state[SockState.SOCK_BUFFER] = sock_state[SockState.SOCK_BUFFER][bytes_sent:]
+        if bytes_sent:
+            sock_state[SockState.SOCK_LAST_ACTIVE] = self._now
+            sock_state[SockState.SOCK_WRITE_START] = self._now
+            sock_state[SockState.SOCK_SEND_BYTES] -= bytes_sent
+            self._buffered_bytes -= bytes_sent
+
+        # remove the buffers sent (the first buffer may be partially sent)
+        bytes_sent += send_offset
+        while send_queue and bytes_sent >= len(send_queue[0]):
+            bytes_sent -= len(send_queue.popleft())
+        sock_state[SockState.SOCK_SEND_OFFSET] = bytes_sent
+
+        if send_queue:
+            # not all bytes were sent
+            self._arm_timer(sock_state)
+            if sock_state[SockState.SOCK_NEXT_CB] is None or \
+                    sock_state[SockState.SOCK_OFFLOAD_JOB] is not None:
+                # session ending or suspended: stop reading
+                self._set_poll_events(sock_state, emews.base.poller.PollEvents.POLL_WRITE)
+            else:
+                self._set_read_events(sock_state, emews.base.poller.PollEvents.POLL_WRITE)
             return
 
         # all bytes sent
@@ -241,22 +711,85 @@ class ConnectionManager(emews.base.baseobject.BaseObject):
             self._close_socket(sock)
             return
 
-        sock_state[SockState.SOCK_BUFFER] = ""  # clear cache
-        # switch to read mode
-        self._w_socks.remove(sock)
-        self._r_socks.append(sock)
+        if sock_state[SockState.SOCK_OFFLOAD_JOB] is not None:
+            self._set_poll_events(sock_state, 0)
+        else:
+            self._set_read_events(sock_state, 0)
+
+    def _session_deadline(self, sock_state):
+        """Return the (deadline, timeout name) of a session, or (None, None) if it has none."""
+        deadline = None
+        timeout_name = None
+
+        if self._idle_timeout >= 0:
+            deadline = sock_state[SockState.SOCK_LAST_ACTIVE] + self._idle_timeout
+            timeout_name = 'idle'
+
+        # (data held while the session is suspended is not being read)
+        if self._read_timeout >= 0 and sock_state[SockState.SOCK_RECV_BYTES] and \
+                sock_state[SockState.SOCK_OFFLOAD_JOB] is None:
+            read_deadline = sock_state[SockState.SOCK_READ_START] + self._read_timeout
+            if deadline is None or read_deadline < deadline:
+                deadline = read_deadline
+                timeout_name = 'read'
+
+        if self._write_timeout >= 0 and sock_state[SockState.SOCK_SEND_QUEUE]:
+            write_deadline = sock_state[SockState.SOCK_WRITE_START] + self._write_timeout
+            if deadline is None or write_deadline < deadline:
+                deadline = write_deadline
+                timeout_name = 'write'
+
+        return deadline, timeout_name
+
+    def _arm_timer(self, sock_state):
+        """Make sure the session has a timer armed no later than its deadline."""
+        deadline = self._session_deadline(sock_state)[0]
+        if deadline is None:
+            return
+
+        timer_tick = sock_state[SockState.SOCK_TIMER_TICK]
+        if timer_tick is not None and timer_tick <= self._timers.tick_of(deadline):
+            # the armed timer fires first, the deadline is checked then
+            return
+
+        # any later timer of this session becomes stale, and is ignored when it fires
+        sock_state[SockState.SOCK_TIMER_TICK] = self._timers.schedule(
+            (sock_state[SockState.SOCK_SOCKET].fileno(), sock_state[SockState.SOCK_SESSION_ID]),
+            deadline)
+
+    def _expire_sessions(self):
+        """Close sessions whose deadline passed, rearm the timers of the others."""
+        for timer_tick, (fd, session_id) in self._timers.expire(self._now):
+            sock_state = self._socks.get(fd, None)
+            if sock_state is None or sock_state[SockState.SOCK_SESSION_ID] != session_id or \
+                    sock_state[SockState.SOCK_TIMER_TICK] != timer_tick:
+                # stale timer (session closed or timer superseded)
+                continue
+
+            sock_state[SockState.SOCK_TIMER_TICK] = None
+            deadline, timeout_name = self._session_deadline(sock_state)
 
-    def _exceptional_socket(self, sock):
+            if deadline is not None and deadline <= self._now:
+                self.logger.info("Session id %d reached its %s timeout, closing socket ...",
+                                 session_id, timeout_name)
+                self._close_socket(sock_state[SockState.SOCK_SOCKET])
+                continue
+
+            self._arm_timer(sock_state)
+
+    def _exceptional_socket(self, sock_state):
         """Close a sock in such a state."""
         self.logger.debug("Closing socket in exceptional state (session %d).",
-                          self._socks[sock][SockState.SOCK_SESSION_ID])
-        self._close_socket(sock)
+                          sock_state[SockState.SOCK_SESSION_ID])
+        self._close_socket(sock_state[SockState.SOCK_SOCKET])
 
     def _setup_listener(self):
         """Create listener (server socket) to manage."""
         # parameter checks
         if self._port < 1 or self._port > 65535:
             raise ValueError("Port is out of range (must be between 1 and 65535, given: %d)" % self._port)
+        if self._listen_backlog < 1:
+            raise ValueError("Listen backlog must be positive (given: %d)" % self._listen_backlog)
         if self._port < 1024:
             self.logger.warning("Port is less than 1024 (given: %d).  "
                                 "Elevated permissions may be needed for binding.", self._port)
@@ -265,6 +798,9 @@ class ConnectionManager(emews.base.baseobject.BaseObject):
         try:
             serv_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             serv_sock.setblocking(0)
+            if self._hub_workers is not None:
+                # hub reactor processes share the port, the kernel balances connections among them
+                serv_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         except socket.error as ex:
             self.logger.error("Could not instantiate new listener socket: %s", ex)
             raise
@@ -276,7 +812,7 @@ class ConnectionManager(emews.base.baseobject.BaseObject):
             self.logger.error("Could not bind new listener socket to interface: %s", ex)
             raise
         try:
-            serv_sock.listen(5)
+            serv_sock.listen(self._listen_backlog)
         except socket.error as ex:
             serv_sock.close()
             self.logger.error("New listener socket threw socket.error on listen(): %s", ex)
@@ -284,6 +820,52 @@ class ConnectionManager(emews.base.baseobject.BaseObject):
 
         self.logger.debug("New listener socket on port %d.", self._port)
 
-        self._r_socks.append(serv_sock)
-        self._e_socks.append(serv_sock)
-        self._listener_sock = serv_sock
+        self._add_listener(serv_sock)
+
+        if self._hub_workers is not None and self._hub_workers.is_owner:
+            # private listener used by the other hub workers to relay requests to the owner
+            self._add_listener(self._hub_workers.owner_listener)
+            self.logger.debug("Hub owner listener on %s:%d.", *self._hub_workers.owner_addr)
+
+        if self._unix_path is not None and \
+                (self._hub_workers is None or self._hub_workers.is_owner):
+            self._setup_unix_listener()
+
+    def _setup_unix_listener(self):
+        """Create the AF_UNIX listener, used by node-local clients (same protocols as TCP)."""
+        # remove a socket file left behind by an earlier run
+        self._remove_unix_path()
+
+        try:
+            serv_sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            serv_sock.setblocking(0)
+        except socket.error as ex:
+            self.logger.error("Could not instantiate new unix listener socket: %s", ex)
+            raise
+
+        try:
+            serv_sock.bind(self._unix_path)
+            serv_sock.listen(self._listen_backlog)
+        except socket.error as ex:
+            serv_sock.close()
+            self.logger.error("Could not bind unix listener socket to path '%s': %s",
+                              self._unix_path, ex)
+            raise
+
+        self.logger.debug("New unix listener socket on path '%s'.", self._unix_path)
+
+        self._add_listener(serv_sock)
+
+    def _remove_unix_path(self):
+        """Remove the AF_UNIX listener path, if it exists and is a socket."""
+        try:
+            if stat.S_ISSOCK(os.stat(self._unix_path).st_mode):
+                os.unlink(self._unix_path)
+        except OSError:
+            # path does not exist
+            pass
+
+    def _add_listener(self, listener_sock):
+        """Manage a (bound and listening) listener socket."""
+        self._poller.register(listener_sock.fileno(), emews.base.poller.PollEvents.POLL_READ)
+        self._listener_socks[listener_sock.fileno()] = listener_sock
@@ -11,7 +11,7 @@ class net_protocols(object):
 
     __slots__ = ()
 
-    ENUM_SIZE = 7
+    ENUM_SIZE = 8
 
     NET_NONE = 0       # placeholder
     NET_CC_1 = 1       # CC channel (future)
@@ -20,6 +20,17 @@ class net_protocols(object):
     NET_AGENT = 4      # agent-based communication
     NET_HUB = 5        # hub-based communication
     NET_SPAWN = 6      # service spwaning
+    NET_MUX = 7        # multiplexed sessions (channels) over a single connection (requires v2)
+
+
+class net_flags(object):
+    """Flags carried in the upper bits of the net protocol id sent in the session header."""
+
+    __slots__ = ()
+
+    NET_FLAG_V2 = 0x8000     # session uses length-prefixed (v2) framing
+    NET_FLAG_SEQ = 0x4000    # session is pipelined, v2 frames carry a sequence id (requires v2)
+    NET_PROTO_MASK = 0x0fff  # bits holding the net protocol id
 
 
 class hub_protocols(object):
@@ -27,11 +38,14 @@ class hub_protocols(object):
 
     __slots__ = ()
 
-    ENUM_SIZE = 3
+    ENUM_SIZE = 6
 
-    HUB_NONE = 0            # placeholder
-    HUB_NODE_ID_REQ = 1     # request a global node id
-    HUB_SERVICE_ID_REQ = 2  # request a global service id
+    HUB_NONE = 0               # placeholder
+    HUB_NODE_ID_REQ = 1        # request a global node id
+    HUB_SERVICE_ID_REQ = 2     # request a global service id
+    HUB_STATS = 3              # request traffic and reactor statistics (json string)
+    HUB_SERVICE_ID_LEASE = 4   # lease a block of global service ids (returns the first id)
+    HUB_SERVICE_ID_REPORT = 5  # report leased service ids given to services
 
 
 class spawner_protocols(object):
@@ -50,12 +64,13 @@ class agent_protocols(object):
 
     __slots__ = ()
 
-    ENUM_SIZE = 4
+    ENUM_SIZE = 5
 
-    AGENT_NONE = 0     # placeholder
-    AGENT_ENV_ID = 1   # get id from environment context
-    AGENT_ASK = 2      # get a state key from a env context
-    AGENT_TELL = 3     # update a value toward a state
+    AGENT_NONE = 0       # placeholder
+    AGENT_ENV_ID = 1     # get id from environment context
+    AGENT_ASK = 2        # get a state key from a env context (comma separated string)
+    AGENT_TELL = 3       # update a value toward a state
+    AGENT_ASK_ARRAY = 4  # get a state key from a env context (packed array)
 
 
 class net_state(object):
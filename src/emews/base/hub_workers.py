@@ -0,0 +1,140 @@
+"""
+Multi-process hub support.
+
+The hub can run several reactor (ConnectionManager) processes.  Each one binds the communication
+port using SO_REUSEPORT, so the kernel spreads incoming connections among them.  Hub state which
+must be global is coordinated as follows:
+- node and service id counters are kept in shared memory (SharedIdCounters)
+- agent environments are owned by the first (owner) process; the other worker processes relay agent
+  requests to the owner over a private loopback listener (see serv_agent.ServAgentRelay)
+
+Workers are forked before any threads are started.
+
+Created on Oct 17, 2026
+"""
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+
+import emews.base.baseobject
+
+
+class IdCounters(object):
+    """
+    Global id counters of a single (process) hub.
+
+    Ids may be requested from several threads (direct hub queries, offloaded handlers).
+    """
+
+    __slots__ = ('_ids', '_lock')
+
+    ENUM_SIZE = 2
+
+    NODE_ID = 0
+    SERVICE_ID = 1
+
+    def __init__(self, first_node_id=2, first_service_id=2):
+        """Constructor."""
+        self._ids = [first_node_id, first_service_id]
+        self._lock = threading.Lock()
+
+    def next_id(self, counter, count=1):
+        """Return the next unassigned id of the given counter, assigning count ids from it."""
+        with self._lock:
+            new_id = self._ids[counter]
+            self._ids[counter] = new_id + count
+        return new_id
+
+    def issued(self, counter, id_val):
+        """Return True if id_val was assigned by the given counter."""
+        return 0 < id_val < self._ids[counter]
+
+
+class SharedIdCounters(IdCounters):
+    """Global id counters kept in shared memory, shared among all hub processes."""
+
+    __slots__ = ()
+
+    def __init__(self, first_node_id=2, first_service_id=2):
+        """Constructor."""
+        # Note that IdCounters.__init__ is not invoked, as _ids lives in shared memory here.
+        self._ids = multiprocessing.RawArray('L', [first_node_id, first_service_id])
+        self._lock = multiprocessing.Lock()
+
+
+class HubWorkers(emews.base.baseobject.BaseObject):
+    """Forks and manages the hub reactor worker processes."""
+
+    __slots__ = ('worker_index', 'id_counters', 'owner_addr', '_owner_sock', '_num_workers',
+                 '_worker_pids')
+
+    def __init__(self, num_workers):
+        """Constructor."""
+        super(HubWorkers, self).__init__()
+
+        if num_workers < 2:
+            raise ValueError("At least two hub workers are required (given: %d)" % num_workers)
+
+        self._num_workers = num_workers
+        self._worker_pids = []
+        self.worker_index = 0  # worker 0 is the owner (this process)
+        self.id_counters = SharedIdCounters()
+
+        # Private listener of the owner, used by the other workers to relay agent requests.  It is
+        # bound here so its address is known to the workers once forked.
+        self._owner_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._owner_sock.setblocking(0)
+        self._owner_sock.bind(('127.0.0.1', 0))
+        self._owner_sock.listen(128)
+        self.owner_addr = self._owner_sock.getsockname()
+
+    @property
+    def is_owner(self):
+        """Return True if this process is the owner (worker 0)."""
+        return self.worker_index == 0
+
+    @property
+    def num_workers(self):
+        """Return the number of hub reactor processes (including the owner)."""
+        return self._num_workers
+
+    @property
+    def owner_listener(self):
+        """Return the private listener socket of the owner (None in other workers)."""
+        return self._owner_sock
+
+    def spawn_workers(self):
+        """Fork the worker processes.  Returns the worker index of the calling process."""
+        for worker_index in xrange(1, self._num_workers):
+            pid = os.fork()
+            if pid == 0:
+                # worker process
+                self.worker_index = worker_index
+                self._worker_pids = []
+                self._owner_sock.close()
+                self._owner_sock = None
+                return worker_index
+
+            self._worker_pids.append(pid)
+            self.logger.info("Forked hub worker %d (pid %d).", worker_index, pid)
+
+        return 0
+
+    def stop_workers(self):
+        """Ask the worker processes to shut down, and wait for them (owner only)."""
+        for pid in self._worker_pids:
+            try:
+                os.kill(pid, signal.SIGINT)
+            except OSError:
+                # already terminated
+                pass
+
+        for pid in self._worker_pids:
+            try:
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+
+        self._worker_pids = []
@@ -4,12 +4,24 @@ Base Logger, module level.
 Created on Feb 21, 2019
 @author: Brian Ricks
 """
+import collections
 import logging.handlers
+import socket
 import struct
+import threading
+import time
+import zlib
 
 import emews.base.enums
 
 
+# a batch of log records starts with this byte (pickled log records never do)
+LOG_BATCH_TAG = '\x00'
+LOG_BATCH_MAX_BYTES = 262144  # uncompressed bytes of records above which a batch is shipped
+LOG_BATCH_COMPRESS_LEVEL = 1  # zlib level, log records compress well even at the fastest
+LOG_LOST_REPORT_INTERVAL = 10  # min seconds between reports of records not shipped to the hub
+LOG_CLOSE_WAIT = 5  # max seconds to wait on shipping the queued records when closing
+
 _base_logger = None
 
 
@@ -19,21 +31,220 @@ def get_logger():
 
 
 class DistLogger(logging.handlers.SocketHandler):
-    """Provides protocol compability for the SocketHandler class."""
+    """
+    Provides protocol compability for the SocketHandler class.
+
+    Logging a record only queues it: a single shipper thread owns the hub connection, and ships the
+    queued records so a slow (or unreachable) hub never stalls the logging threads.  The queue is
+    a ring of queue_size records, when full the oldest record is dropped.
+
+    Records are gathered into batches, each shipped (zlib compressed) as a single log message once
+    batch_max_records records are gathered, or once its oldest record waited batch_max_delay
+    seconds.  A batch_max_records of 1 ships each record on its own.
+    """
 
-    def __init__(self, host, port, node_id):
+    def __init__(self, host, port, node_id, batch_max_records=1, batch_max_delay=0,
+                 queue_size=10000):
         """Constructor."""
         super(DistLogger, self).__init__(host, port)
         self._node_id = node_id  # no __slots__, as base class doesn't use it
+        self._open_channel = None  # if set, returns a channel of the multiplexed hub connection
+        self._batch_max_records = batch_max_records
+        self._batch_max_delay = batch_max_delay
+        self._queue = collections.deque(maxlen=queue_size)  # records not taken by the shipper
+        self._queue_event = threading.Event()  # wakes the shipper when records are queued
+        self._ship_lock = threading.Lock()  # held while the shipper uses the connection
+        self._shipper = None  # started on the first record
+        self._flush_requested = False
+        self._closed = False
+        self._stats = {'queued': 0, 'shipped': 0, 'dropped': 0, 'unsent': 0}
+        self._stats_lock = threading.Lock()  # counters are updated by logging and shipper threads
+        self._reported = (0, 0)  # dropped and unsent counts last reported
+        self._report_time = 0
+
+    def use_channel(self, open_channel):
+        """
+        Ship records over a channel of the multiplexed hub connection, instead of a connection.
+
+        open_channel is a callable returning a new channel (see NetClient.open_hub_channel).
+        """
+        with self._ship_lock:
+            self._open_channel = open_channel
+            if self.sock:
+                self.sock.close()
+                self.sock = None  # the channel is opened on the next record
+
+    def stats(self):
+        """Return the record counters: queued, shipped, dropped (queue full, closed) and unsent."""
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def emit(self, record):
+        """@Override queue the record for the shipper."""
+        # (the handler lock is held, so close() can't set _closed meanwhile)
+        if self._closed:
+            # the shipper is gone, nothing ships the record
+            with self._stats_lock:
+                self._stats['dropped'] += 1
+            return
+
+        try:
+            # the message arguments may change once the caller continues, so format them now
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                self.format(record)  # caches the exception text
+                record.exc_info = None
+        except Exception:  # pylint: disable=broad-except
+            self.handleError(record)
+            return
+
+        with self._stats_lock:
+            if len(self._queue) == self._queue.maxlen:
+                self._stats['dropped'] += 1  # the oldest record is dropped on append
+            self._stats['queued'] += 1
+        self._queue.append(record)
+
+        if self._shipper is None:
+            self._shipper = threading.Thread(target=self._run_shipper, name='DistLogger')
+            self._shipper.daemon = True
+            self._shipper.start()
+
+        if not self._queue_event.is_set():
+            self._queue_event.set()
+
+    def flush(self):
+        """@Override ship the queued records without waiting for their batch to fill up."""
+        self._flush_requested = True
+        self._queue_event.set()
+
+    def close(self):
+        """@Override ship the queued records before closing."""
+        self.acquire()
+        try:
+            self._closed = True
+            shipper = self._shipper
+        finally:
+            self.release()
+
+        if shipper is not None and shipper is not threading.current_thread():
+            self._queue_event.set()
+            shipper.join(LOG_CLOSE_WAIT)
+
+        super(DistLogger, self).close()
+
+    def _run_shipper(self):
+        """Ship the queued records to the hub."""
+        batch = []  # records taken from the queue, not shipped yet
+        batch_bytes = 0
+        batch_deadline = 0  # time the batch is shipped if it doesn't fill up before
+
+        while True:
+            self._queue_event.clear()  # cleared before taking records, so no wakeup is missed
+            closed = self._closed
+            flush = self._flush_requested
+            self._flush_requested = False
+
+            while self._queue:
+                record = self._queue.popleft()
+                try:
+                    if self._batch_max_records <= 1:
+                        self._ship([record], self.makePickle(record))
+                        continue
+
+                    # plain SocketHandler pickle: the batch itself is framed when shipped
+                    data = logging.handlers.SocketHandler.makePickle(self, record)
+                except Exception:  # pylint: disable=broad-except
+                    self.handleError(record)
+                    continue
+
+                if not batch:
+                    batch_deadline = time.time() + self._batch_max_delay
+                batch.append(data)
+                batch_bytes += len(data)
+
+                if len(batch) >= self._batch_max_records or batch_bytes >= LOG_BATCH_MAX_BYTES:
+                    self._ship_batch(batch)
+                    batch = []
+                    batch_bytes = 0
+
+            wait_time = None  # no batch, wait for records
+            if batch:
+                wait_time = batch_deadline - time.time()
+                if wait_time <= 0 or flush or closed:
+                    self._ship_batch(batch)
+                    batch = []
+                    batch_bytes = 0
+                    wait_time = None
+
+            if closed:
+                return
+
+            self._report_lost()
+            self._queue_event.wait(wait_time)
+
+    def _ship_batch(self, batch):
+        """Ship a batch of pickled records (length prefixed) as a single log message."""
+        data = LOG_BATCH_TAG + zlib.compress(''.join(batch), LOG_BATCH_COMPRESS_LEVEL)
+        data = struct.pack(">L", len(data)) + data
+        if self._open_channel is not None:
+            data = struct.pack(">L", len(data)) + data
+
+        self._ship(batch, data)
+
+    def _ship(self, records, data):
+        """Send a log message holding the given records."""
+        with self._ship_lock:
+            self.send(data)
+            sent = self.sock is not None
+
+        with self._stats_lock:
+            if sent:
+                self._stats['shipped'] += len(records)
+            else:
+                # connection errors drop the records, as the logging threads can't wait on them
+                self._stats['unsent'] += len(records)
+
+    def _report_lost(self):
+        """Log the number of records not shipped, if changed (at most once per interval)."""
+        with self._stats_lock:
+            lost = (self._stats['dropped'], self._stats['unsent'])
+        if lost == self._reported or time.time() - self._report_time < LOG_LOST_REPORT_INTERVAL:
+            return
+
+        self._reported = lost
+        self._report_time = time.time()
+        if _base_logger is not None:
+            # queued like any other record (an unreachable hub drops it too, reported later)
+            _base_logger.warning("Log records not shipped to the hub: %d dropped (queue full), "
+                                 "%d unsent (hub connection).", lost[0], lost[1])
+
+    def makeSocket(self, timeout=1):
+        """@Override open a channel of the multiplexed hub connection if used."""
+        if self._open_channel is not None:
+            return self._open_channel()
+
+        return super(DistLogger, self).makeSocket(timeout)
+
+    def makePickle(self, record):
+        """@Override records sent over a channel are v2 frames."""
+        data = super(DistLogger, self).makePickle(record)
+        if self._open_channel is not None:
+            return struct.pack(">L", len(data)) + data
+
+        return data
 
     def createSocket(self):
         """@Override send proto and node id upon successful connection."""
         super(DistLogger, self).createSocket()
         if self.sock:
             # send the proto id (logging) and node id to hub first
+            net_proto = emews.base.enums.net_protocols.NET_LOGGING
+            if self._open_channel is not None:
+                net_proto |= emews.base.enums.net_flags.NET_FLAG_V2
+
             try:
-                self.sock.sendall(
-                    struct.pack(">HL", emews.base.enums.net_protocols.NET_LOGGING, self._node_id))
-            except OSError:  # pragma: no cover
+                self.sock.sendall(struct.pack(">HL", net_proto, self._node_id))
+            except (OSError, socket.error):  # pragma: no cover
                 self.sock.close()
                 self.sock = None  # so we can call createSocket next time
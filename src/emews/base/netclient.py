@@ -4,21 +4,54 @@ Network client functionality.
 Created on Apr 17, 2019
 @author: Brian Ricks
 """
+import functools
+import os
+import random
+import select
 import socket
 import struct
+import sys
+import threading
+import time
 
+import emews.base.async_client
 import emews.base.baseclient
 import emews.base.baseobject
 import emews.base.baseserv
 import emews.base.enums
 
 """
-TODO: Refactor this to only use a single connection to the hub node.  So instead of multiple
-connections to the hub per node, we establish a single connection, and keep it persistent
-throughout an experimental run.  This would have the additional benefit of freeing 'None' for use
-to return (ie, if something being looked up doesn't exist).
+Note: client sessions to the hub node are carried as channels over a single persistent connection
+(see HubMux), if communication: hub_multiplex is enabled.
+TODO: This would have the additional benefit of freeing 'None' for use to return (ie, if something
+being looked up doesn't exist).
 """
 
+_NOT_ANSWERED = object()  # result of a request not known to be processed by the server
+
+
+def recv_exactly(sock, view, is_interrupted=None):
+    """
+    Receive exactly len(view) bytes from sock into view (a writable memoryview).
+
+    Returns the number of bytes received, which is less than len(view) only if the connection was
+    closed by the peer, or if is_interrupted (a callable checked before each recv) returned True.
+    Socket errors (including timeouts) are raised.
+    """
+    num_bytes = len(view)
+    offset = 0
+    while offset < num_bytes:
+        if is_interrupted is not None and is_interrupted():
+            break
+
+        chunk_len = sock.recv_into(view[offset:])
+        if not chunk_len:
+            break
+
+        offset += chunk_len
+
+    return offset
+
 
 # client classes - these run in separate threads and are suitable for ThreadDispatcher dispatch
 class BroadcastMessage(emews.base.baseclient.BaseClient):
@@ -56,11 +89,493 @@ class BroadcastMessage(emews.base.baseclient.BaseClient):
         self.logger.debug("%s: Broadcast finished.", self._client_name)
 
 
+class MuxChannel(object):
+    """
+    A channel of a HubMux connection.
+
+    A channel behaves as a (blocking) socket of a v2 client session: the first data sent is the
+    session header, followed by v2 frames.  Data received are the v2 response frames of the
+    channel.  A channel is used by a single thread at a time (as a session socket would be).
+    """
+
+    __slots__ = ('channel_id', 'conn_index', 'recv_buf', 'header_sent', 'closed', '_mux')
+
+    def __init__(self, mux, channel_id, conn_index):
+        """Constructor."""
+        self.channel_id = channel_id
+        self.conn_index = conn_index    # HubMux connection the channel belongs to
+        self.recv_buf = bytearray()     # v2 frames received, not read yet
+        self.header_sent = False
+        self.closed = False
+        self._mux = mux
+
+    def sendall(self, data):
+        """Send the session header, or v2 frames."""
+        self._mux.send(self, data)
+
+    def recv(self, num_bytes):
+        """Receive up to num_bytes.  Returns an empty string if the channel is closed."""
+        return self._mux.recv(self, num_bytes)
+
+    def recv_into(self, view):
+        """Receive up to len(view) bytes into view.  Returns 0 if the channel is closed."""
+        return self._mux.recv_into(self, view)
+
+    def shutdown(self, how):
+        """Nothing to shut down, the connection is shared."""
+        pass
+
+    def close(self):
+        """Close the channel."""
+        self._mux.close_channel(self)
+
+
+class HubMux(emews.base.baseobject.BaseObject):
+    """
+    Single persistent connection to the hub node, carrying client sessions as channels.
+
+    Each channel is a v2 client session of its own (see NetServ._handle_mux_frame).  The connection
+    is established on first use, and re-established on next use if lost (all channels open at that
+    time are closed, and their sessions reconnect as they would on a socket error).  Frames received
+    are read by whichever thread waits on a response, and stored in the buffer of their channel.
+    """
+
+    __slots__ = ('_connect', '_node_id', '_sock', '_conn_index', '_channels', '_next_channel_id',
+                 '_send_lock', '_cond', '_reading', '_recv_buf')
+
+    MAX_CHANNELS = 0x7fff  # the upper bit of a channel id is CHANNEL_OPEN_FLAG (CHANNEL_CLOSE_FLAG)
+
+    def __init__(self, connect, node_id):
+        """
+        Constructor.
+
+        connect is a callable returning a (blocking) socket connected to the hub.
+        """
+        super(HubMux, self).__init__()
+
+        self._connect = connect
+        self._node_id = node_id
+        self._sock = None
+        self._conn_index = 0       # incremented on each new connection
+        self._channels = {}        # [channel_id]: MuxChannel
+        self._next_channel_id = 1
+        self._send_lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._reading = False      # True if a thread is reading from the connection
+        self._recv_buf = bytearray()  # partial frame received (kept across recv timeouts)
+
+    def open_channel(self):
+        """Return a new channel (the connection is established if needed)."""
+        with self._cond:
+            if self._sock is None:
+                sock = self._connect()
+                try:
+                    sock.sendall(emews.base.baseserv.HEADER_STRUCT.pack(
+                        emews.base.enums.net_protocols.NET_MUX |
+                        emews.base.enums.net_flags.NET_FLAG_V2, self._node_id))
+                except socket.error:
+                    sock.close()
+                    raise
+
+                self._sock = sock
+                self._conn_index += 1
+                self._recv_buf = bytearray()
+                self.logger.info("Multiplexed connection to the hub established.")
+
+            if len(self._channels) >= HubMux.MAX_CHANNELS:
+                raise socket.error("No free channel ids on the multiplexed hub connection.")
+
+            while self._next_channel_id in self._channels:
+                self._next_channel_id = self._next_channel_id % HubMux.MAX_CHANNELS + 1
+
+            channel = MuxChannel(self, self._next_channel_id, self._conn_index)
+            self._channels[channel.channel_id] = channel
+            self._next_channel_id = self._next_channel_id % HubMux.MAX_CHANNELS + 1
+
+        return channel
+
+    def _disconnect(self):
+        """Close the connection, and all of its channels (self._cond must be held)."""
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+        for channel in self._channels.itervalues():
+            channel.closed = True
+        self._channels.clear()
+        self._cond.notify_all()
+
+    def send(self, channel, data):
+        """Send data on the channel (the session header, or v2 frames)."""
+        if channel.closed or channel.conn_index != self._conn_index:
+            raise socket.error("Channel %d is closed." % channel.channel_id)
+
+        if not channel.header_sent:
+            channel.header_sent = True
+            frames = [emews.base.baseserv.MUX_HEADER_STRUCT.pack(
+                len(data) + emews.base.baseserv.CHANNEL_ID_STRUCT.size,
+                channel.channel_id | emews.base.baseserv.CHANNEL_OPEN_FLAG), data]
+        else:
+            # re-frame each v2 frame as a multiplexed frame
+            frames = []
+            offset = 0
+            while offset < len(data):
+                frame_len = emews.base.baseserv.FRAME_LEN_STRUCT.unpack_from(data, offset)[0]
+                offset += emews.base.baseserv.FRAME_LEN_STRUCT.size
+                frames.append(emews.base.baseserv.MUX_HEADER_STRUCT.pack(
+                    frame_len + emews.base.baseserv.CHANNEL_ID_STRUCT.size, channel.channel_id))
+                frames.append(data[offset:offset + frame_len])
+                offset += frame_len
+
+        sock = self._sock
+        if sock is None:
+            raise socket.error("Multiplexed hub connection is closed.")
+
+        try:
+            with self._send_lock:
+                sock.sendall(''.join(frames))
+        except socket.error:
+            with self._cond:
+                if sock is self._sock:
+                    self._disconnect()
+            raise
+
+    def _read_frame(self, sock):
+        """Read a multiplexed frame, return (channel id, frame body), None on connection close."""
+        header_size = emews.base.baseserv.MUX_HEADER_STRUCT.size
+        frame_len = None
+        while True:
+            if frame_len is None and len(self._recv_buf) >= header_size:
+                frame_len = emews.base.baseserv.FRAME_LEN_STRUCT.unpack_from(self._recv_buf)[0]
+
+            if frame_len is not None and \
+                    len(self._recv_buf) >= emews.base.baseserv.FRAME_LEN_STRUCT.size + frame_len:
+                break
+
+            chunk = sock.recv(65536)
+            if not len(chunk):
+                return None
+
+            self._recv_buf.extend(chunk)
+
+        channel_id = emews.base.baseserv.CHANNEL_ID_STRUCT.unpack_from(
+            self._recv_buf, emews.base.baseserv.FRAME_LEN_STRUCT.size)[0]
+        body = self._recv_buf[header_size:emews.base.baseserv.FRAME_LEN_STRUCT.size + frame_len]
+        del self._recv_buf[:emews.base.baseserv.FRAME_LEN_STRUCT.size + frame_len]
+
+        return (channel_id, body)
+
+    def _wait_data(self, channel):
+        """Wait until v2 frames of the channel are received, or it is closed (self._cond held)."""
+        while not channel.recv_buf and not channel.closed:
+            if self._reading:
+                # another thread reads the connection, wait for it to hand over our frames
+                self._cond.wait()
+                continue
+
+            sock = self._sock
+            if sock is None or channel.conn_index != self._conn_index:
+                channel.closed = True
+                return
+
+            self._reading = True
+            self._cond.release()
+            recv_ex = None
+            try:
+                frame = self._read_frame(sock)
+            except socket.error as ex:
+                recv_ex = ex
+            finally:
+                self._cond.acquire()
+                self._reading = False
+                self._cond.notify_all()
+
+            if isinstance(recv_ex, socket.timeout):
+                # the connection is kept (as well as any partial frame read)
+                raise recv_ex
+            elif recv_ex is not None or frame is None:
+                self.logger.info("Multiplexed connection to the hub lost: %s",
+                                 "closed remotely" if recv_ex is None else recv_ex)
+                if sock is self._sock:
+                    self._disconnect()
+
+                if recv_ex is not None:
+                    raise recv_ex
+                return
+
+            channel_id = frame[0] & ~emews.base.baseserv.CHANNEL_CLOSE_FLAG
+            recv_channel = self._channels.get(channel_id, None)
+            if recv_channel is None:
+                # channel closed on our side already
+                continue
+
+            if frame[0] & emews.base.baseserv.CHANNEL_CLOSE_FLAG:
+                # closed by the hub
+                recv_channel.closed = True
+                del self._channels[channel_id]
+            else:
+                # response frames may be empty (an empty string or array)
+                recv_channel.recv_buf.extend(
+                    emews.base.baseserv.FRAME_LEN_STRUCT.pack(len(frame[1])))
+                recv_channel.recv_buf.extend(frame[1])
+
+    def recv(self, channel, num_bytes):
+        """Receive up to num_bytes of the v2 frames of the channel (an empty string if closed)."""
+        with self._cond:
+            self._wait_data(channel)
+            if not channel.recv_buf:
+                return ''
+
+            data = str(channel.recv_buf[:num_bytes])
+            del channel.recv_buf[:num_bytes]
+
+        return data
+
+    def recv_into(self, channel, view):
+        """Receive up to len(view) bytes of the v2 frames of the channel into view (0 if closed)."""
+        with self._cond:
+            self._wait_data(channel)
+            num_bytes = min(len(view), len(channel.recv_buf))
+            view[:num_bytes] = channel.recv_buf[:num_bytes]
+            del channel.recv_buf[:num_bytes]
+
+        return num_bytes
+
+    def close_channel(self, channel):
+        """Close the channel, letting the hub know."""
+        with self._cond:
+            if channel.closed:
+                return
+
+            channel.closed = True
+            if self._channels.get(channel.channel_id, None) is not channel:
+                return
+
+            del self._channels[channel.channel_id]
+            sock = self._sock
+
+        if channel.header_sent and sock is not None:
+            try:
+                with self._send_lock:
+                    sock.sendall(emews.base.baseserv.MUX_HEADER_STRUCT.pack(
+                        emews.base.baseserv.CHANNEL_ID_STRUCT.size, channel.channel_id))
+            except socket.error:
+                pass
+
+    def close(self):
+        """Close the connection."""
+        with self._cond:
+            self._disconnect()
+
+
+class ConnectionPool(emews.base.baseobject.BaseObject):
+    """
+    Idle client session connections, kept open for reuse by later sessions.
+
+    A connection is keyed by the session header sent on it: destination address, server protocol,
+    node id, and whether the session is sequenced.  Once a session is closed by the client, its
+    connection is checked in, and checked out by the next session with the same key, saving the
+    connect (and header) of a new connection.  Connections idle for longer than idle_timeout are
+    closed, as are connections found readable (closed by the server, or with unexpected data
+    pending) when checked in or out.
+    """
+
+    __slots__ = ('_max_idle', '_idle_timeout', '_idle', '_lock')
+
+    def __init__(self, max_idle, idle_timeout):
+        """Constructor."""
+        super(ConnectionPool, self).__init__()
+
+        self._max_idle = max_idle          # idle connections kept per key
+        self._idle_timeout = idle_timeout  # seconds a connection may stay idle
+        self._idle = {}  # [key]: list of (socket, next sequence id, checkin time), newest last
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _is_stale(sock):
+        """Return True if an idle connection cannot be reused (readable, or closed)."""
+        poller = select.poll()
+        try:
+            poller.register(sock, select.POLLIN)
+            return bool(poller.poll(0))
+        except (socket.error, select.error, ValueError):
+            return True
+
+    def checkout(self, key):
+        """Return (socket, next sequence id) of an idle connection for key, None if none."""
+        now = time.time()
+        while True:
+            with self._lock:
+                idle = self._idle.get(key, None)
+                if not idle:
+                    return None
+
+                sock, seq_id, checkin_time = idle.pop()
+                if not idle:
+                    del self._idle[key]
+
+            if now - checkin_time < self._idle_timeout and not ConnectionPool._is_stale(sock):
+                return (sock, seq_id)
+
+            # the server may close idle sessions at any time, so don't bother with a shutdown
+            sock.close()
+
+    def checkin(self, key, sock, seq_id):
+        """Keep the connection of a closed session.  Returns False if not kept (caller closes)."""
+        if self._max_idle < 1 or ConnectionPool._is_stale(sock):
+            return False
+
+        expired = []
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            now = time.time()
+            while idle and now - idle[0][2] >= self._idle_timeout:
+                expired.append(idle.pop(0)[0])
+
+            kept = len(idle) < self._max_idle
+            if kept:
+                idle.append((sock, seq_id, now))
+            elif not idle:
+                del self._idle[key]
+
+        for expired_sock in expired:
+            expired_sock.close()
+
+        return kept
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            idle_lists = self._idle.values()
+            self._idle = {}
+
+        for idle in idle_lists:
+            for sock, _, _ in idle:
+                sock.close()
+
+
+class ReconnectBackoff(object):
+    """
+    Delays between reconnect attempts: exponential backoff with decorrelated jitter.
+
+    Each delay is drawn uniformly between the base delay and three times the previous delay (capped
+    at max_delay), so clients which lost their connections at the same time spread out their
+    attempts instead of reconnecting in lockstep.
+    """
+
+    __slots__ = ('_base', '_max_delay', '_delay')
+
+    def __init__(self, base, max_delay):
+        """Constructor."""
+        self._base = base
+        self._max_delay = max_delay
+        self._delay = base
+
+    def next_delay(self):
+        """Return the delay (seconds) before the next attempt."""
+        self._delay = min(self._max_delay, random.uniform(self._base, self._delay * 3))
+        return self._delay
+
+
+class CircuitBreakers(emews.base.baseobject.BaseObject):
+    """
+    Circuit breakers of the nodes connected to, shared by all sessions to a node.
+
+    Failures are failed connection attempts, and connections lost while waiting on a response.  Once
+    failure_threshold consecutive failures occur for a node, its circuit opens: connection attempts
+    to the node fail right away, without reaching the network.  Once reset_timeout seconds have
+    passed, a single attempt is let through (half open).  A response received from the node closes
+    the circuit, another failure opens it for reset_timeout again.  Reconnect statistics of all
+    nodes are kept as well.  A failure_threshold below 1 disables the breakers.
+    """
+
+    __slots__ = ('_threshold', '_reset_timeout', '_lock', '_nodes', '_counters')
+
+    COUNTERS = ('connect_failures', 'reconnects', 'circuit_opens', 'circuit_rejects',
+                'backoff_time')
+
+    def __init__(self, failure_threshold, reset_timeout):
+        """Constructor."""
+        super(CircuitBreakers, self).__init__()
+
+        self._threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._nodes = {}  # [addr]: [consecutive failures, time the circuit opened (None if closed)]
+        self._counters = dict.fromkeys(CircuitBreakers.COUNTERS, 0)
+
+    def allow(self, addr):
+        """Return True if a connection attempt to addr may be made."""
+        with self._lock:
+            node = self._nodes.get(addr, None)
+            if node is None or node[1] is None:
+                return True
+
+            now = time.time()
+            if now - node[1] >= self._reset_timeout:
+                # half open: let this attempt through, the next one once reset_timeout passes again
+                node[1] = now
+                self.logger.info("Circuit to node at address %s half open, attempting to connect.",
+                                 str(addr))
+                return True
+
+            self._counters['circuit_rejects'] += 1
+
+        return False
+
+    def failure(self, addr):
+        """Record a failure of addr, opening its circuit once failure_threshold is reached."""
+        if self._threshold < 1:
+            return
+
+        with self._lock:
+            node = self._nodes.setdefault(addr, [0, None])
+            node[0] += 1
+            if node[0] < self._threshold:
+                return
+
+            if node[1] is None:
+                self._counters['circuit_opens'] += 1
+                self.logger.warning(
+                    "Circuit to node at address %s opened after %d consecutive failures.",
+                    str(addr), node[0])
+            node[1] = time.time()
+
+    def success(self, addr):
+        """Record a response received from addr, closing its circuit."""
+        with self._lock:
+            node = self._nodes.pop(addr, None)
+
+        if node is not None and node[1] is not None:
+            self.logger.info("Circuit to node at address %s closed.", str(addr))
+
+    def count(self, counter, value=1):
+        """Add value to a reconnect statistics counter (see COUNTERS)."""
+        with self._lock:
+            self._counters[counter] += value
+
+    def stats(self):
+        """Return a dict of reconnect statistics, and the number of nodes with an open circuit."""
+        with self._lock:
+            stats = dict(self._counters)
+            stats['open_circuits'] = sum(
+                1 for node in self._nodes.itervalues() if node[1] is not None)
+
+        return stats
+
+
 class NetClient(emews.base.baseobject.BaseObject):
     """Classdocs."""
 
     __slots__ = ('_port', '_hub_addr', '_conn_timeout', '_conn_max_attempts', '_num_clients',
-                 '_session_id', 'hub_query', '_client_sessions', 'protocols')
+                 '_session_id', 'hub_query', '_client_sessions', 'protocols', '_framed',
+                 '_next_seq_ids', '_hub_mux', '_pool', '_recv_local', '_async_client',
+                 'hub_query_async', '_backoff_base', '_backoff_max', '_breakers', '_lease_lock',
+                 '_lease_cond', '_leasing', '_lease_max_size', '_lease_size', '_lease_next',
+                 '_lease_end', '_unreported', '_reporting', '_interrupt_event')
+
+    RECV_BUFFER_SIZE = 4096       # initial per thread receive buffer size
+    RECV_BUFFER_MAX_SIZE = 65536  # larger responses are received in a buffer of their own
 
     def __init__(self, config, hub_addr):
         """Constructor."""
@@ -72,32 +587,110 @@ class NetClient(emews.base.baseobject.BaseObject):
         self._conn_timeout = config['connect_timeout']
         self._conn_max_attempts = config['connect_max_attempts']
 
+        # reconnects back off, and nodes failing repeatedly are not connected to for a while
+        # (backoff waits end early once the client is interrupted)
+        self._interrupt_event = threading.Event()
+        self._backoff_base = config['reconnect_backoff_base']
+        self._backoff_max = config['reconnect_backoff_max']
+        self._breakers = CircuitBreakers(config['circuit_failure_threshold'],
+                                         config['circuit_reset_timeout'], _inject={'sys': self.sys})
+
+        # wire protocol version of client sessions: 2 (length-prefixed frames), or 1 (field by
+        # field, supported by all eMews versions)
+        if config['wire_protocol'] not in (1, 2):
+            raise ValueError("Wire protocol version must be 1 or 2 (given: %s)"
+                             % config['wire_protocol'])
+        self._framed = config['wire_protocol'] == 2
+
+        # client sessions to the hub carried as channels over a single connection (v2 only)
+        self._hub_mux = None
+        if config['hub_multiplex'] and self._framed and not self.sys.is_hub:
+            self._hub_mux = HubMux(self._new_connection, self.sys.node_id,
+                                   _inject={'sys': self.sys})
+
+        # idle client session connections (sessions to the hub are pooled if not multiplexed)
+        self._pool = ConnectionPool(config['pool_max_idle'], config['pool_idle_timeout'],
+                                    _inject={'sys': self.sys})
+
+        # asynchronous requests, run on pipelined sessions of a single I/O thread (see async_client)
+        self._async_client = emews.base.async_client.AsyncClient(
+            self._sock_addr, functools.partial(self._session_header, sequenced=True),
+            self._framed, config['poll_backend'], self._conn_timeout, config['response_timeout'],
+            self._conn_max_attempts, self._breakers, self._new_backoff, _inject={'sys': self.sys})
+
+        # Service ids are leased from the hub in blocks, doubling in size up to lease_max_size.
+        # Ids given to services are reported back to the hub (see next_service_id).
+        self._lease_lock = threading.Lock()
+        self._lease_cond = threading.Condition(self._lease_lock)  # notified once a lease completes
+        self._leasing = False  # True while a block is leased (the lock is released meanwhile)
+        self._lease_max_size = config['service_id_lease_max']
+        self._lease_size = 0
+        self._lease_next = 0  # next service id to give out
+        self._lease_end = 0   # end (exclusive) of the leased block
+        self._unreported = []  # service ids given out, not yet reported to the hub
+        self._reporting = False  # True while a report is sent
+
         self._num_clients = 0  # unique id given to client object instances
 
         self._client_sessions = {}  # sock management for client sessions
         self._session_id = 1  # sock session id (note, different than ConnectionManager session ids)
+        self._next_seq_ids = {}  # [session_id]: next request sequence id (pipelined sessions)
+        self._recv_local = threading.local()  # receive buffer of each thread using the client
 
         self.protocols = emews.base.baseserv.BaseServ.protocols
 
         # method pointers (allows monkey-patching)
         self.hub_query = self._hub_query
+        self.hub_query_async = self._hub_query_async
 
     def _sock_connect(self, addr=None):
-        """Connect to addr, return a (socket, dest_addr)."""
+        """
+        Connect to addr, return a (socket, dest_addr).
+
+        addr is either a node address (the eMews port is used), a (address, port) tuple, or the
+        path of a (node-local) AF_UNIX listener.
+        """
         connect_attempts = 0
         conn_addr = addr if addr is not None else self._hub_addr
+        sock_family, sock_addr = self._sock_addr(conn_addr)
+
+        backoff = None
+        while not self._interrupted:
+            if not self._breakers.allow(conn_addr):
+                err_msg = "Circuit to node at address %s is open, not connecting." % str(conn_addr)
+                self.logger.debug(err_msg)
+                raise IOError(err_msg)
+
+            if backoff is not None:
+                self._backoff_sleep(backoff)
+                if self._interrupted:
+                    break
 
-        while not self._interrupted and connect_attempts < self._conn_max_attempts:
             try:
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                sock = socket.socket(sock_family, socket.SOCK_STREAM)
                 sock.settimeout(self._conn_timeout)
-                sock.connect((conn_addr, self._port))
+                sock.connect(sock_addr)
+                if sock_family == socket.AF_INET:
+                    # Requests are sent whole, but a session header (or channel open frame) may
+                    # be followed by a request right away, so don't let Nagle hold it back.
+                    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
             except socket.error as ex:
                 sock.close()
                 connect_attempts += 1
+                self._breakers.count('connect_failures')
+                self._breakers.failure(conn_addr)
                 self.logger.debug(
                     "Connection attempt %d failed to connect to node at address %s: %s",
                     connect_attempts, str(conn_addr), ex)
+
+                if connect_attempts == self._conn_max_attempts:
+                    err_msg = "Exhausted attempts trying to connect to node at address %s." \
+                        % str(conn_addr)
+                    self.logger.error(err_msg)
+                    raise IOError(err_msg)
+
+                if backoff is None:
+                    backoff = self._new_backoff()
                 continue
 
             break  # forgetting this results in some nice flooding action
@@ -105,14 +698,74 @@ class NetClient(emews.base.baseobject.BaseObject):
         if self._interrupted:
             return None
 
-        if connect_attempts == self._conn_max_attempts:
-            sock.close()
-            err_msg = "Exhausted attempts trying to connect to node at address %s." % str(conn_addr)
-            self.logger.error(err_msg)
-            raise IOError(err_msg)
-
         return (sock, conn_addr)
 
+    def _sock_addr(self, addr):
+        """Return the (socket family, socket address) to connect to addr (see _sock_connect)."""
+        if isinstance(addr, tuple):
+            return (socket.AF_INET, addr)
+        elif addr.startswith(os.sep):
+            return (socket.AF_UNIX, addr)
+
+        return (socket.AF_INET, (addr, self._port))
+
+    def _new_backoff(self):
+        """Return a new ReconnectBackoff, for a sequence of reconnect attempts."""
+        return ReconnectBackoff(self._backoff_base, self._backoff_max)
+
+    def _backoff_sleep(self, backoff):
+        """Sleep for the next delay of backoff (returns right away once interrupted)."""
+        delay = backoff.next_delay()
+        self._breakers.count('backoff_time', delay)
+        self._interrupt_event.wait(delay)
+
+    def interrupt(self):
+        """@Override interrupt the client, ending any backoff sleep."""
+        super(NetClient, self).interrupt()
+        self._interrupt_event.set()
+
+    def _new_connection(self, addr=None):
+        """Return a new socket connected to addr (the hub if None), see _sock_connect()."""
+        conn_tup = self._sock_connect(addr)
+        if conn_tup is None:
+            raise socket.error("Interrupted while connecting to node at address %s."
+                               % str(addr if addr is not None else self._hub_addr))
+
+        return conn_tup[0]
+
+    def _session_connect(self, addr=None):
+        """
+        Return (socket, dest_addr) of a new client session.
+
+        If the session is to the hub (addr is None) and hub sessions are multiplexed, the socket is
+        a new channel of the multiplexed hub connection (MuxChannel).
+        """
+        if addr is None and self._hub_mux is not None:
+            return (self._hub_mux.open_channel(), self._hub_addr)
+
+        return self._sock_connect(addr)
+
+    def open_hub_channel(self):
+        """Return a new channel of the multiplexed hub connection (see MuxChannel)."""
+        if self._hub_mux is None:
+            raise AttributeError("Hub sessions are not multiplexed.")
+
+        return self._hub_mux.open_channel()
+
+    @property
+    def hub_multiplexed(self):
+        """Return True if client sessions to the hub are multiplexed over a single connection."""
+        return self._hub_mux is not None
+
+    def _session_header(self, serv_proto, node_id, sequenced=False):
+        """Return the session header (server protocol and node id) of a new client session."""
+        if self._framed:
+            serv_proto |= emews.base.enums.net_flags.NET_FLAG_V2
+            if sequenced:
+                serv_proto |= emews.base.enums.net_flags.NET_FLAG_SEQ
+
+        return emews.base.baseserv.HEADER_STRUCT.pack(serv_proto, node_id)
+
     def _client_session_reconnect(self, session_id):
         """Attempt to reconnect a failed connection."""
         if session_id not in self._client_sessions:
@@ -120,18 +773,25 @@ class NetClient(emews.base.baseobject.BaseObject):
             self.logger.error(err_msg)
             raise AttributeError(err_msg)
 
-        _, addr, serv_proto = self._client_sessions[session_id]
+        old_sock, addr, serv_proto, node_id = self._client_sessions[session_id]
 
-        sock = self._sock_connect(addr)[0]
+        self._breakers.count('reconnects')
+        conn_tup = self._session_connect(None if isinstance(old_sock, MuxChannel) else addr)
+        if conn_tup is None:
+            # interrupted
+            return
 
-        self._client_sessions[session_id] = (sock, addr, serv_proto)
+        sock = conn_tup[0]
+
+        self._client_sessions[session_id] = (sock, addr, serv_proto, node_id)
 
         self.logger.info(
             "Client-side session id %d: connection re-established to node address '%s'",
             session_id, str(addr))
 
         try:
-            sock.sendall(struct.pack(">HL", serv_proto, self.sys.node_id))
+            sock.sendall(self._session_header(
+                serv_proto, node_id, sequenced=session_id in self._next_seq_ids))
         except socket.error as ex:
             self.logger.warning(
                 "Client-side session id %d: connection issue on reconnect (serv protocol send): %s",
@@ -151,35 +811,167 @@ class NetClient(emews.base.baseobject.BaseObject):
 
         return class_def(*args, _inject=inject_dict)
 
-    def _hub_query(self, request_id):
+    def _hub_query(self, request_id, val_list=None):
         """
-        Given a request, return the corresponding result.
+        Given a request (and its values, if any), return the corresponding result.
 
         Note that this is a client-side (blocking) operation.
         """
         session_id = self.create_client_session(emews.base.enums.net_protocols.NET_HUB)
         protocol = self.protocols[emews.base.enums.net_protocols.NET_HUB][request_id]
 
-        result = self.node_query(session_id, protocol)
+        # The session may reuse a pooled connection which the hub closed since it was checked in.
+        # client_session_get reconnects (and sends the request again) if so, and the connection
+        # is put back into the pool (or closed) whatever the outcome.
+        try:
+            result = self.client_session_get(
+                session_id, protocol, [] if val_list is None else val_list)
+        finally:
+            self.close_connection(session_id)
 
-        self.close_connection(session_id)
         return result
 
+    def _hub_query_async(self, request_id, val_list=None, callback=None, idempotent=False):
+        """Asynchronous hub_query(), return a ClientFuture of the result (see node_query_async)."""
+        return self.node_query_async(
+            emews.base.enums.net_protocols.NET_HUB,
+            self.protocols[emews.base.enums.net_protocols.NET_HUB][request_id],
+            [] if val_list is None else val_list,
+            callback=callback, idempotent=idempotent)
+
+    def next_service_id(self):
+        """
+        Return a new globally unique service id.
+
+        Ids are given out from a block of ids leased from the hub.  Once a block is used up, the
+        next one is leased, twice as large (up to service_id_lease_max), so nodes running a few
+        services lease small blocks, and nodes spawning many query the hub a few times only.  Ids
+        given out are reported to the hub asynchronously, for its record of the services of each
+        node.  If service_id_lease_max is below 1, each id is requested from the hub.
+        """
+        if self._lease_max_size < 1:
+            return self.hub_query(emews.base.enums.hub_protocols.HUB_SERVICE_ID_REQ)
+
+        with self._lease_lock:
+            while self._lease_next == self._lease_end:
+                if self._leasing:
+                    # another thread leases the next block
+                    self._lease_cond.wait()
+                elif not self._lease_block():
+                    # interrupted
+                    return None
+
+            service_id = self._lease_next
+            self._lease_next += 1
+            self._unreported.append(service_id)
+
+        self._report_service_ids()
+        return service_id
+
+    def _lease_block(self):
+        """
+        Lease the next block of service ids from the hub, return False if interrupted.
+
+        Called with _lease_lock held.  The lock is released during the hub query, so reporting the
+        ids given out doesn't wait on the round trip (threads needing an id wait on _lease_cond).
+        """
+        lease_size = min(max(1, self._lease_size * 2), self._lease_max_size)
+        first_service_id = None
+        self._leasing = True
+        self._lease_lock.release()
+        try:
+            first_service_id = self.hub_query(
+                emews.base.enums.hub_protocols.HUB_SERVICE_ID_LEASE, [lease_size])
+        finally:
+            self._lease_lock.acquire()
+            self._leasing = False
+            self._lease_cond.notify_all()
+
+        if first_service_id is None:
+            return False
+
+        self._lease_size = lease_size
+        self._lease_next = first_service_id
+        self._lease_end = first_service_id + lease_size
+        self.logger.debug("Leased service ids '%d' to '%d' from the hub.",
+                          first_service_id, self._lease_end - 1)
+        return True
+
+    def _report_service_ids(self):
+        """Report the service ids given out to the hub, unless a report is already being sent."""
+        with self._lease_lock:
+            if self._reporting or not self._unreported:
+                return
+
+            service_ids = self._unreported
+            self._unreported = []
+            self._reporting = True
+
+        def _reported(future):
+            """Report response, send the ids given out since."""
+            ex = future.exception()
+            with self._lease_lock:
+                self._reporting = False
+                if ex is not None:
+                    # sent with the next report
+                    self._unreported[:0] = service_ids
+
+            if ex is not None:
+                self.logger.warning("Could not report service ids %s to the hub: %s",
+                                    service_ids, ex)
+            elif future.result() != emews.base.enums.net_state.STATE_ACK:
+                self.logger.warning("Hub did not acknowledge service ids %s.", service_ids)
+            else:
+                self._report_service_ids()
+
+        try:
+            # reporting ids already reported is harmless
+            self.hub_query_async(emews.base.enums.hub_protocols.HUB_SERVICE_ID_REPORT,
+                                 [service_ids], callback=_reported, idempotent=True)
+        except socket.error as ex:
+            with self._lease_lock:
+                self._reporting = False
+            self.logger.warning("Could not report service ids %s to the hub: %s", service_ids, ex)
+
+    def stats(self):
+        """Return a dict of reconnect statistics (see CircuitBreakers)."""
+        return self._breakers.stats()
+
     def close_all_sockets(self):
-        """Close all managed sockets (self._sock_state)."""
-        for sock, _ in self._client_sessions.values():
-            sock.close()
+        """Close all managed sockets (self._sock_state), interrupting the client."""
+        self.interrupt()
+
+        stats = self._breakers.stats()
+        if stats['reconnects'] or stats['connect_failures']:
+            self.logger.info("Client reconnect statistics: %s", stats)
+
+        for session in self._client_sessions.values():
+            session[0].close()
+
+        self._pool.close()
+        self._async_client.close()
+
+        if self._hub_mux is not None:
+            self._hub_mux.close()
 
     def close_connection(self, session_id):
-        """Close the connection of the passed sock."""
+        """
+        Close the client session.
+
+        The connection of the session is kept open (see ConnectionPool), for the next session to
+        the same node and server protocol.
+        """
         if session_id not in self._client_sessions:
             err_msg = "Session id '%d' does not exist" % session_id
             self.logger.error(err_msg)
             raise AttributeError(err_msg)
 
-        sock = self._client_sessions[session_id][0]
+        sock, dest_addr, serv_proto, node_id = self._client_sessions.pop(session_id)
+        seq_id = self._next_seq_ids.pop(session_id, None)
 
-        del self._client_sessions[session_id]
+        if not isinstance(sock, MuxChannel) and not self._interrupted and self._pool.checkin(
+                (dest_addr, serv_proto, node_id, seq_id is not None), sock, seq_id):
+            return
 
         try:
             sock.shutdown(socket.SHUT_RDWR)
@@ -188,6 +980,84 @@ class NetClient(emews.base.baseobject.BaseObject):
 
         sock.close()
 
+    def _recv_view(self, num_bytes):
+        """Return a memoryview of num_bytes of the receive buffer of the calling thread."""
+        if num_bytes > NetClient.RECV_BUFFER_MAX_SIZE:
+            # don't hold on to a large buffer once the response is decoded
+            return memoryview(bytearray(num_bytes))
+
+        recv_view = getattr(self._recv_local, 'view', None)
+        if recv_view is None or len(recv_view) < num_bytes:
+            recv_view = memoryview(bytearray(max(num_bytes, NetClient.RECV_BUFFER_SIZE)))
+            self._recv_local.view = recv_view
+
+        return recv_view[:num_bytes]
+
+    def _interrupted_check(self):
+        """Return True if the client was interrupted (see recv_exactly)."""
+        return self._interrupted
+
+    def _recv_bytes(self, session_id, sock, num_bytes):
+        """
+        Receive num_bytes from sock, return them (None if interrupted).
+
+        The bytes are returned as a memoryview of the receive buffer of the calling thread, valid
+        until its next receive.
+        """
+        recv_view = self._recv_view(num_bytes)
+        try:
+            # If a signal is caught to shutdown, but the socket does not catch it (say because
+            # it is running from another thread than the main one), the hub node will catch it
+            # and close the socket from its side, unblocking it here.
+            bytes_recv = recv_exactly(sock, recv_view, self._interrupted_check)  # query result
+        except socket.error as ex:
+            self.logger.warning(
+                "Client-side session id %d: connection issue (query result receive): %s",
+                session_id, ex)
+            sock.close()
+            raise
+
+        if bytes_recv < num_bytes:
+            if self._interrupted:
+                return None
+
+            warn_msg = "Client-side session id %d: connection closed remotely." % session_id
+            self.logger.warning(warn_msg)
+            sock.close()
+            raise socket.error(warn_msg)
+
+        return recv_view
+
+    def _recv_response(self, session_id, sock, protocol):
+        """Receive the (encoded) response of a v1 session request, None if interrupted."""
+        # (the response is a memoryview of the receive buffer, see _recv_bytes)
+        if protocol.return_struct is not None:
+            return self._recv_bytes(session_id, sock, protocol.return_struct.size)
+
+        # we don't know the length of the string (array), but we will get the length first
+        if protocol.return_array:
+            len_struct = emews.base.baseserv.ARRAY_LEN_STRUCT
+            item_size = emews.base.baseserv.ARRAY_ITEM_SIZE
+        else:
+            len_struct = emews.base.baseserv.STR_LEN_STRUCT
+            item_size = 1
+
+        bytes_recv = self._recv_bytes(session_id, sock, len_struct.size)
+        if bytes_recv is None:
+            return None
+
+        return self._recv_bytes(session_id, sock, len_struct.unpack(bytes_recv)[0] * item_size)
+
+    def _recv_frame(self, session_id, sock):
+        """Receive a v2 response frame, return its body (None if interrupted)."""
+        bytes_recv = self._recv_bytes(
+            session_id, sock, emews.base.baseserv.FRAME_LEN_STRUCT.size)
+        if bytes_recv is None:
+            return None
+
+        return self._recv_bytes(
+            session_id, sock, emews.base.baseserv.FRAME_LEN_STRUCT.unpack(bytes_recv)[0])
+
     def node_query(self, session_id, protocol, val_list=[]):
         """
         Query a node, using an existing session, and return the result.
@@ -195,20 +1065,58 @@ class NetClient(emews.base.baseobject.BaseObject):
         protocol: specific protocol on the server (server is established on session connection)
         val_list: values to send (types specified in the protocol)
         """
+        return self.node_query_pipeline(session_id, [(protocol, val_list)])[0]
+
+    def node_query_pipeline(self, session_id, queries):
+        """
+        Query a node with several requests at once, using an existing session.
+
+        queries: list of (protocol, val_list), see node_query()
+        All requests are sent without waiting on responses, and the list of results (in the order
+        of queries) is returned.  Requests without a response type have a None result.  The server
+        processes requests of a session in order; on pipelined sessions (see
+        create_client_session()), responses are matched to requests by their sequence id.
+        """
+        results = [None] * len(queries)
+        self._query_pipeline(session_id, queries, results)
+        return results
+
+    def _query_pipeline(self, session_id, queries, results):
+        """
+        Send queries at once, setting the result of each request processed by the server.
+
+        results holds an entry per query.  An entry is set once the server is known to have
+        processed its request: on its response, or on the response of a later request for requests
+        without a response type (requests are processed in order).  Entries of requests which may
+        not have been processed when a socket.error is raised, or when interrupted, are left as is.
+        """
         if session_id not in self._client_sessions:
             err_msg = "Session id '%d' does not exist" % session_id
             self.logger.error(err_msg)
             raise AttributeError(err_msg)
 
         sock = self._client_sessions[session_id][0]
+        seq_id = self._next_seq_ids.get(session_id, None)
+
+        requests = []
+        expected = []  # (seq id, query index) of each request expecting a response, in order
+        for index, (protocol, val_list) in enumerate(queries):
+            if self._framed:
+                requests.append(protocol.encode_query_frame(val_list, seq_id))
+            else:
+                requests.append(protocol.encode_query(val_list))
+
+            if protocol.return_type is not None and protocol.return_type != '':
+                expected.append((seq_id, index))
 
-        send_vals = [protocol.request_id]
-        send_vals.extend(val_list)
-        query_format_str, send_vals = emews.base.baseserv.build_query(
-            'H%s' % protocol.format_string, send_vals)
+            if seq_id is not None:
+                seq_id = (seq_id + 1) & 0xffffffff
+
+        if seq_id is not None:
+            self._next_seq_ids[session_id] = seq_id
 
         try:
-            sock.sendall(struct.pack(query_format_str, *send_vals))
+            sock.sendall(''.join(requests))
         except socket.error as ex:
             self.logger.warning(
                 "Client-side session id %d: connection issue (query command send): %s",
@@ -216,90 +1124,196 @@ class NetClient(emews.base.baseobject.BaseObject):
             sock.close()
             raise
 
-        # receive result
-        if protocol.return_type == 's':
-            # we don't know the length of the string, but we will get the length first
-            buf_len = 2
-            str_len_recv = True
-        else:
-            buf_len = emews.base.baseserv.calculate_recv_len(protocol.return_type)
-            str_len_recv = False
+        # receive results
+        pending = dict(expected)  # [seq id]: query index
+        num_processed = 0  # queries known to be processed (requests are processed in order)
+        for seq_id, index in expected:
+            if seq_id is None:
+                if self._framed:
+                    bytes_recv = self._recv_frame(session_id, sock)
+                else:
+                    bytes_recv = self._recv_response(session_id, sock, queries[index][0])
+            else:
+                bytes_recv = self._recv_frame(session_id, sock)
+                if bytes_recv is not None:
+                    resp_seq_id = None
+                    if len(bytes_recv) >= emews.base.baseserv.SEQ_ID_STRUCT.size:
+                        resp_seq_id = emews.base.baseserv.SEQ_ID_STRUCT.unpack_from(bytes_recv)[0]
+
+                    if resp_seq_id not in pending:
+                        warn_msg = "Client-side session id %d: response to unknown sequence " \
+                            "id %s." % (session_id, resp_seq_id)
+                        self.logger.warning(warn_msg)
+                        sock.close()
+                        raise socket.error(warn_msg)
+
+                    index = pending.pop(resp_seq_id)
+                    bytes_recv = bytes_recv[emews.base.baseserv.SEQ_ID_STRUCT.size:]
+
+            if bytes_recv is None:
+                # interrupted
+                return
+
+            for prev_index in xrange(num_processed, index):
+                if queries[prev_index][0].return_type is None or \
+                        queries[prev_index][0].return_type == '':
+                    results[prev_index] = None
+            num_processed = max(num_processed, index + 1)
 
-        bytes_recv = ''
-        while not self._interrupted and len(bytes_recv) < buf_len:
             try:
-                # If a signal is caught to shutdown, but the socket does not catch it (say because
-                # it is running from another thread than the main one), the hub node will catch it
-                # and close the socket from its side, unblocking it here.
-                chunk = sock.recv(buf_len)  # query result (4 bytes)
+                results[index] = queries[index][0].decode_return(bytes_recv)
+            except struct.error as ex:
+                self.logger.warning("Client-side session id %d: unexpected data format from: %s",
+                                    session_id, ex)
+                results[index] = None
 
-            except socket.error as ex:
-                self.logger.warning(
-                    "Client-side session id %d: connection issue (query result receive): %s",
-                    session_id, ex)
-                sock.close()
-                raise
+        for index in xrange(num_processed, len(queries)):
+            # requests without a response type sent after the last response
+            results[index] = None
 
-            if not len(chunk):
-                warn_msg = "Client-side session id %d: connection closed remotely." % session_id
-                self.logger.warning(warn_msg)
-                sock.close()
-                raise socket.error(warn_msg)
+    def node_query_batch(self, session_id, queries):
+        """
+        Query a node with several requests in a single batch request, using an existing session.
+
+        queries: list of (protocol, val_list), see node_query()
+        The server dispatches all requests at once, and sends back all responses in a single frame.
+        The list of results (in the order of queries) is returned, a result is None if the server
+        did not respond to its request (session ended by an earlier request of the batch).  Each
+        request must have a response type.  Batch requests require v2 framing, on v1 sessions the
+        requests are pipelined instead (see node_query_pipeline).
+        """
+        results = [None] * len(queries)
+        self._query_batch(session_id, queries, results)
+        return results
 
-            bytes_recv += chunk
+    def _query_batch(self, session_id, queries, results):
+        """
+        Send queries as a batch request, setting the result of each request (see _query_pipeline).
 
-            if str_len_recv and len(bytes_recv) == buf_len:
-                # we've received the length of the incoming string
-                str_len_recv = False
+        The entries of results are all set once the batch response is received.
+        """
+        if not self._framed:
+            self._query_pipeline(session_id, queries, results)
+            return
 
-                try:
-                    buf_len = struct.unpack('>H', bytes_recv)[0]
-                except struct.error as ex:
-                    self.logger.warning(
-                        "Client-side session id %d: unexpected data format (str len) from: %s",
-                        session_id, ex)
-                    return None
+        if session_id not in self._client_sessions:
+            err_msg = "Session id '%d' does not exist" % session_id
+            self.logger.error(err_msg)
+            raise AttributeError(err_msg)
 
-                #self.logger.debug("Client-side session id %d: incoming string of len: %d",
-                #                  session_id, buf_len)
-                bytes_recv = ''
+        sock = self._client_sessions[session_id][0]
+        seq_id = self._next_seq_ids.get(session_id, None)
+        if seq_id is not None:
+            self._next_seq_ids[session_id] = (seq_id + 1) & 0xffffffff
 
         try:
-            if protocol.return_type == 's':
-                result = struct.unpack('>%ss' % len(bytes_recv), bytes_recv)[0]
-            else:
-                result = struct.unpack('>%s' % protocol.return_type, bytes_recv)[0]
+            sock.sendall(emews.base.baseserv.encode_batch_frame(queries, seq_id))
+        except socket.error as ex:
+            self.logger.warning(
+                "Client-side session id %d: connection issue (batch command send): %s",
+                session_id, ex)
+            sock.close()
+            raise
+
+        bytes_recv = self._recv_frame(session_id, sock)
+        if bytes_recv is None:
+            # interrupted
+            return
+
+        # requests the server did not respond to (session ended by an earlier one) have no result
+        results[:] = [None] * len(queries)
+        try:
+            offset = 0
+            if seq_id is not None:
+                if emews.base.baseserv.SEQ_ID_STRUCT.unpack_from(bytes_recv)[0] != seq_id:
+                    raise struct.error("response to another sequence id")
+                offset += emews.base.baseserv.SEQ_ID_STRUCT.size
+
+            num_results = emews.base.baseserv.BATCH_COUNT_STRUCT.unpack_from(bytes_recv, offset)[0]
+            offset += emews.base.baseserv.BATCH_COUNT_STRUCT.size
+
+            for index in xrange(min(num_results, len(queries))):
+                res_end = offset + emews.base.baseserv.FRAME_LEN_STRUCT.size + \
+                    emews.base.baseserv.FRAME_LEN_STRUCT.unpack_from(bytes_recv, offset)[0]
+                results[index] = queries[index][0].decode_return(
+                    bytes_recv[offset + emews.base.baseserv.FRAME_LEN_STRUCT.size:res_end])
+                offset = res_end
         except struct.error as ex:
-            self.logger.warning("Client-side session id %d: unexpected data format from: %s",
-                                session_id, ex)
-            return None
+            self.logger.warning(
+                "Client-side session id %d: unexpected data format from batch response: %s",
+                session_id, ex)
 
-        return result
+    def node_query_async(self, serv_proto, protocol, val_list, addr=None, node_id=None,
+                         callback=None, idempotent=False):
+        """
+        Query a node without waiting on the response, return a ClientFuture of the result.
+
+        The request is sent on a pipelined session to addr (the hub if None) for serv_proto, shared
+        by all asynchronous requests to them, and run by the I/O thread of the client (see
+        async_client).  callback, if given, is called with the future once it is done, from the I/O
+        thread.  node_id is the node id to present to the server (if None, our node id).  Only
+        idempotent requests are re-sent once they may have reached the server (see AsyncClient).
+        """
+        if node_id is None:
+            node_id = self.sys.node_id
+
+        return self._async_client.query(
+            (addr if addr is not None else self._hub_addr, serv_proto, node_id), protocol, val_list,
+            callback=callback, idempotent=idempotent)
 
     # client session methods - client sessions are persistent, and their session ids remain static
-    def create_client_session(self, serv_proto, addr=None):
+    def create_client_session(self, serv_proto, addr=None, node_id=None, pipelined=False):
         """
         Attempt to make a connection to the node given by address.
 
         Note that this is a client-side (blocking) operation.  Currently client sessions are bound
         to a specific server protocol.  This is due to legacy design choices back when server
-        connections were for single requests.
+        connections were for single requests.  node_id is the node id to present to the server (if
+        None, our node id).  If pipelined (and v2 framing is used), each request of the session is
+        tagged with a sequence id, echoed by the server in its response (see node_query_pipeline).
+        The connection of a closed session with the same header is reused if available.
         """
-        sock, dest_addr = self._sock_connect(addr)
+        if node_id is None:
+            node_id = self.sys.node_id
 
-        if self._interrupted:
-            return None
+        sequenced = pipelined and self._framed
+        pooled = None
+        if addr is not None or self._hub_mux is None:
+            pooled = self._pool.checkout(
+                (addr if addr is not None else self._hub_addr, serv_proto, node_id, sequenced))
 
         session_id = self._session_id
         self._session_id += 1
-        self._client_sessions[session_id] = (sock, dest_addr, serv_proto)
+
+        if pooled is not None:
+            # session header was sent when the connection was established
+            self._client_sessions[session_id] = (
+                pooled[0], addr if addr is not None else self._hub_addr, serv_proto, node_id)
+            if sequenced:
+                self._next_seq_ids[session_id] = pooled[1]
+
+            self.logger.debug(
+                "Client-side session id %d: reusing connection to node address '%s'",
+                session_id, str(self._client_sessions[session_id][1]))
+            return session_id
+
+        conn_tup = self._session_connect(addr)
+
+        if conn_tup is None or self._interrupted:
+            return None
+
+        sock, dest_addr = conn_tup
+
+        self._client_sessions[session_id] = (sock, dest_addr, serv_proto, node_id)
+        if sequenced:
+            self._next_seq_ids[session_id] = 0
 
         self.logger.info(
             "Client-side session id %d: New connection established to node address '%s'",
             session_id, str(dest_addr))
 
         try:
-            sock.sendall(struct.pack(">HL", serv_proto, self.sys.node_id))
+            sock.sendall(self._session_header(serv_proto, node_id, sequenced=sequenced))
         except socket.error as ex:
             self.logger.warning(
                 "Client-side session id %d: connection issue (serv protocol send): %s",
@@ -309,30 +1323,83 @@ class NetClient(emews.base.baseobject.BaseObject):
 
         return session_id
 
-    def _client_session_query(self, session_id, protocol, val_list):
-        """Get a value (type is return_type), based on protocol and byte string to send."""
-        if self._interrupted:
-            return None
+    def _client_session_query(self, session_id, queries, batch=False, idempotent=True):
+        """
+        Return the list of results of queries (see node_query_pipeline, node_query_batch).
 
-        while not self._interrupted:
+        If the connection fails, the session is reconnected, and the requests not answered yet are
+        sent again.  Unless idempotent, a request which may have reached the server is not sent
+        again: the socket.error is raised instead (once reconnected, so the session can be used).
+        """
+        results = [None] * len(queries)
+        query_fn = self._query_batch if batch else self._query_pipeline
+        indices = range(len(queries))  # queries not answered yet
+        backoff = None
+
+        while indices and not self._interrupted:
+            sent_results = [_NOT_ANSWERED] * len(indices)
+            exc_info = None
             try:
-                result = self.node_query(session_id, protocol, val_list=val_list)
+                query_fn(session_id, [queries[index] for index in indices], sent_results)
             except socket.error:
-                # attempt to reconnect and try again (if reconnect fails, exception raised)
+                exc_info = sys.exc_info()
+
+            unanswered = []
+            for index, result in zip(indices, sent_results):
+                if result is _NOT_ANSWERED:
+                    unanswered.append(index)
+                else:
+                    results[index] = result
+
+            if exc_info is None:
+                # (requests not answered if interrupted have no result)
+                self._breakers.success(self._client_sessions[session_id][1])
+                break
+
+            indices = unanswered
+            self._breakers.failure(self._client_sessions[session_id][1])
+
+            if indices and not idempotent:
+                self.logger.warning(
+                    "Client-side session id %d: %d request(s) not answered, not sending again "
+                    "(not idempotent).", session_id, len(indices))
                 self._client_session_reconnect(session_id)
-                continue
+                raise exc_info[0], exc_info[1], exc_info[2]
 
-            break
+            # The first reconnect is immediate (the connection may just have been idle for too
+            # long), later ones back off.
+            if backoff is None:
+                backoff = self._new_backoff()
+            else:
+                self._backoff_sleep(backoff)
+                if self._interrupted:
+                    break
 
-        return result
+            # attempt to reconnect and try again (if reconnect fails, exception raised)
+            self._client_session_reconnect(session_id)
+
+        return results
 
     def client_session_get(self, session_id, protocol, val_list):
         """Put data somewhere, based on protocol and byte string to send."""
-        return self._client_session_query(session_id, protocol, val_list)
+        return self._client_session_query(session_id, [(protocol, val_list)])[0]
 
     def client_session_put(self, session_id, protocol, val_list):
         """Put data somewhere, based on protocol and byte string to send."""
-        return self._client_session_query(session_id, protocol, val_list)
+        return self._client_session_query(session_id, [(protocol, val_list)])[0]
+
+    def client_session_pipeline(self, session_id, queries, idempotent=False):
+        """
+        Send several requests at once, return their results (see node_query_pipeline).
+
+        If the connection fails, only idempotent requests which may have reached the server are sent
+        again, socket.error is raised otherwise (see _client_session_query).
+        """
+        return self._client_session_query(session_id, queries, idempotent=idempotent)
+
+    def client_session_batch(self, session_id, queries, idempotent=False):
+        """Send several requests as a batch, return their results (see client_session_pipeline)."""
+        return self._client_session_query(session_id, queries, batch=True, idempotent=idempotent)
 
     # clients which need to run in a thread - these methods return an object suitable for dispatch
     def broadcast_message(self, message, interval, duration):
@@ -4,34 +4,71 @@ Network handler for node to node communication.
 Created on March 20, 2019
 @author: Brian Ricks
 """
+import array
+import functools
 import socket
 import struct
+import time
 
+import emews.base.async_client
 import emews.base.baseobject
+import emews.base.baseserv
 import emews.base.enums
+import emews.base.hub_workers
+import emews.base.offload_pool
+import emews.base.queryserv
 import emews.base.serv_agent
 import emews.base.serv_hub
 import emews.base.serv_logging
 import emews.base.serv_spawner
 
 
-class NonSupportedHub(object):
+class NonSupportedHub(emews.base.baseobject.BaseObject):
     """Server for hub-based requests to non-hub nodes."""
 
+    __slots__ = ()
+
     def handle_init(self, node_id, session_id):
         """Not the hub, server is not running."""
         self.logger.warning("This protocol server not running: this node is not the hub.")
         return None
 
+    def handle_close(self, session_id):
+        """Nothing to clean up, no session was started."""
+        pass
+
 
-class NonSupportedInvalid(object):
+class NonSupportedInvalid(emews.base.baseobject.BaseObject):
     """Server for invalid requests."""
 
+    __slots__ = ()
+
     def handle_init(self, node_id, session_id):
         """Invalid protocol id (or reserved)."""
         self.logger.warning("Protocol not supported or reserved.")
         return None
 
+    def handle_close(self, session_id):
+        """Nothing to clean up, no session was started."""
+        pass
+
+
+class TrafficStats(object):
+    """Enumerations for traffic counter indices (see NetCache.new_stats())."""
+
+    __slots__ = ()
+
+    ENUM_SIZE = 6
+
+    STAT_BYTES_IN = 0       # bytes received
+    STAT_BYTES_OUT = 1      # bytes queued to send
+    STAT_FRAMES_IN = 2      # fields (frames) received and processed
+    STAT_FRAMES_OUT = 3     # responses queued to send
+    STAT_HANDLER_CALLS = 4  # handler invocations (requests)
+    STAT_HANDLER_TIME = 5   # wall time (seconds) spent in handlers
+
+    NAMES = ('bytes_in', 'bytes_out', 'frames_in', 'frames_out', 'handler_calls', 'handler_time')
+
 
 class NetCache(object):
     """Network cache."""
@@ -39,35 +76,74 @@ class NetCache(object):
     class NodeData(object):
         """Per node data."""
 
-        __slots__ = ('addr', 'services')
+        __slots__ = ('addr', 'services', 'stats')
 
         def __init__(self):
             """Constructor."""
             self.addr = None       # last known network address associated with this node
             self.services = set()  # set of all services associated with this node
+            self.stats = NetCache.new_stats()  # traffic of closed sessions of this node
 
     class SessionData(object):
         """Per session data."""
 
-        __slots__ = ('addr', 'node_id', 'serv', 'handler', 'recv_type_str', 'recv_args',
-                     'recv_index')
+        __slots__ = ('addr', 'node_id', 'proto_id', 'framed', 'sequenced', 'channels', 'serv',
+                     'handler', 'recv_struct', 'recv_len', 'recv_args', 'recv_index', 'stats')
 
         def __init__(self):
             """Constructor."""
             self.addr = None         # network address of this session
             self.node_id = None      # node id associated with this session
+            self.proto_id = None     # net protocol id requested by this session
+            self.framed = False      # True if the session uses length-prefixed (v2) framing
+            self.sequenced = False   # True if v2 frames carry a sequence id (pipelined session)
+            self.channels = None     # [channel_id]: session id (NET_MUX sessions, {} if a channel)
             self.serv = None         # server handling this session
             self.handler = None      # current recv data handler
-            self.recv_type_str = ''  # current recv type string (struct unpack)
+            self.recv_struct = None  # current recv struct.Struct (None when receiving a string)
+            self.recv_len = 0        # current expected recv bytes
             self.recv_args = []      # current list of args received and unpacked
             self.recv_index = 0      # current index in handler for expected recv bytes / type str
+            self.stats = NetCache.new_stats()  # traffic counters (TrafficStats indices)
 
-    __slots__ = ('node', 'session')
+    __slots__ = ('node', 'session', 'proto_stats')
 
     def __init__(self):
         """Constructor."""
         self.node = {}    # [node_id]: NodeData
         self.session = {}  # [session_id]: SessionData
+        # [proto_id]: traffic of closed sessions, per net protocol
+        self.proto_stats = [NetCache.new_stats()
+                            for _ in xrange(emews.base.enums.net_protocols.ENUM_SIZE)]
+
+    @staticmethod
+    def new_stats():
+        """Return a new (zeroed) traffic counter array."""
+        return array.array('d', [0.0]) * TrafficStats.ENUM_SIZE
+
+    @staticmethod
+    def add_stats(dst_stats, src_stats):
+        """Add the traffic counters of src_stats to dst_stats."""
+        for index in xrange(TrafficStats.ENUM_SIZE):
+            dst_stats[index] += src_stats[index]
+
+    def traffic(self):
+        """
+        Return (proto_stats, node_stats) of the traffic so far, including open sessions.
+
+        proto_stats is a list indexed by net protocol id, node_stats is a dict keyed by node id.
+        """
+        proto_stats = [array.array('d', stats) for stats in self.proto_stats]
+        node_stats = dict((node_id, array.array('d', node_data.stats))
+                          for node_id, node_data in self.node.iteritems())
+
+        for session_data in self.session.itervalues():
+            if session_data.proto_id is not None:
+                NetCache.add_stats(proto_stats[session_data.proto_id], session_data.stats)
+            if session_data.node_id in node_stats:
+                NetCache.add_stats(node_stats[session_data.node_id], session_data.stats)
+
+        return proto_stats, node_stats
 
     def add_node(self, node_id, session_id):
         """
@@ -83,13 +159,38 @@ class NetCache(object):
 class NetServ(emews.base.baseobject.BaseObject):
     """Classdocs."""
 
-    __slots__ = ('_proto_cb', '_net_cache')
+    __slots__ = ('_proto_cb', '_net_cache', '_id_counters', '_channel_session_id', '_offload_pool',
+                 '_offloaded_stats')
 
-    def __init__(self, config, thread_dispatcher, net_client):
-        """Constructor."""
+    # Channels of NET_MUX sessions are sessions of their own, with ids above those the
+    # ConnectionManager gives.
+    CHANNEL_SESSION_ID_BASE = 1 << 32
+
+    def __init__(self, config, thread_dispatcher, net_client, hub_workers=None,
+                 reactor_stats=None):
+        """
+        Constructor.
+
+        hub_workers is given if the hub runs multiple reactor processes (HubWorkers object).
+        reactor_stats is a callable returning a dict of reactor (ConnectionManager) statistics.
+        """
         super(NetServ, self).__init__()
 
         self._net_cache = NetCache()  # net cache shared among the servers
+        self._channel_session_id = NetServ.CHANNEL_SESSION_ID_BASE  # last channel session id
+
+        # Handlers marked for offload run in the offload pool (see _offload_handler), if enabled.
+        # Their traffic counters are only updated by the reactor thread, once they complete.
+        self._offload_pool = None
+        self._offloaded_stats = {}  # [OffloadJob]: traffic counters of the session of the handler
+        if config['offload_threads'] > 0:
+            self._offload_pool = emews.base.offload_pool.OffloadPool(
+                config['offload_threads'], config['offload_queue_size'],
+                _inject={'sys': self.sys})
+
+        # global id counters (hub only), shared among hub processes if there are multiple
+        self._id_counters = emews.base.hub_workers.IdCounters() if hub_workers is None \
+            else hub_workers.id_counters
 
         nonsupported_invalid = NonSupportedInvalid()
         nonsupported_hub = NonSupportedHub()
@@ -98,8 +199,12 @@ class NetServ(emews.base.baseobject.BaseObject):
         self._proto_cb[emews.base.enums.net_protocols.NET_NONE] = nonsupported_invalid
         self._proto_cb[emews.base.enums.net_protocols.NET_CC_1] = nonsupported_invalid
         self._proto_cb[emews.base.enums.net_protocols.NET_CC_2] = nonsupported_invalid
+        # NET_MUX sessions are handled by NetServ itself (see _handle_mux_frame)
+        self._proto_cb[emews.base.enums.net_protocols.NET_MUX] = nonsupported_invalid
 
         inject_par = {'sys': self.sys, '_net_cache': self._net_cache, '_net_client': net_client}
+        hub_inject_par = dict(inject_par, _id_counters=self._id_counters,
+                              _reactor_stats=reactor_stats)
 
         # build net protocols (must be called before instantiation)
         emews.base.serv_hub.ServHub.build_protocols()
@@ -109,11 +214,17 @@ class NetServ(emews.base.baseobject.BaseObject):
         if self.sys.is_hub:
             # Hub node runs the following servers:
             self._proto_cb[emews.base.enums.net_protocols.NET_HUB] = \
-                emews.base.serv_hub.ServHub(_inject=inject_par)
+                emews.base.serv_hub.ServHub(_inject=hub_inject_par)
             self._proto_cb[emews.base.enums.net_protocols.NET_LOGGING] = \
                 emews.base.serv_logging.ServLogging(_inject=inject_par)
-            self._proto_cb[emews.base.enums.net_protocols.NET_AGENT] = \
-                emews.base.serv_agent.ServAgent(thread_dispatcher, _inject=inject_par)
+
+            if hub_workers is None or hub_workers.is_owner:
+                self._proto_cb[emews.base.enums.net_protocols.NET_AGENT] = \
+                    emews.base.serv_agent.ServAgent(thread_dispatcher, _inject=inject_par)
+            else:
+                # agent environments live in the owner hub process
+                self._proto_cb[emews.base.enums.net_protocols.NET_AGENT] = \
+                    emews.base.serv_agent.ServAgentRelay(hub_workers.owner_addr, _inject=inject_par)
         else:
             self._proto_cb[emews.base.enums.net_protocols.NET_HUB] = nonsupported_hub
             self._proto_cb[emews.base.enums.net_protocols.NET_LOGGING] = nonsupported_hub
@@ -124,31 +235,97 @@ class NetServ(emews.base.baseobject.BaseObject):
             emews.base.serv_spawner.ServSpawner(
                 thread_dispatcher, config['raise_on_servicebuilder_exceptions'], _inject=inject_par)
 
+    @property
+    def offload_fd(self):
+        """Return the fd readable once offloaded handlers complete (None if offload disabled)."""
+        return None if self._offload_pool is None else self._offload_pool.wakeup_fd
+
+    def offloaded_jobs(self):
+        """
+        Return the offloaded handler jobs completed (OffloadJob objects).
+
+        Each job suspended a session (see _offload_handler).  The session resumes by calling
+        job.resume(job.result()), which returns the tuple the suspending callback would have
+        returned had the handler run inline.
+        """
+        jobs = self._offload_pool.completed()
+        for job in jobs:
+            stats = self._offloaded_stats.pop(job, None)
+            if stats is not None:
+                stats[TrafficStats.STAT_HANDLER_CALLS] += 1
+                stats[TrafficStats.STAT_HANDLER_TIME] += job.run_time
+
+        return jobs
+
+    def close(self):
+        """Shut down the offload pool (if any)."""
+        if self._offload_pool is not None:
+            self._offload_pool.close()
+
     def handle_init(self, session_id, int_addr):
-        """Init tasks."""
+        """
+        Init tasks.
+
+        Returns the traffic counter array of the session (TrafficStats indices), which the caller
+        updates with the bytes and frames it receives and sends.
+        """
         session_data = NetCache.SessionData()
         session_data.addr = int_addr
         self._net_cache.session[session_id] = session_data
 
+        return session_data.stats
+
     def handle_close(self, session_id):
         """Handle the case when a socket is closed."""
         session_data = self._net_cache.session[session_id]
+        if session_data.channels is not None:
+            # multiplexed session, close all of its channels
+            for channel_session_id in session_data.channels.itervalues():
+                self.handle_close(channel_session_id)
+
         if session_data.serv is not None:
             # if no handler, means the session ended before a handler was assigned (and thus called)
             session_data.serv.handle_close(session_id)
 
+        # keep the traffic of the session in the protocol and node totals
+        if session_data.proto_id is not None:
+            NetCache.add_stats(self._net_cache.proto_stats[session_data.proto_id],
+                               session_data.stats)
+        if session_data.node_id in self._net_cache.node:
+            NetCache.add_stats(self._net_cache.node[session_data.node_id].stats,
+                               session_data.stats)
+
         del self._net_cache.session[session_id]
 
-    def handle_connection(self, session_id, chunk):
-        """Chunk contains the protocol and node id."""
+    def handle_connection(self, session_id, chunk, offset):
+        """
+        Chunk (buffer view) contains the protocol and node id, starting at offset.
+
+        If the protocol id carries the NET_FLAG_V2 flag, the session uses v2 framing: each request
+        is a single frame prefixed by its length, decoded as a whole (see _handle_frame).
+        Otherwise, requests are received field by field (see _handle_data).  If it also carries the
+        NET_FLAG_SEQ flag, the session is pipelined: each frame starts with a sequence id, echoed in
+        the response frame, so the client can send requests without waiting for responses.
+
+        A NET_MUX (v2) session carries several sessions as channels over a single connection (see
+        _handle_mux_frame).
+        """
         try:
-            proto_id, node_id = struct.unpack('>HL', chunk)
+            proto_id, node_id = emews.base.baseserv.HEADER_STRUCT.unpack_from(chunk, offset)
         except struct.error as ex:
             self.logger.warning("Session id: %d, struct error when unpacking protocol: %s",
                                 session_id, ex)
             return (None, 0)
 
         session_data = self._net_cache.session[session_id]
+        session_data.framed = bool(proto_id & emews.base.enums.net_flags.NET_FLAG_V2)
+        session_data.sequenced = bool(proto_id & emews.base.enums.net_flags.NET_FLAG_SEQ)
+        proto_id &= emews.base.enums.net_flags.NET_PROTO_MASK
+
+        if session_data.sequenced and not session_data.framed:
+            self.logger.warning("Session id: %d, sequence ids requested without v2 framing.",
+                                session_id)
+            return (None, 0)
 
         if node_id > 0:
             # a node id of zero refers to an unassigned node or client, so don't track it
@@ -156,14 +333,21 @@ class NetServ(emews.base.baseobject.BaseObject):
 
             if node_data is None:
                 if self.sys.is_hub:
-                    self.logger.warning(
-                        "Session id: %d, unrecognized node id given: %d, from address: %s",
-                        session_id, node_id, socket.inet_ntoa(struct.pack(">I", session_data.addr)))
-                    return (None, 0)
-
-                # if not the hub node, assume node id is legit
-                # TODO: validate node id with hub node
-                node_data = NetCache.NodeData()
+                    if not self._id_counters.issued(
+                            emews.base.hub_workers.IdCounters.NODE_ID, node_id):
+                        self.logger.warning(
+                            "Session id: %d, unrecognized node id given: %d, from address: %s",
+                            session_id, node_id,
+                            socket.inet_ntoa(struct.pack(">I", session_data.addr)))
+                        return (None, 0)
+
+                    # node id was assigned by another hub process
+                    node_data = NetCache.NodeData()
+                    self._net_cache.node[node_id] = node_data
+                else:
+                    # if not the hub node, assume node id is legit
+                    # TODO: validate node id with hub node
+                    node_data = NetCache.NodeData()
 
             node_data.addr = session_data.addr  # update latest address
             session_data.node_id = node_id      # assign node id associated with this session
@@ -174,20 +358,349 @@ class NetServ(emews.base.baseobject.BaseObject):
                 session_id, proto_id, socket.inet_ntoa(struct.pack(">I", session_data.addr)))
             return (None, 0)
 
+        session_data.proto_id = proto_id
+
+        if proto_id == emews.base.enums.net_protocols.NET_MUX:
+            if not session_data.framed or session_data.channels is not None:
+                # channels cannot be multiplexed themselves
+                self.logger.warning(
+                    "Session id: %d, multiplexed session requires v2 framing, and cannot be a "
+                    "channel.", session_id)
+                return (None, 0)
+
+            self.logger.debug("Session id: %d, multiplexed session requested.", session_id)
+            session_data.channels = {}
+            return (self._handle_mux_frame_len, emews.base.baseserv.FRAME_LEN_STRUCT.size)
+
         session_data.serv = self._proto_cb[proto_id]
-        self.logger.debug("Session id: %d, protocol requested: %d", session_id, proto_id)
+        self.logger.debug("Session id: %d, protocol requested: %d (framed: %s, sequenced: %s)",
+                          session_id, proto_id, session_data.framed, session_data.sequenced)
+
+        handler = session_data.serv.handle_init(node_id, session_id)
+        if handler is None:
+            # server does not support this session
+            return (None, 0)
+
+        if session_data.framed:
+            session_data.handler = handler
+            return (self._handle_frame_len, emews.base.baseserv.FRAME_LEN_STRUCT.size)
+
+        return self._new_handler_invocation(session_id, handler)
+
+    def _handle_frame_len(self, session_id, chunk, offset):
+        """Chunk (buffer view) contains the length of the next v2 frame, starting at offset."""
+        session_data = self._net_cache.session[session_id]
+        session_data.recv_len = emews.base.baseserv.FRAME_LEN_STRUCT.unpack_from(chunk, offset)[0]
 
-        return self._new_handler_invocation(
-            session_id, session_data.serv.handle_init(node_id, session_id))
+        return (self._handle_frame, session_data.recv_len)
 
-    def _handle_data(self, session_id, chunk):
-        """Handle chunk during a session with a serv."""
+    def _handle_frame(self, session_id, chunk, offset):
+        """
+        Chunk (buffer view) contains a complete v2 request frame, starting at offset.
+
+        The fields of the current handler are decoded from the frame, and the handler invoked.  If
+        the handler returns a new handler (QueryServ request id for example), its fields are
+        decoded from the rest of the frame.  A frame ends with a response, or with a handler
+        expecting further fields (which are then expected in the next frame).  On pipelined
+        sessions, the frame starts with its sequence id, which the response frame is tagged with.
+        On QueryServ sessions, the frame may hold a batch request (see _handle_batch).  If the
+        handler is offloaded, the session is suspended until it completes (see _offload_handler).
+        """
+        session_data = self._net_cache.session[session_id]
+        handler = session_data.handler
+        end = offset + session_data.recv_len
+        seq_id = None
+
+        try:
+            if session_data.sequenced:
+                if end - offset < emews.base.baseserv.SEQ_ID_STRUCT.size:
+                    raise struct.error("frame too short to hold a sequence id")
+                seq_id = emews.base.baseserv.SEQ_ID_STRUCT.unpack_from(chunk, offset)[0]
+                offset += emews.base.baseserv.SEQ_ID_STRUCT.size
+
+            if isinstance(session_data.serv, emews.base.queryserv.QueryServ) and \
+                    handler is session_data.serv.query_handler and \
+                    end - offset >= emews.base.baseserv.BATCH_HEADER_STRUCT.size and \
+                    emews.base.baseserv.BATCH_HEADER_STRUCT.unpack_from(chunk, offset)[0] == \
+                    emews.base.baseserv.BATCH_REQUEST_ID:
+                return self._handle_batch(session_id, session_data, chunk, offset, end, seq_id)
+
+            ret_val, handler, offset = self._dispatch_request(
+                session_id, session_data, handler, chunk, offset, end)
+        except struct.error as ex:
+            self.logger.warning("Session id: %d, malformed frame: %s", session_id, ex)
+            return (None, 0)
+
+        if isinstance(ret_val, emews.base.offload_pool.OffloadJob):
+            ret_val.resume = functools.partial(
+                self._resume_frame, session_id, handler, offset, end, seq_id)
+            return (ret_val,)
+
+        return self._frame_response(session_id, session_data, handler, ret_val, offset, end, seq_id)
+
+    def _resume_frame(self, session_id, handler, offset, end, seq_id, ret_val):
+        """Resume a v2 session suspended by an offloaded handler, given its return value."""
+        if ret_val is not None and not isinstance(ret_val, tuple) and offset != end:
+            # the frame itself is gone by now
+            self.logger.warning(
+                "Session id: %d, offloaded handler returned a handler for fields of its frame.",
+                session_id)
+            return (None, 0)
+
+        return self._frame_response(session_id, self._net_cache.session[session_id], handler,
+                                    ret_val, offset, end, seq_id)
+
+    def _frame_response(self, session_id, session_data, handler, ret_val, offset, end, seq_id):
+        """Return the callback tuple of a v2 frame, given the return value of its last handler."""
+        if ret_val is None:
+            # end the session
+            return (None, 0)
+        elif not isinstance(ret_val, tuple):
+            # request complete, the handler fields are expected in the next frame
+            session_data.handler = ret_val
+            return (self._handle_frame_len, emews.base.baseserv.FRAME_LEN_STRUCT.size)
+
+        if offset != end:
+            self.logger.warning("Session id: %d, frame holds %d unexpected trailing bytes.",
+                                session_id, end - offset)
+            return (None, 0)
+
+        # send some data
+        if handler.protocol.return_type is None or handler.protocol.return_type == '':
+            self.logger.warning(
+                "Session id: %d, type specified to pack string is empty.", session_id)
+            return (None, 0)
+
+        send_data = handler.protocol.encode_return_frame(ret_val[0], seq_id)
+
+        if ret_val[1] is None:
+            # send some data and then end the session.
+            return (None, 0, send_data)
+
+        session_data.handler = ret_val[1]
+        return (self._handle_frame_len, emews.base.baseserv.FRAME_LEN_STRUCT.size, send_data)
+
+    def _dispatch_request(self, session_id, session_data, handler, chunk, offset, end,
+                          offload=True):
+        """
+        Decode the handler fields from chunk[offset:end], and invoke the handler.
+
+        New handlers returned are invoked in turn, until a handler returns a response (tuple), ends
+        the session (None), or expects fields past end.  Returns (return value of the last handler
+        invoked, that handler, offset after the fields decoded).  Raises struct.error if the fields
+        are malformed.  If offload is True and the handler is offloaded (or returns a ClientFuture),
+        the return value is the OffloadJob running it (see _defer_handler).
+        """
+        while True:
+            recv_args, offset = handler.protocol.decode(chunk, offset, end)
+            if offload and handler.offload:
+                job = self._offload_handler(session_id, session_data, handler, recv_args)
+                if job is not None:
+                    return (job, handler, offset)
+
+            ret_val = self._call_handler(session_data, handler, session_id, recv_args)
+            if isinstance(ret_val, emews.base.async_client.ClientFuture):
+                ret_val = self._defer_handler(session_id, handler, ret_val, defer=offload)
+                if isinstance(ret_val, emews.base.offload_pool.OffloadJob):
+                    return (ret_val, handler, offset)
+
+            if ret_val is None or isinstance(ret_val, tuple):
+                return (ret_val, handler, offset)
+
+            # new handler
+            if offset == end and len(ret_val.recv_types):
+                return (ret_val, handler, offset)
+
+            handler = ret_val
+
+    def _handle_batch(self, session_id, session_data, chunk, offset, end, seq_id):
+        """
+        Handle a batch request held in chunk[offset:end] (see baseserv.encode_batch_frame).
+
+        All requests of the batch are dispatched in turn, and their responses sent back as a single
+        (batch response) frame.  Each request must end with a response.  If a request ends the
+        session, the requests after it are not dispatched, and the session ends once the responses
+        so far are sent.
+        """
+        num_requests = emews.base.baseserv.BATCH_HEADER_STRUCT.unpack_from(chunk, offset)[1]
+        offset += emews.base.baseserv.BATCH_HEADER_STRUCT.size
+
+        send_parts = []
+        next_handler = session_data.handler
+        for _ in xrange(num_requests):
+            if end - offset < emews.base.baseserv.FRAME_LEN_STRUCT.size:
+                raise struct.error("batch holds less requests than announced")
+            req_end = offset + emews.base.baseserv.FRAME_LEN_STRUCT.size + \
+                emews.base.baseserv.FRAME_LEN_STRUCT.unpack_from(chunk, offset)[0]
+            if req_end > end:
+                raise struct.error("batch request exceeds the frame")
+
+            # batched requests run inline, as the batch response holds all of them
+            ret_val, handler, offset = self._dispatch_request(
+                session_id, session_data, session_data.serv.query_handler, chunk,
+                offset + emews.base.baseserv.FRAME_LEN_STRUCT.size, req_end, offload=False)
+
+            if ret_val is None:
+                next_handler = None
+                break
+            elif not isinstance(ret_val, tuple) or offset != req_end or \
+                    handler.protocol.return_type is None or handler.protocol.return_type == '':
+                raise struct.error("batch request does not end with a response")
+
+            send_parts.append(handler.protocol.encode_return_frame(ret_val[0]))
+            next_handler = ret_val[1]
+            if next_handler is None:
+                break
+
+        if next_handler is None:
+            self.logger.debug("Session id: %d, session ended by request %d of batch of %d.",
+                              session_id, len(send_parts), num_requests)
+        elif offset != end:
+            raise struct.error("frame holds %d unexpected trailing bytes" % (end - offset))
+
+        send_parts.insert(0, emews.base.baseserv.BATCH_COUNT_STRUCT.pack(len(send_parts)))
+        send_data = emews.base.baseserv.encode_frame(''.join(send_parts), seq_id)
+
+        if next_handler is None:
+            return (None, 0, send_data)
+
+        session_data.handler = next_handler
+        return (self._handle_frame_len, emews.base.baseserv.FRAME_LEN_STRUCT.size, send_data)
+
+    def _handle_mux_frame_len(self, session_id, chunk, offset):
+        """Chunk (buffer view) contains the length of the next multiplexed frame."""
+        session_data = self._net_cache.session[session_id]
+        session_data.recv_len = emews.base.baseserv.FRAME_LEN_STRUCT.unpack_from(chunk, offset)[0]
+
+        if session_data.recv_len < emews.base.baseserv.CHANNEL_ID_STRUCT.size:
+            self.logger.warning("Session id: %d, multiplexed frame too short to hold a channel id.",
+                                session_id)
+            return (None, 0)
+
+        return (self._handle_mux_frame, session_data.recv_len)
+
+    def _handle_mux_frame(self, session_id, chunk, offset):
+        """
+        Chunk (buffer view) contains a complete multiplexed frame, starting at offset.
+
+        A multiplexed frame is a v2 frame of a channel, prefixed by its channel id.  A channel is
+        opened by a frame holding the session header of the channel (net protocol and node id, as
+        sent on a new connection), with CHANNEL_OPEN_FLAG set in the channel id.  The channel is
+        then a session of its own, which must use v2 framing.  An empty frame closes the channel.
+        The server closes a channel with an empty frame with CHANNEL_CLOSE_FLAG set in the channel
+        id, as response frames may be empty (an empty string or array).  Frames of channels which
+        are not open are dropped (the channel may have been closed by the server while the frames
+        were sent), the client is told the channel is closed.
+        """
+        session_data = self._net_cache.session[session_id]
+        end = offset + session_data.recv_len
+        channel_id = emews.base.baseserv.CHANNEL_ID_STRUCT.unpack_from(chunk, offset)[0]
+        offset += emews.base.baseserv.CHANNEL_ID_STRUCT.size
+        channel_open = channel_id & emews.base.baseserv.CHANNEL_OPEN_FLAG
+        channel_id &= ~emews.base.baseserv.CHANNEL_OPEN_FLAG
+
+        channel_session_id = session_data.channels.get(channel_id, None)
+        if channel_open:
+            if channel_session_id is not None or \
+                    end - offset != emews.base.baseserv.HEADER_STRUCT.size:
+                self.logger.warning(
+                    "Session id: %d, channel %d, invalid channel open frame.",
+                    session_id, channel_id)
+                return (None, 0)
+
+            self._channel_session_id += 1
+            channel_session_id = self._channel_session_id
+            channel_data = NetCache.SessionData()
+            channel_data.addr = session_data.addr
+            channel_data.channels = {}  # marks the session as a channel
+            self._net_cache.session[channel_session_id] = channel_data
+            session_data.channels[channel_id] = channel_session_id
+
+            ret_tup = self.handle_connection(channel_session_id, chunk, offset)
+            if ret_tup[0] is not None and not channel_data.framed:
+                self.logger.warning("Session id: %d, channel %d requires v2 framing.",
+                                    session_id, channel_id)
+                ret_tup = (None, 0)
+
+            self.logger.debug("Session id: %d, channel %d opened as session id: %d",
+                              session_id, channel_id, channel_session_id)
+        elif channel_session_id is None:
+            if offset == end:
+                # closed by both sides
+                return (self._handle_mux_frame_len, emews.base.baseserv.FRAME_LEN_STRUCT.size)
+
+            self.logger.debug("Session id: %d, frame for channel %d, which is not open, dropped.",
+                              session_id, channel_id)
+            return (self._handle_mux_frame_len, emews.base.baseserv.FRAME_LEN_STRUCT.size,
+                    emews.base.baseserv.MUX_HEADER_STRUCT.pack(
+                        emews.base.baseserv.CHANNEL_ID_STRUCT.size,
+                        channel_id | emews.base.baseserv.CHANNEL_CLOSE_FLAG))
+        elif offset == end:
+            # closed by the client
+            self._close_channel(session_id, channel_id)
+            return (self._handle_mux_frame_len, emews.base.baseserv.FRAME_LEN_STRUCT.size)
+        else:
+            self._net_cache.session[channel_session_id].recv_len = end - offset
+            ret_tup = self._handle_frame(channel_session_id, chunk, offset)
+
+            if len(ret_tup) == 1:
+                # offloaded handler, the multiplexed session is suspended along with the channel
+                job = ret_tup[0]
+                job.resume = functools.partial(
+                    self._resume_channel, session_id, channel_id, job.resume)
+                return (job,)
+
+        return self._channel_response(session_id, channel_id, ret_tup)
+
+    def _resume_channel(self, session_id, channel_id, resume, ret_val):
+        """Resume a multiplexed session suspended by an offloaded handler of a channel."""
+        return self._channel_response(session_id, channel_id, resume(ret_val))
+
+    def _channel_response(self, session_id, channel_id, ret_tup):
+        """Return the callback tuple of a multiplexed frame, given that of its channel."""
+        send_data = ''
+        if len(ret_tup) == 3:
+            # re-frame the channel response frame as a multiplexed frame
+            frame_len = len(ret_tup[2]) - emews.base.baseserv.FRAME_LEN_STRUCT.size
+            send_data = emews.base.baseserv.MUX_HEADER_STRUCT.pack(
+                frame_len + emews.base.baseserv.CHANNEL_ID_STRUCT.size, channel_id) + \
+                ret_tup[2][emews.base.baseserv.FRAME_LEN_STRUCT.size:]
+
+        if ret_tup[0] is None:
+            # channel ended by the server, let the client know
+            self._close_channel(session_id, channel_id)
+            send_data += emews.base.baseserv.MUX_HEADER_STRUCT.pack(
+                emews.base.baseserv.CHANNEL_ID_STRUCT.size,
+                channel_id | emews.base.baseserv.CHANNEL_CLOSE_FLAG)
+
+        if send_data:
+            return (self._handle_mux_frame_len, emews.base.baseserv.FRAME_LEN_STRUCT.size,
+                    send_data)
+
+        return (self._handle_mux_frame_len, emews.base.baseserv.FRAME_LEN_STRUCT.size)
+
+    def _close_channel(self, session_id, channel_id):
+        """Close a channel of a multiplexed session."""
+        channel_session_id = self._net_cache.session[session_id].channels.pop(channel_id)
+        self.handle_close(channel_session_id)
+        self.logger.debug("Session id: %d, channel %d (session id: %d) closed.",
+                          session_id, channel_id, channel_session_id)
+
+    def _handle_data(self, session_id, chunk, offset):
+        """Handle chunk (buffer view, data starts at offset) during a session with a serv."""
         # connection manager expects: (cb, buf) for read mode, (cb, buf, data) for write mode
         session_data = self._net_cache.session[session_id]
         handler = session_data.handler
 
         try:
-            var_tup = struct.unpack(session_data.recv_type_str, chunk)
+            # unpack straight from the receive buffer (chunk may hold more than the expected bytes)
+            if session_data.recv_struct is None:
+                # string or packed array
+                var_tup = (chunk[offset:offset + session_data.recv_len].tobytes(),)
+                if handler.recv_types[session_data.recv_index][1] != 1:
+                    var_tup = (emews.base.baseserv.decode_array(var_tup[0]),)
+            else:
+                var_tup = session_data.recv_struct.unpack_from(chunk, offset)
         except struct.error as ex:
             self.logger.warning("Session id: %d, struct error when unpacking chunk: %s",
                                 session_id, ex)
@@ -201,22 +714,24 @@ class NetServ(emews.base.baseobject.BaseObject):
         session_data.recv_index += 1
 
         # return the next expected bytes to receive
-        recv_str = handler.recv_types[session_data.recv_index][0]
-        if recv_str == 's':
+        recv_struct, next_recv_bytes = handler.recv_types[session_data.recv_index]
+        if recv_struct is None:
             session_data.recv_args.extend(var_tup[:-1])  # don't append last val, as it's the s len
 
-            # prepare for string reception
+            # prepare for string (packed array) reception
             s_len = var_tup[-1]
+            item_size = next_recv_bytes
 
             if s_len > 0:
-                session_data.recv_type_str = '>%ds' % var_tup[-1]
-                next_recv_bytes = s_len  # next recv bytes correspond to s len
+                session_data.recv_struct = None
+                next_recv_bytes = s_len * item_size  # next recv bytes correspond to s len
             else:
                 self.logger.debug(
                     "Session id: %d, received zero len string, appending empty string ...",
                     session_id)
 
-                session_data.recv_args.append('')
+                session_data.recv_args.append(
+                    '' if item_size == 1 else emews.base.baseserv.decode_array(''))
                 session_data.recv_index += 1  # skip the string recv_str (None var appended)
 
                 if session_data.recv_index == len(handler.recv_types):
@@ -224,21 +739,21 @@ class NetServ(emews.base.baseobject.BaseObject):
                     # comparison here is to the recv_list len, as we increment recv_index by 2
                     return self._invoke_handler(session_id, handler)
 
-                session_data.recv_type_str = handler.recv_types[session_data.recv_index][0]
-                next_recv_bytes = handler.recv_types[session_data.recv_index][1]  # next recv bytes
+                session_data.recv_struct, next_recv_bytes = \
+                    handler.recv_types[session_data.recv_index]
 
         else:
-            session_data.recv_type_str = recv_str
+            session_data.recv_struct = recv_struct
             session_data.recv_args.extend(var_tup)
-            next_recv_bytes = handler.recv_types[session_data.recv_index][1]  # next recv bytes
 
+        session_data.recv_len = next_recv_bytes
         return (self._handle_data, next_recv_bytes)
 
     def _new_handler_invocation(self, session_id, handler):
         """Invoke new handler."""
         session_data = self._net_cache.session[session_id]
         session_data.recv_index = 0
-        session_data.recv_type_str = ''
+        session_data.recv_struct = None
         session_data.recv_args = []
 
         session_data.handler = handler
@@ -249,14 +764,103 @@ class NetServ(emews.base.baseobject.BaseObject):
                 session_id)
             return self._invoke_handler(session_id, handler)
 
-        session_data.recv_type_str = handler.recv_types[0][0]
-        return (self._handle_data, handler.recv_types[0][1])
+        session_data.recv_struct, session_data.recv_len = handler.recv_types[0]
+        return (self._handle_data, session_data.recv_len)
+
+    def _offload_handler(self, session_id, session_data, handler, recv_args):
+        """
+        Run an offloaded handler in the offload pool, return its OffloadJob.
+
+        The caller returns (job,), suspending the session (no further data is processed) until the
+        job completes, after setting job.resume.  Returns None if the handler must run inline
+        (offload disabled, or the pool is full).
+        """
+        if self._offload_pool is None:
+            return None
+
+        job = emews.base.offload_pool.OffloadJob(
+            self._run_handler, (handler, session_id, recv_args))
+        if not self._offload_pool.submit(job):
+            self.logger.debug("Session id: %d, offload pool full, running handler inline.",
+                              session_id)
+            return None
+
+        # (the traffic counters are not thread safe, see offloaded_jobs)
+        self._offloaded_stats[job] = session_data.stats
+        return job
+
+    def _defer_handler(self, session_id, handler, future, defer=True):
+        """
+        Return an OffloadJob completed with the result of a handler which returned a ClientFuture.
+
+        Handlers relaying requests to other nodes return the future of an asynchronous request
+        (which resolves to their actual return value), so the reactor isn't blocked on it.  The
+        caller suspends the session until the job completes, as for an offloaded handler.  If defer
+        is False (or offload is disabled), waits on the future, and returns its result instead.
+        Handlers returning a future must not be offloaded themselves.
+        """
+        if not defer or self._offload_pool is None:
+            self.logger.debug("Session id: %d, waiting on deferred handler result.", session_id)
+            return self._deferred_result(future, handler, session_id, None)
+
+        job = emews.base.offload_pool.OffloadJob(
+            self._deferred_result, (future, handler, session_id))
+        self._offload_pool.defer(job, future)
+        return job
+
+    def _deferred_result(self, future, handler, session_id, timeout=0):
+        """Return the result of the future of a deferred handler, None if it failed."""
+        try:
+            return future.result(timeout)
+        except StandardError as ex:
+            self.logger.error("Session id: %d, deferred handler '%s' failed: %s.",
+                              session_id, handler.callback, ex)
+            return None
+
+    def _call_handler(self, session_data, handler, session_id, recv_args):
+        """Call the handler callback with the received args, return its return value."""
+        start_time = time.time()
+        ret_val = self._run_handler(handler, session_id, recv_args)
+        session_data.stats[TrafficStats.STAT_HANDLER_CALLS] += 1
+        session_data.stats[TrafficStats.STAT_HANDLER_TIME] += time.time() - start_time
+
+        return ret_val
+
+    def _run_handler(self, handler, session_id, recv_args):
+        """
+        Return the return value of the handler callback, given the received args.
+
+        An exception raised by the handler ends its session (None is returned), without affecting
+        other sessions.
+        """
+        try:
+            return handler.callback(session_id, *recv_args)
+        except StandardError as ex:
+            self.logger.error("Session id: %d, handler '%s' threw exception: %s.",
+                              session_id, handler.callback, ex)
+            return None
 
     def _invoke_handler(self, session_id, handler):
         """Invoke the handler callback once all data has been received."""
         session_data = self._net_cache.session[session_id]
-        ret_val = handler.callback(session_id, *session_data.recv_args)
 
+        if handler.offload:
+            job = self._offload_handler(session_id, session_data, handler, session_data.recv_args)
+            if job is not None:
+                job.resume = functools.partial(self._handler_response, session_id, handler)
+                return (job,)
+
+        ret_val = self._call_handler(session_data, handler, session_id, session_data.recv_args)
+        if isinstance(ret_val, emews.base.async_client.ClientFuture):
+            ret_val = self._defer_handler(session_id, handler, ret_val)
+            if isinstance(ret_val, emews.base.offload_pool.OffloadJob):
+                ret_val.resume = functools.partial(self._handler_response, session_id, handler)
+                return (ret_val,)
+
+        return self._handler_response(session_id, handler, ret_val)
+
+    def _handler_response(self, session_id, handler, ret_val):
+        """Return the callback tuple of a (v1) session, given the return value of its handler."""
         # handle return types
         if ret_val is None:
             # end the session
@@ -268,11 +872,7 @@ class NetServ(emews.base.baseobject.BaseObject):
                     "Session id: %d, type specified to pack string is empty.", session_id)
                 return (None, 0)
 
-            if handler.protocol.return_type == 's':
-                # string return type - len needs to be part of this
-                send_data = struct.pack('>H%ss' % len(ret_val[0]), len(ret_val[0]), ret_val[0])
-            else:
-                send_data = struct.pack('>%s' % handler.protocol.return_type, ret_val[0])
+            send_data = handler.protocol.encode_return(ret_val[0])
 
             if ret_val[1] is None:
                 # send some data and then end the session.
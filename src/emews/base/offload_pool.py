@@ -0,0 +1,173 @@
+"""
+Bounded thread pool running slow session handlers off the reactor thread.
+
+Jobs are run by a fixed number of worker threads.  Completed jobs are handed back to the reactor
+through a wakeup pipe: the reactor polls the read end of the pipe, and collects the completed jobs
+once it becomes readable.  The number of pending (submitted, not yet collected) jobs is bounded;
+once reached, jobs are not accepted, and the caller is expected to run them itself.  Jobs waiting on
+an asynchronous request are deferred instead: they are completed along with the request, without
+holding a worker thread.
+
+Created on Oct 17, 2026
+"""
+import collections
+import errno
+import fcntl
+import os
+import Queue
+import sys
+import threading
+import time
+
+import emews.base.baseobject
+
+
+class OffloadJob(object):
+    """A function call to run in the pool, and what to resume with its result."""
+
+    __slots__ = ('fn', 'args', 'resume', 'run_time', '_ret_val', '_exc_info')
+
+    def __init__(self, fn, args, resume=None):
+        """Constructor."""
+        self.fn = fn
+        self.args = args
+        self.resume = resume  # called (reactor thread) with the return value of fn
+        self.run_time = 0.0  # wall time (seconds) fn ran for, set once the job completes
+        self._ret_val = None
+        self._exc_info = None
+
+    def run(self):
+        """Run the function (worker thread), keeping its return value or exception."""
+        start_time = time.time()
+        try:
+            self._ret_val = self.fn(*self.args)
+        except StandardError:
+            self._exc_info = sys.exc_info()
+
+        self.run_time = time.time() - start_time
+
+    def result(self):
+        """Return the return value of the function, or raise the exception it raised."""
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+
+        return self._ret_val
+
+
+class OffloadPool(emews.base.baseobject.BaseObject):
+    """Classdocs."""
+
+    __slots__ = ('_jobs', '_completed', '_lock', '_threads', '_wakeup_r', '_wakeup_w',
+                 '_max_pending', '_num_pending', '_closed')
+
+    CLOSE_WAIT = 1.0  # max seconds to wait on the worker threads (running jobs) when closing
+
+    def __init__(self, num_threads, max_pending):
+        """Constructor."""
+        super(OffloadPool, self).__init__()
+
+        if num_threads < 1:
+            raise ValueError("At least one offload thread is required (given: %d)" % num_threads)
+
+        self._jobs = Queue.Queue()  # jobs to run (None stops a worker thread)
+        self._completed = collections.deque()  # jobs run, not yet collected by the reactor
+        self._lock = threading.Lock()
+        self._max_pending = max_pending
+        self._num_pending = 0  # jobs submitted and not yet collected (reactor thread only)
+        self._closed = False  # wakeup pipe closed (guarded by the lock)
+
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        for fd in (self._wakeup_r, self._wakeup_w):
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+        self._threads = []
+        for index in xrange(num_threads):
+            thread = threading.Thread(target=self._run, name='Offload-%d' % index)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    @property
+    def wakeup_fd(self):
+        """Return the fd which becomes readable when jobs have completed."""
+        return self._wakeup_r
+
+    @property
+    def num_pending(self):
+        """Return the number of jobs submitted and not yet collected."""
+        return self._num_pending
+
+    def submit(self, job):
+        """Submit a job to run.  Returns False if too many jobs are pending (job not accepted)."""
+        if self._num_pending >= self._max_pending:
+            return False
+
+        self._num_pending += 1
+        self._jobs.put(job)
+        return True
+
+    def _run(self):
+        """Worker thread: run jobs as they are submitted."""
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+
+            self._complete(job)
+
+    def defer(self, job, future):
+        """
+        Complete a job once the given future (async_client.ClientFuture) is done.
+
+        The job is not run by a worker thread, but by the thread completing the future (right away
+        if already done), so job.fn must not block.  Deferred jobs don't count towards the bound
+        of pending jobs, as they don't hold a worker thread.
+        """
+        self._num_pending += 1
+        future.add_done_callback(lambda _future: self._complete(job))
+
+    def _complete(self, job):
+        """Run a job, and hand it back to the reactor."""
+        job.run()
+
+        with self._lock:
+            self._completed.append(job)
+            if len(self._completed) == 1 and not self._closed:
+                # The reactor collects all completed jobs on a wakeup.  Written while holding the
+                # lock, so the pipe can't be closed (and its fd reused) in between.
+                try:
+                    os.write(self._wakeup_w, '\0')
+                except OSError as ex:
+                    if ex.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                        raise
+
+    def completed(self):
+        """Return the list of completed jobs (reactor thread, once the wakeup fd is readable)."""
+        try:
+            while os.read(self._wakeup_r, 4096):
+                pass
+        except OSError as ex:
+            if ex.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+        with self._lock:
+            jobs = list(self._completed)
+            self._completed.clear()
+
+        self._num_pending -= len(jobs)
+        return jobs
+
+    def close(self):
+        """Stop the worker threads (once their current job is done), and close the wakeup pipe."""
+        for _ in self._threads:
+            self._jobs.put(None)
+
+        # jobs still running after CLOSE_WAIT complete without a wakeup
+        deadline = time.time() + OffloadPool.CLOSE_WAIT
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.time()))
+
+        with self._lock:
+            self._closed = True
+            os.close(self._wakeup_r)
+            os.close(self._wakeup_w)
@@ -0,0 +1,184 @@
+"""
+Socket readiness backends for the ConnectionManager.
+
+Pollers track file descriptors (not socket objects), so registration changes are O(1) regardless of
+how many sockets are managed.  The epoll backend additionally has no file descriptor ceiling.
+
+Created on Oct 17, 2026
+"""
+import errno
+import select
+
+
+class PollEvents(object):
+    """Enumerations for poll events (bit flags)."""
+
+    __slots__ = ()
+
+    POLL_READ = 1   # fd is readable (or peer hung up)
+    POLL_WRITE = 2  # fd is writable
+    POLL_ERROR = 4  # fd is in an exceptional state
+
+
+class SelectPoller(object):
+    """Readiness backend using select().  Limited to fds below FD_SETSIZE (usually 1024)."""
+
+    __slots__ = ('_r_fds', '_w_fds', '_e_fds')
+
+    name = 'select'
+    FD_SETSIZE = 1024
+
+    def __init__(self):
+        """Constructor."""
+        self._r_fds = set()  # fds to manage for a readable state
+        self._w_fds = set()  # fds to manage for a writable state
+        self._e_fds = set()  # fds to manage for an exceptional state
+
+    def register(self, fd, events):
+        """Start managing fd for the given events."""
+        if fd >= SelectPoller.FD_SETSIZE:
+            raise ValueError("File descriptor %d is out of range for select() (FD_SETSIZE: %d)"
+                             % (fd, SelectPoller.FD_SETSIZE))
+
+        self.modify(fd, events)
+
+    def modify(self, fd, events):
+        """Change the events fd is managed for (an fd managed for no events is not reported)."""
+        if events:
+            self._e_fds.add(fd)
+        else:
+            self._e_fds.discard(fd)
+
+        if events & PollEvents.POLL_READ:
+            self._r_fds.add(fd)
+        else:
+            self._r_fds.discard(fd)
+
+        if events & PollEvents.POLL_WRITE:
+            self._w_fds.add(fd)
+        else:
+            self._w_fds.discard(fd)
+
+    def unregister(self, fd):
+        """Stop managing fd."""
+        self._r_fds.discard(fd)
+        self._w_fds.discard(fd)
+        self._e_fds.discard(fd)
+
+    def poll(self, timeout=None):
+        """Block until at least one fd is ready, return a list of (fd, events)."""
+        try:
+            r_fds, w_fds, e_fds = select.select(self._r_fds, self._w_fds, self._e_fds, timeout)
+        except select.error as ex:
+            if ex.args[0] == errno.EINTR:
+                return []
+            raise
+
+        ready = {}
+        for fd in r_fds:
+            ready[fd] = PollEvents.POLL_READ
+        for fd in w_fds:
+            ready[fd] = ready.get(fd, 0) | PollEvents.POLL_WRITE
+        for fd in e_fds:
+            ready[fd] = ready.get(fd, 0) | PollEvents.POLL_ERROR
+
+        return ready.items()
+
+    def close(self):
+        """Release poller resources."""
+        self._r_fds.clear()
+        self._w_fds.clear()
+        self._e_fds.clear()
+
+
+class EpollPoller(object):
+    """Readiness backend using epoll (Linux)."""
+
+    __slots__ = ('_epoll',)
+
+    name = 'epoll'
+
+    def __init__(self):
+        """Constructor."""
+        self._epoll = select.epoll()
+
+    @staticmethod
+    def _to_epoll(events):
+        """Convert PollEvents flags to epoll flags."""
+        if not events:
+            # Hang ups and errors are reported even for no events, so report them once only
+            # (instead of on every poll) until the events are changed.
+            return select.EPOLLONESHOT
+
+        ep_events = 0
+        if events & PollEvents.POLL_READ:
+            ep_events |= select.EPOLLIN
+        if events & PollEvents.POLL_WRITE:
+            ep_events |= select.EPOLLOUT
+
+        return ep_events
+
+    def register(self, fd, events):
+        """Start managing fd for the given events."""
+        self._epoll.register(fd, EpollPoller._to_epoll(events))
+
+    def modify(self, fd, events):
+        """Change the events fd is managed for."""
+        self._epoll.modify(fd, EpollPoller._to_epoll(events))
+
+    def unregister(self, fd):
+        """Stop managing fd."""
+        try:
+            self._epoll.unregister(fd)
+        except (IOError, OSError, ValueError):
+            # fd already closed or not registered
+            pass
+
+    def poll(self, timeout=None):
+        """Block until at least one fd is ready, return a list of (fd, events)."""
+        try:
+            ep_ready = self._epoll.poll(-1 if timeout is None else timeout)
+        except (IOError, OSError) as ex:
+            if ex.errno == errno.EINTR:
+                return []
+            raise
+
+        ready = []
+        for fd, ep_events in ep_ready:
+            events = 0
+            if ep_events & (select.EPOLLIN | select.EPOLLHUP):
+                # a hang up is treated as readable, recv() will then return zero bytes
+                events |= PollEvents.POLL_READ
+            if ep_events & select.EPOLLOUT:
+                events |= PollEvents.POLL_WRITE
+            if ep_events & select.EPOLLERR:
+                events |= PollEvents.POLL_ERROR
+
+            ready.append((fd, events))
+
+        return ready
+
+    def close(self):
+        """Release poller resources."""
+        self._epoll.close()
+
+
+POLLERS = {
+    'select': SelectPoller,
+    'epoll': EpollPoller,
+}
+
+
+def get_poller(backend='auto'):
+    """Return a new poller instance for the given backend name ('auto' prefers epoll)."""
+    if backend == 'auto':
+        backend = 'epoll' if hasattr(select, 'epoll') else 'select'
+
+    if backend not in POLLERS:
+        raise ValueError("Poll backend '%s' not supported (supported: auto, %s)"
+                         % (backend, ", ".join(sorted(POLLERS.keys()))))
+
+    if backend == 'epoll' and not hasattr(select, 'epoll'):
+        raise ValueError("Poll backend 'epoll' is not available on this platform")
+
+    return POLLERS[backend]()
@@ -29,6 +29,19 @@ class QueryServ(emews.base.baseserv.BaseServ):
         """Session termination."""
         self.serv_close(session_id)
 
+    def _session_handler(self, session_id):
+        """
+        Return the handler which follows a response: the query handler for v2 sessions.
+
+        v2 (framed) clients may send further requests on the session, while v1 clients expect it to
+        end with the response (None is returned).
+        """
+        session_data = self._net_cache.session.get(session_id)
+        if session_data is None or not session_data.framed:
+            return None
+
+        return self.query_handler
+
     def _query(self, session_id, req_id):
         """Process a request sent by a node."""
         try:
@@ -6,6 +6,11 @@ Handles agent communication on the hub.
 Created on Apr 3, 2019
 @author: Brian Ricks
 """
+import functools
+import socket
+import threading
+
+import emews.base.async_client
 import emews.base.baseserv
 import emews.base.enums
 import emews.base.import_tools
@@ -15,7 +20,7 @@ import emews.base.queryserv
 class ServAgent(emews.base.queryserv.QueryServ):
     """Classdocs."""
 
-    __slots__ = ('_env_id', '_env_handler', '_thread_dispatcher')
+    __slots__ = ('_env_id', '_env_handler', '_env_lock', '_thread_dispatcher')
 
     @classmethod
     def build_protocols(cls):
@@ -41,6 +46,12 @@ class ServAgent(emews.base.queryserv.QueryServ):
             request_id=emews.base.enums.agent_protocols.AGENT_ENV_ID)
         cls.protocols[proto_id][new_proto.request_id] = new_proto
 
+        new_proto = emews.base.baseserv.NetProto(
+            'Ls', type_return='a',
+            proto_id=proto_id,
+            request_id=emews.base.enums.agent_protocols.AGENT_ASK_ARRAY)
+        cls.protocols[proto_id][new_proto.request_id] = new_proto
+
     def __init__(self, thread_dispatcher):
         """Constructor."""
         super(ServAgent, self).__init__()
@@ -57,11 +68,18 @@ class ServAgent(emews.base.queryserv.QueryServ):
         self.handlers[request_id] = emews.base.baseserv.Handler(self.protocols[proto_id][request_id], self._agent_tell_env_req)
 
         request_id = emews.base.enums.agent_protocols.AGENT_ENV_ID
-        self.handlers[request_id] = emews.base.baseserv.Handler(self.protocols[proto_id][request_id], self._agent_env_id_req)
+        # registering an environment imports its module, so don't block the reactor on it
+        self.handlers[request_id] = emews.base.baseserv.Handler(
+            self.protocols[proto_id][request_id], self._agent_env_id_req, offload=True)
+
+        request_id = emews.base.enums.agent_protocols.AGENT_ASK_ARRAY
+        self.handlers[request_id] = emews.base.baseserv.Handler(
+            self.protocols[proto_id][request_id], self._agent_ask_array_env_req)
 
         self._env_id = {}  # [env_service_name]: id
         self._env_handler = []  # agent environment callback assigned to env id at index
         self._env_handler.append(None)  # env id 0 is invalid
+        self._env_lock = threading.Lock()  # env id requests run in the offload pool
 
     def _env_register(self, session_id, service_name):
         """Register a new agent environment."""
@@ -112,6 +130,18 @@ class ServAgent(emews.base.queryserv.QueryServ):
 
         return (ev_str, self.query_handler)
 
+    # agent ask (array)
+    def _agent_ask_array_env_req(self, session_id, env_id, ev_key):
+        """Remote agent wants the available evidence of ev_key from the env_id (packed array)."""
+        if env_id < 1 or env_id >= len(self._env_handler):
+            self.logger.warning("Session id: %d, env id '%d' not registered.", session_id, env_id)
+            return ((), self.query_handler)  # no evidence
+
+        evidence = self._env_handler[env_id][1].get_evidence_array(
+            self._net_cache.session[session_id].node_id, ev_key)
+
+        return (evidence, self.query_handler)
+
     # agent tell
     def _agent_tell_env_req(self, session_id, env_id, obs_key, obs_val):
         """Agent is going to update an observation key's value corresponding to the given env id."""
@@ -127,8 +157,73 @@ class ServAgent(emews.base.queryserv.QueryServ):
     # agent env id request
     def _agent_env_id_req(self, session_id, service_name):
         """Remote agent wants the env id for its environment."""
-        if service_name not in self._env_id:
-            # register the service environment
-            return (self._env_register(session_id, service_name), self.query_handler)
+        with self._env_lock:
+            if service_name not in self._env_id:
+                # register the service environment
+                return (self._env_register(session_id, service_name), self.query_handler)
+
+            return (self._env_id[service_name], self.query_handler)
+
 
-        return (self._env_id[service_name], self.query_handler)
+class ServAgentRelay(emews.base.queryserv.QueryServ):
+    """
+    Relays agent requests to the agent server of the owner hub process.
+
+    Used by hub worker processes (see hub_workers.HubWorkers), as agent environments are owned by a
+    single process.  Requests are relayed asynchronously (see NetClient.node_query_async), each
+    session suspended until the owner responds, so the reactor of the worker isn't blocked on the
+    owner.  Requests are relayed using the node id of the agent, so the owner sees it.
+    """
+
+    __slots__ = ('_owner_addr',)
+
+    def __init__(self, owner_addr):
+        """Constructor."""
+        super(ServAgentRelay, self).__init__()
+
+        self._owner_addr = owner_addr  # (address, port) of the owner private listener
+
+        self.handlers = [None] * emews.base.enums.agent_protocols.ENUM_SIZE
+        proto_id = emews.base.enums.net_protocols.NET_AGENT
+
+        for request_id in xrange(1, emews.base.enums.agent_protocols.ENUM_SIZE):
+            protocol = self.protocols[proto_id][request_id]
+            self.handlers[request_id] = emews.base.baseserv.Handler(
+                protocol, functools.partial(self._relay_req, protocol))
+
+    def serv_init(self, node_id, session_id):
+        """Init of new agent session."""
+        pass
+
+    def serv_close(self, session_id):
+        """Close a session."""
+        pass
+
+    def _relay_req(self, protocol, session_id, *args):
+        """Relay a request to the owner, return the future of the result (see NetServ)."""
+        node_id = self._net_cache.session[session_id].node_id
+        relayed = emews.base.async_client.ClientFuture()
+
+        try:
+            self._net_client.node_query_async(
+                emews.base.enums.net_protocols.NET_AGENT, protocol, list(args),
+                addr=self._owner_addr, node_id=node_id if node_id is not None else 0,
+                callback=functools.partial(self._relay_done, session_id, relayed),
+                idempotent=protocol.request_id != emews.base.enums.agent_protocols.AGENT_TELL)
+        except (IOError, socket.error) as ex:
+            self.logger.warning("Session id: %d, could not relay agent request to owner: %s",
+                                session_id, ex)
+            return None
+
+        return relayed
+
+    def _relay_done(self, session_id, relayed, future):
+        """Complete a relayed request, given the future of the request to the owner."""
+        ex = future.exception()
+        if ex is not None:
+            self.logger.warning("Session id: %d, could not relay agent request to owner: %s",
+                                session_id, ex)
+            relayed.set_result(None)  # ends the session
+            return
+
+        relayed.set_result((future.result(), self.query_handler))
@@ -6,8 +6,12 @@ Handles core hub related communication.
 Created on Apr 9, 2019
 @author: Brian Ricks
 """
+import json
+
+import emews.base.async_client
 import emews.base.enums
 import emews.base.baseserv
+import emews.base.hub_workers
 import emews.base.queryserv
 import emews.base.netserv
 
@@ -15,7 +19,10 @@ import emews.base.netserv
 class ServHub(emews.base.queryserv.QueryServ):
     """Classdocs."""
 
-    __slots__ = ('_node_id', '_service_id')
+    __slots__ = ('_id_counters', '_reactor_stats')
+
+    STATS_MAX_LEN = 65535  # string responses are limited to an unsigned short length
+    DIRECT_SESSION_ID = -1  # session id given to handlers on direct (hub node) queries
 
     @classmethod
     def build_protocols(cls):
@@ -35,6 +42,24 @@ class ServHub(emews.base.queryserv.QueryServ):
             request_id=emews.base.enums.hub_protocols.HUB_SERVICE_ID_REQ)
         cls.protocols[proto_id][new_proto.request_id] = new_proto
 
+        new_proto = emews.base.baseserv.NetProto(
+            '', type_return='s',
+            proto_id=proto_id,
+            request_id=emews.base.enums.hub_protocols.HUB_STATS)
+        cls.protocols[proto_id][new_proto.request_id] = new_proto
+
+        new_proto = emews.base.baseserv.NetProto(
+            'H', type_return='L',
+            proto_id=proto_id,
+            request_id=emews.base.enums.hub_protocols.HUB_SERVICE_ID_LEASE)
+        cls.protocols[proto_id][new_proto.request_id] = new_proto
+
+        new_proto = emews.base.baseserv.NetProto(
+            'a', type_return='H',
+            proto_id=proto_id,
+            request_id=emews.base.enums.hub_protocols.HUB_SERVICE_ID_REPORT)
+        cls.protocols[proto_id][new_proto.request_id] = new_proto
+
     def __init__(self):
         """Constructor."""
         super(ServHub, self).__init__()
@@ -48,11 +73,21 @@ class ServHub(emews.base.queryserv.QueryServ):
         request_id = emews.base.enums.hub_protocols.HUB_SERVICE_ID_REQ
         self.handlers[request_id] = emews.base.baseserv.Handler(self.protocols[proto_id][request_id], self._service_id_req)
 
-        self._node_id = 2     # current unassigned node id
-        self._service_id = 2  # current unassigned service id
+        request_id = emews.base.enums.hub_protocols.HUB_STATS
+        self.handlers[request_id] = emews.base.baseserv.Handler(self.protocols[proto_id][request_id], self._stats_req)
+
+        request_id = emews.base.enums.hub_protocols.HUB_SERVICE_ID_LEASE
+        self.handlers[request_id] = emews.base.baseserv.Handler(self.protocols[proto_id][request_id], self._service_id_lease_req)
+
+        request_id = emews.base.enums.hub_protocols.HUB_SERVICE_ID_REPORT
+        self.handlers[request_id] = emews.base.baseserv.Handler(self.protocols[proto_id][request_id], self._service_id_report_req)
+
+        # self._id_counters (injected) holds the current unassigned node and service ids
+        # self._reactor_stats (injected) returns the ConnectionManager statistics (may be None)
 
         # we are the hub node, so use a direct query instead of connecting to myself
         self._net_client.hub_query = self.direct_hub_query
+        self._net_client.hub_query_async = self.direct_hub_query_async
 
         # register my node id
         node_data = emews.base.netserv.NetCache.NodeData()
@@ -68,35 +103,141 @@ class ServHub(emews.base.queryserv.QueryServ):
 
     def _node_id_req(self, session_id):
         """Register a new node."""
-        new_node_id = self._node_id
+        new_node_id = self._id_counters.next_id(emews.base.hub_workers.IdCounters.NODE_ID)
         self._net_cache.add_node(new_node_id, session_id)
         self.logger.info("New node id '%d' given to node using session id: %d",
-                         self._node_id, session_id)
-
-        self._node_id += 1
+                         new_node_id, session_id)
 
         return (new_node_id, None)  # send new node id and terminate
 
     def _service_id_req(self, session_id):
         """Register a new service specific to a node."""
-        new_service_id = self._service_id
-        self._service_id += 1
+        new_service_id = self._id_counters.next_id(emews.base.hub_workers.IdCounters.SERVICE_ID)
 
-        node_id = self._net_cache.session[session_id].node_id
+        node_id = self._session_node_id(session_id)
         self._net_cache.node[node_id].services.add(new_service_id)
 
         self.logger.info("New service id '%d' given to node with id '%d' using session id: %d",
                          new_service_id, node_id, session_id)
 
-        return (new_service_id, None)  # send new service id and terminate
-
-    def direct_hub_query(self, request):
-        """Hub query method that the hub node uses instead of the netclient version."""
-        self._net_cache.session[-1] = emews.base.netserv.NetCache.SessionData()
-        self._net_cache.session[-1].node_id = 1
-
-        ret = self.handlers[request].callback(-1)[0]
-
-        del self._net_cache.session[-1]
-
-        return ret
+        # send new service id, v2 sessions are kept open (clients may reuse their connection)
+        return (new_service_id, self._session_handler(session_id))
+
+    def _service_id_lease_req(self, session_id, num_ids):
+        """
+        Lease a block of num_ids service ids to a node, return the first id of the block.
+
+        Leased ids are added to the services of the node once reported as given to services (see
+        _service_id_report_req).
+        """
+        num_ids = max(1, num_ids)
+        first_service_id = self._id_counters.next_id(
+            emews.base.hub_workers.IdCounters.SERVICE_ID, num_ids)
+
+        self.logger.info(
+            "Service ids '%d' to '%d' leased to node with id '%d' using session id: %d",
+            first_service_id, first_service_id + num_ids - 1, self._session_node_id(session_id),
+            session_id)
+
+        return (first_service_id, self.query_handler)
+
+    def _service_id_report_req(self, session_id, service_ids):
+        """Register leased service ids given to services of a node."""
+        node_id = self._session_node_id(session_id)
+        node_services = self._net_cache.node[node_id].services
+
+        ack_val = emews.base.enums.net_state.STATE_ACK
+        for service_id in service_ids:
+            if not self._id_counters.issued(
+                    emews.base.hub_workers.IdCounters.SERVICE_ID, service_id):
+                self.logger.warning(
+                    "Session id: %d, node with id '%d' reported unassigned service id: %d",
+                    session_id, node_id, service_id)
+                ack_val = emews.base.enums.net_state.STATE_NACK
+                continue
+
+            node_services.add(service_id)
+
+        self.logger.debug("Node with id '%d' reported %d service ids in use, using session id: %d",
+                          node_id, len(service_ids), session_id)
+
+        return (ack_val, self.query_handler)
+
+    @staticmethod
+    def _stats_dict(stats):
+        """Return a traffic counter array as a dict (counters as ints)."""
+        stats_dict = dict(zip(emews.base.netserv.TrafficStats.NAMES, (int(val) for val in stats)))
+        stats_dict['handler_time'] = stats[emews.base.netserv.TrafficStats.STAT_HANDLER_TIME]
+        return stats_dict
+
+    def _stats_req(self, session_id):
+        """
+        Return traffic statistics per net protocol and per node, and reactor statistics.
+
+        If the hub runs multiple reactor processes, the statistics are those of the process
+        serving this session.
+        """
+        proto_stats, node_stats = self._net_cache.traffic()
+
+        stats = {
+            'protocols': dict((proto_id, ServHub._stats_dict(proto_stats[proto_id]))
+                              for proto_id in xrange(len(proto_stats))
+                              if proto_stats[proto_id][0]),
+            'nodes': {},
+            'sessions': len(self._net_cache.session),
+        }
+        if self._reactor_stats is not None:
+            stats['reactor'] = self._reactor_stats()
+
+        # nodes by bytes received (busiest first), as many as the response length allows
+        node_ids = sorted(node_stats, key=lambda node_id: node_stats[node_id][0], reverse=True)
+        num_nodes = len(node_ids)
+        while True:
+            stats['nodes'] = dict((node_id, ServHub._stats_dict(node_stats[node_id]))
+                                  for node_id in node_ids[:num_nodes])
+            stats['nodes_truncated'] = num_nodes < len(node_ids)
+            stats_str = json.dumps(stats, separators=(',', ':'))
+            if len(stats_str) <= ServHub.STATS_MAX_LEN or not num_nodes:
+                break
+            num_nodes /= 2
+
+        return (stats_str, self.query_handler)  # send stats, keeping the session open
+
+    def direct_hub_query(self, request, val_list=None):
+        """
+        Hub query method that the hub node uses instead of the netclient version.
+
+        Direct queries may be made from any thread (services, offloaded handlers), so no session is
+        added to the net cache for them (see _session_node_id).
+        """
+        if val_list is None:
+            return self.handlers[request].callback(ServHub.DIRECT_SESSION_ID)[0]
+
+        return self.handlers[request].callback(ServHub.DIRECT_SESSION_ID, *val_list)[0]
+
+    def direct_hub_query_async(self, request, val_list=None, callback=None, idempotent=False):
+        """
+        Asynchronous version of direct_hub_query (the future returned is already done).
+
+        idempotent is accepted for compatibility with NetClient.hub_query_async (nothing is
+        re-sent).
+        """
+        future = emews.base.async_client.ClientFuture()
+        if callback is not None:
+            future.add_done_callback(callback)
+
+        try:
+            result = self.direct_hub_query(request, val_list)
+        except StandardError as ex:
+            future.set_exception(ex)
+        else:
+            future.set_result(result)
+
+        return future
+
+    def _session_node_id(self, session_id):
+        """Return the node id of a session (the hub node for direct queries)."""
+        if session_id == ServHub.DIRECT_SESSION_ID:
+            return 1
+
+        return self._net_cache.session[session_id].node_id
@@ -4,10 +4,15 @@ Provides a centralized point for distributed log collection over a network.
 Created on Apr 11, 2019
 @author: Brian Ricks
 """
+import cPickle
 import logging
-import pickle
+import struct
+import zlib
 
 import emews.base.baseserv
+import emews.base.logger
+
+RECORD_LEN_STRUCT = struct.Struct('>L')
 
 
 class ServLogging(emews.base.baseserv.BaseServ):
@@ -15,9 +20,14 @@ class ServLogging(emews.base.baseserv.BaseServ):
 
     __slots__ = ()
 
+    # largest a batch of log records may decompress to, larger batches end the session
+    BATCH_MAX_SIZE = 16777216
+
     def __init__(self):
         """Constructor."""
         super(ServLogging, self).__init__()
+        # Log messages are handled inline: offloading suspends the session, which for a
+        # multiplexed session holds back every other channel of the node until handled.
         self.handlers = emews.base.baseserv.Handler(
             emews.base.baseserv.NetProto('s'),
             self._process_message)
@@ -31,7 +41,40 @@ class ServLogging(emews.base.baseserv.BaseServ):
         pass
 
     def _process_message(self, session_id, msg):
-        """Process the complete log message."""
-        log_record = logging.makeLogRecord(pickle.loads(msg))
-        self.logger.logger.handle(log_record)
+        """Process the complete log message, either a single log record or a batch of them."""
+        try:
+            if msg[:1] == emews.base.logger.LOG_BATCH_TAG:
+                log_records = self._decode_batch(msg)
+            else:
+                log_records = [logging.makeLogRecord(cPickle.loads(msg))]
+        except Exception as ex:  # unpickling malformed data may raise most exception types
+            self.logger.warning("Session id: %d, malformed log record, ending session: %r",
+                                session_id, ex)
+            return None
+
+        for log_record in log_records:
+            self.logger.logger.handle(log_record)
+
         return self.handlers
+
+    def _decode_batch(self, msg):
+        """Decompress a batch of log records, and return the records within it."""
+        decompressor = zlib.decompressobj()
+        data = decompressor.decompress(buffer(msg, 1), ServLogging.BATCH_MAX_SIZE)
+        if decompressor.unconsumed_tail:
+            raise ValueError("batch decompresses to more than %d bytes" %
+                             ServLogging.BATCH_MAX_SIZE)
+
+        log_records = []
+        offset = 0
+        while offset < len(data):
+            record_len = RECORD_LEN_STRUCT.unpack_from(data, offset)[0]
+            offset += RECORD_LEN_STRUCT.size
+            if offset + record_len > len(data):
+                raise ValueError("truncated log record in batch")
+
+            log_records.append(logging.makeLogRecord(
+                cPickle.loads(data[offset:offset + record_len])))
+            offset += record_len
+
+        return log_records
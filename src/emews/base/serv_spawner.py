@@ -4,6 +4,9 @@ Service spawner server.
 Created on Apr 19, 2019
 @author: Brian Ricks
 """
+import os
+import signal
+
 import emews.base.baseserv
 import emews.base.enums
 import emews.base.queryserv
@@ -38,7 +41,10 @@ class ServSpawner(emews.base.queryserv.QueryServ):
         proto_id = emews.base.enums.net_protocols.NET_SPAWN
 
         request_id = emews.base.enums.spawner_protocols.SPAWNER_LAUNCH_SERVICE
-        self.handlers[request_id] = emews.base.baseserv.Handler(self.protocols[proto_id][request_id], self._spawn_service_req)
+        # building a service parses its config, imports modules and queries the hub, so don't
+        # block the reactor on it
+        self.handlers[request_id] = emews.base.baseserv.Handler(
+            self.protocols[proto_id][request_id], self._spawn_service_req, offload=True)
 
     def serv_init(self, node_id, session_id):
         """Init of new session."""
@@ -61,11 +67,14 @@ class ServSpawner(emews.base.queryserv.QueryServ):
                 "Session id: %d, ServiceBuilder threw exception while building service: %s: %s",
                 session_id, ex.__class__.__name__, ex)
             if self._raise_sb_exceptions:
+                # the handler runs offloaded (and handler exceptions only end their session), so
+                # halt eMews as raising on the reactor thread used to
                 self.logger.info(
-                    "Session id: %d, raise_on_servicebuilder_exceptions = True, raising exception ...",
-                    session_id)
-                raise
-            return (emews.base.enums.net_state.STATE_NACK, None)
+                    "Session id: %d, raise_on_servicebuilder_exceptions = True, "
+                    "throwing SIGINT ...", session_id)
+                os.kill(os.getpid(), signal.SIGINT)
+            return (emews.base.enums.net_state.STATE_NACK, self._session_handler(session_id))
 
         self._thread_dispatcher.dispatch(service_obj)
-        return (emews.base.enums.net_state.STATE_ACK, None)
+        # v2 sessions are kept open, clients may reuse their connection for further requests
+        return (emews.base.enums.net_state.STATE_ACK, self._session_handler(session_id))
@@ -17,10 +17,13 @@ import threading
 import emews.base.enums
 import emews.base.config
 import emews.base.logger
+import emews.base.netclient
 import emews.base.serv_hub
 import emews.base.system_manager
 import emews.base.sysprop
 
+NODE_ID_STRUCT = struct.Struct('>L')  # node id response of the hub node
+
 
 def system_init(args):
     """Init configuration and base system properties."""
@@ -217,8 +220,10 @@ def _get_node_id(addr, port, timeout, max_attempts):
                                      0,  # node id (not assigned yet, so leave at zero),
                                      emews.base.enums.hub_protocols.HUB_NODE_ID_REQ
                                      ))
-            chunk = sock.recv(4)  # node_id (4 bytes)
-            node_id = struct.unpack('>L', chunk)[0]
+            node_id_buf = bytearray(NODE_ID_STRUCT.size)
+            if emews.base.netclient.recv_exactly(sock, memoryview(node_id_buf)) < len(node_id_buf):
+                raise socket.error("connection closed by the hub node.")
+            node_id = NODE_ID_STRUCT.unpack_from(node_id_buf)[0]
         except (socket.error, struct.error):
             connect_attempts += 1
             sock.close()
@@ -262,7 +267,10 @@ def _init_base_logger(log_config, node_id, host, port, is_hub=False, is_local=Fa
             _log_handler_stream(log_config, logger)
     else:
         # non-hub node: distributed logging
-        logger.addHandler(emews.base.logger.DistLogger(host, port, node_id))
+        logger.addHandler(emews.base.logger.DistLogger(
+            host, port, node_id,
+            log_config['batch_max_records'], log_config['batch_max_delay'],
+            log_config['queue_size']))
 
     return logger
 
@@ -9,6 +9,7 @@ import signal
 import threading
 
 import emews.base.connectionmanager
+import emews.base.hub_workers
 import emews.base.logger
 import emews.base.netclient
 import emews.base.sysprop
@@ -25,6 +26,7 @@ class SystemManager(object):
                  '_thread_dispatcher',
                  '_connection_manager',
                  '_net_client',
+                 '_hub_workers',
                  '_interrupted',
                  '_local_event')
 
@@ -49,6 +51,7 @@ class SystemManager(object):
         self._thread_dispatcher = None
         self._connection_manager = None
         self._net_client = None
+        self._hub_workers = None
         self._interrupted = False
         self._local_event = threading.Event()
 
@@ -101,6 +104,14 @@ class SystemManager(object):
         """Start the daemon."""
         self.logger.debug("Starting system manager ...")
 
+        if self.sys.is_hub and self._config['hub']['reactor_workers'] > 1:
+            # Multi-process hub.  Workers must be forked before any threads are started.
+            self._hub_workers = emews.base.hub_workers.HubWorkers(
+                self._config['hub']['reactor_workers'], _inject={'sys': self.sys})
+            worker_index = self._hub_workers.spawn_workers()
+            self.logger.info("Hub reactor worker %d of %d started.",
+                             worker_index, self._hub_workers.num_workers)
+
         # instantiate thread dispatcher and connection manager
         self._thread_dispatcher = emews.base.thread_dispatcher.ThreadDispatcher(
             self._merge_configs('debug', 'general'),
@@ -129,12 +140,26 @@ class SystemManager(object):
                 self._config['hub']['node_address'],
                 _inject={'sys': self.sys})
 
+            if self._net_client.hub_multiplexed:
+                # distributed logging shares the multiplexed hub connection
+                for handler in self.logger.logger.handlers:
+                    if isinstance(handler, emews.base.logger.DistLogger):
+                        handler.use_channel(self._net_client.open_hub_channel)
+
             self._connection_manager = emews.base.connectionmanager.ConnectionManager(
                 self._merge_configs('debug', 'communication'),
                 self._thread_dispatcher,
                 self._net_client,
+                self._hub_workers,
                 _inject={'sys': self.sys})
 
+            if self._hub_workers is not None and not self._hub_workers.is_owner:
+                # hub worker processes only run a ConnectionManager
+                self._connection_manager.start()  # blocks here
+                self.logger.info("Hub reactor worker %d shutdown complete.",
+                                 self._hub_workers.worker_index)
+                return
+
             self._startup_services()
             if self.sys.is_hub:
                 if self._config['hub']['node_address'] is None:
@@ -163,7 +188,12 @@ class SystemManager(object):
         if not self.sys.local:
             self._connection_manager.stop()
 
-        # shut down any dispatched threads that may be running
+        if self._hub_workers is not None and self._hub_workers.is_owner:
+            self._hub_workers.stop_workers()
+
+        # shut down any dispatched threads that may be running (interrupting the client first, so
+        # threads waiting to reconnect don't hold up their shutdown)
+        self._net_client.interrupt()
         self._thread_dispatcher.shutdown_all_threads()
         self._net_client.close_all_sockets()
 
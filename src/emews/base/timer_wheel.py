@@ -0,0 +1,100 @@
+"""
+Hashed timer wheel.
+
+Timers are hashed by their expiry tick into a fixed number of slots, so scheduling a timer is O(1)
+for a tick that already has timers, and O(log n) in the number of distinct ticks pending otherwise.
+Expiring visits each slot elapsed since the last expiry once (at most a full rotation), along with
+the timers hashed to it, independent of the total number of timers.  Timers are not cancelled; the
+owner of a timer is expected to check on expiry if the timer is still relevant (and reschedule it
+if needed).
+
+Created on Oct 17, 2026
+"""
+import heapq
+import math
+
+
+class TimerWheel(object):
+    """Classdocs."""
+
+    __slots__ = ('_slots', '_num_slots', '_tick_duration', '_cur_tick', '_num_timers',
+                 '_tick_counts', '_ticks')
+
+    def __init__(self, tick_duration=1.0, num_slots=512, now=0.0):
+        """Constructor."""
+        self._tick_duration = float(tick_duration)
+        self._num_slots = num_slots
+        self._slots = [[] for _ in xrange(num_slots)]  # each slot is a list of (tick, key)
+        self._cur_tick = int(now / self._tick_duration)  # last tick processed
+        self._num_timers = 0
+        self._tick_counts = {}  # [tick]: number of timers scheduled to expire on the tick
+        self._ticks = []  # heap of the ticks with timers (expired ticks are removed lazily)
+
+    def __len__(self):
+        """Return the number of scheduled timers."""
+        return self._num_timers
+
+    def tick_of(self, timestamp):
+        """Return the tick a timestamp falls in."""
+        return int(math.ceil(timestamp / self._tick_duration))
+
+    def schedule(self, key, deadline):
+        """Schedule key to expire on the first tick at or after deadline.  Returns the tick."""
+        tick = max(self.tick_of(deadline), self._cur_tick + 1)
+        self._slots[tick % self._num_slots].append((tick, key))
+        self._num_timers += 1
+
+        if tick in self._tick_counts:
+            self._tick_counts[tick] += 1
+        else:
+            self._tick_counts[tick] = 1
+            heapq.heappush(self._ticks, tick)
+
+        return tick
+
+    def next_timeout(self, now):
+        """Return the time (seconds) until the earliest timer, or None if there are no timers."""
+        ticks = self._ticks
+        while ticks and ticks[0] not in self._tick_counts:
+            heapq.heappop(ticks)
+
+        if not ticks:
+            return None
+
+        return max(0.0, ticks[0] * self._tick_duration - now)
+
+    def expire(self, now):
+        """Advance the wheel to now, returning a list of (tick, key) of all expired timers."""
+        expired = []
+        now_tick = int(now / self._tick_duration)
+
+        if now_tick - self._cur_tick > self._num_slots:
+            # more than a full rotation has passed, visit each slot once
+            self._cur_tick = now_tick - self._num_slots
+
+        while self._cur_tick < now_tick and self._num_timers:
+            self._cur_tick += 1
+            slot = self._slots[self._cur_tick % self._num_slots]
+            if not slot:
+                continue
+
+            remaining = []
+            for timer in slot:
+                if timer[0] <= now_tick:
+                    expired.append(timer)
+                else:
+                    # timer for a later rotation of the wheel
+                    remaining.append(timer)
+
+            self._slots[self._cur_tick % self._num_slots] = remaining
+            self._num_timers -= len(slot) - len(remaining)
+
+        self._cur_tick = max(self._cur_tick, now_tick)
+
+        for tick, _ in expired:
+            if self._tick_counts[tick] == 1:
+                del self._tick_counts[tick]
+            else:
+                self._tick_counts[tick] -= 1
+
+        return expired
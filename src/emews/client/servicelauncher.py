@@ -15,18 +15,26 @@ import threading
 
 import emews.base.config
 import emews.base.enums
+import emews.base.netclient
+
+ACK_STRUCT = struct.Struct('>H')  # service launch response (net_state)
 
 
 class SingleServiceClient(object):
     """Classdocs."""
 
-    __slots__ = ('_port', '_service_name', '_service_config_path', '_connect_timeout')
+    __slots__ = ('_port', '_unix_path', '_service_name', '_service_config_path',
+                 '_connect_timeout')
 
     def __init__(self, config, service_name, service_config_path):
         """Constructor."""
         self._port = config['communication']['port']
         print "[service_launcher] daemon port: " + str(self._port)
 
+        self._unix_path = config['communication']['unix_socket_path']
+        if self._unix_path is not None:
+            print "[service_launcher] daemon unix socket path: " + self._unix_path
+
         self._connect_timeout = config['communication']['connect_timeout']
         print "[service_launcher] connect timeout: " + str(self._connect_timeout)
 
@@ -41,6 +49,33 @@ class SingleServiceClient(object):
 
         sys.stdout.flush()
 
+    def _connect(self):
+        """Connect to the eMews daemon, using its unix socket if available (skipping TCP)."""
+        if self._unix_path is not None and os.path.exists(self._unix_path):
+            print "[service_launcher] connecting (unix socket) ..."
+            sys.stdout.flush()
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self._connect_timeout)
+            try:
+                sock.connect(self._unix_path)
+                return sock
+            except socket.error as ex:
+                sock.close()
+                print "[service_launcher] unix socket connect failed (" + str(ex) + \
+                    "), falling back to TCP."
+
+        print "[service_launcher] connecting ..."
+        sys.stdout.flush()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(self._connect_timeout)
+        try:
+            sock.connect(('127.0.0.1', self._port))
+        except socket.error:
+            sock.close()
+            raise
+
+        return sock
+
     def start(self):
         """Connect to eMews daemon and send command."""
         ack = None
@@ -62,13 +97,8 @@ class SingleServiceClient(object):
 
         try:
             try:
-                print "[service_launcher] connecting ..."
-                sys.stdout.flush()
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                sock.settimeout(self._connect_timeout)
-                sock.connect(('127.0.0.1', self._port))
+                sock = self._connect()
             except socket.error as ex:
-                sock.close()
                 raise IOError("socket error on connect: %s." % ex)
 
             print "[service_launcher] connected."
@@ -84,13 +114,12 @@ class SingleServiceClient(object):
             sys.stdout.flush()
 
             try:
-                chunk = sock.recv(2)  # ACK (2 bytes)
-
-                if not len(chunk):
+                ack_buf = bytearray(ACK_STRUCT.size)
+                if emews.base.netclient.recv_exactly(sock, memoryview(ack_buf)) < len(ack_buf):
                     sock.close()
                     raise IOError("connection reset by peer.")
 
-                ack = struct.unpack('>H', chunk)[0]
+                ack = ACK_STRUCT.unpack_from(ack_buf)[0]
             except socket.error as ex:
                 sock.close()
                 raise IOError("socket error on response: %s." % ex)
@@ -105,7 +134,7 @@ class SingleServiceClient(object):
             raise
 
         try:
-            # this most likely will fail as the hub node should have closed the connection
+            # this may fail if the node closed the connection already (older eMews versions)
             sock.shutdown(socket.SHUT_RDWR)
         except socket.error:
             pass
@@ -9,9 +9,11 @@ Created on Mar 29, 2019
 @author: Brian Ricks
 """
 from abc import abstractmethod
+import array
 import time
 
 import emews.base.baseobject
+import emews.base.baseserv
 
 
 class Observation(object):
@@ -61,6 +63,10 @@ class BaseEnv(emews.base.baseobject.BaseObject):
 
         return ev_str[:-1]  # last character is a space
 
+    def get_evidence_array(self, node_id, key):
+        """Return the current evidence by key, as an array of unsigned ints."""
+        return array.array(emews.base.baseserv.ARRAY_TYPECODE, self.get_evidence_list(node_id, key))
+
     def put_observation(self, node_id, obs_key, obs_val):
         """Given an observation key and value, update the observation."""
         self.logger.debug("%s: new observation from node %d '%s', %d",
@@ -27,7 +27,7 @@ class BaseAgent(emews.services.baseservice.BaseService):
         self._proto = self._net_client.protocols[emews.base.enums.net_protocols.NET_AGENT]
 
         self._client_session = self._net_client.create_client_session(
-            emews.base.enums.net_protocols.NET_AGENT)  # NetClient session
+            emews.base.enums.net_protocols.NET_AGENT, pipelined=True)  # NetClient session
         self._env_id = self._get_env_id()
 
     def _get_env_id(self):
@@ -48,27 +48,44 @@ class BaseAgent(emews.services.baseservice.BaseService):
 
         Evidence is a list of integers.
         """
-        ev_str = self._net_client.client_session_get(
+        return self._evidence_list(self._net_client.client_session_get(
             self._client_session,
-            self._proto[emews.base.enums.agent_protocols.AGENT_ASK],
+            self._proto[emews.base.enums.agent_protocols.AGENT_ASK_ARRAY],
             [self._env_id, key]
-            )
+            ))
+
+    def ask_async(self, key, callback=None):
+        """
+        Ask the environment without waiting on the evidence, returning a ClientFuture of it.
+
+        Asynchronous requests of all agents of the node share a single session, run by the I/O
+        thread of the NetClient, so an agent may overlap asks with other work.  callback, if given,
+        is called with the future once it is done (from the I/O thread, so it should not block).
+        """
+        ask_future = self._net_client.node_query_async(
+            emews.base.enums.net_protocols.NET_AGENT,
+            self._proto[emews.base.enums.agent_protocols.AGENT_ASK_ARRAY],
+            [self._env_id, key],
+            idempotent=True
+            ).chain(self._evidence_list)
 
-        if ev_str == '0':
-            return []
+        if callback is not None:
+            ask_future.add_done_callback(callback)
 
-        val_str_list = ev_str.split(',')
-        val_int_list = []
-        for val_str in val_str_list:
-            try:
-                val_int_list.append(int(val_str))
-            except TypeError:
-                self.logger.warning(
-                    "%s: the evidence string returned has a malformed value '%s' for key: %s",
-                    self.service_name, val_str, key)
-                return []
+        return ask_future
 
-        return val_int_list
+    def ask_many(self, keys):
+        """
+        Ask the environment for the evidence of several keys, returning a list of evidence.
+
+        The requests are sent as a single batch request, so this costs a single round trip.
+        """
+        return [self._evidence_list(ev_arr) for ev_arr in self._net_client.client_session_batch(
+            self._client_session,
+            [(self._proto[emews.base.enums.agent_protocols.AGENT_ASK_ARRAY], [self._env_id, key])
+             for key in keys],
+            idempotent=True
+            )]
 
     def tell(self, obs_key, obs_val):
         """
@@ -76,15 +93,63 @@ class BaseAgent(emews.services.baseservice.BaseService):
 
         Observations are provided to the environment, and is used to produce evidence.
         """
-        if obs_key is None or obs_key == '':
-            self.logger.error("%s: state key passed is empty.", self.service_name)
-            raise ValueError("%s: state key passed is empty." % self.service_name)
+        self._check_obs_key(obs_key)
 
-        ack_val = self._net_client.client_session_get(
+        self._check_ack(self._net_client.client_session_get(
             self._client_session,
             self._proto[emews.base.enums.agent_protocols.AGENT_TELL],
             [self._env_id, obs_key, obs_val]
+            ))
+
+    def tell_async(self, obs_key, obs_val, callback=None):
+        """
+        Tell the environment without waiting on the acknowledgement, returning a ClientFuture.
+
+        The future fails with a ValueError if a NACK is returned (see ask_async).
+        """
+        self._check_obs_key(obs_key)
+
+        tell_future = self._net_client.node_query_async(
+            emews.base.enums.net_protocols.NET_AGENT,
+            self._proto[emews.base.enums.agent_protocols.AGENT_TELL],
+            [self._env_id, obs_key, obs_val]
+            ).chain(self._check_ack)
+
+        if callback is not None:
+            tell_future.add_done_callback(callback)
+
+        return tell_future
+
+    def tell_many(self, observations):
+        """
+        Tell the environment several observations, given as a list of (obs_key, obs_val).
+
+        The requests are sent as a single batch request, so this costs a single round trip.  If the
+        connection fails once the batch was sent, it is not sent again (socket.error is raised).
+        """
+        for obs_key, _ in observations:
+            self._check_obs_key(obs_key)
+
+        ack_vals = self._net_client.client_session_batch(
+            self._client_session,
+            [(self._proto[emews.base.enums.agent_protocols.AGENT_TELL],
+              [self._env_id, obs_key, obs_val]) for obs_key, obs_val in observations]
             )
 
+        for ack_val in ack_vals:
+            self._check_ack(ack_val)
+
+    def _evidence_list(self, ev_arr):
+        """Return evidence received as a packed array as a list of integers (None if missing)."""
+        return None if ev_arr is None else list(ev_arr)
+
+    def _check_obs_key(self, obs_key):
+        """Raise ValueError if an observation key is empty."""
+        if obs_key is None or obs_key == '':
+            self.logger.error("%s: state key passed is empty.", self.service_name)
+            raise ValueError("%s: state key passed is empty." % self.service_name)
+
+    def _check_ack(self, ack_val):
+        """Raise ValueError if a TELL was not acknowledged."""
         if ack_val != emews.base.enums.net_state.STATE_ACK:
             raise ValueError("%s: NACK returned when providing evidence (TELL)." % self.service_name)
@@ -9,7 +9,6 @@ import os
 
 import emews.base.baseobject
 import emews.base.config
-import emews.base.enums
 import emews.base.import_tools
 import emews.components.samplers.zerosampler
 
@@ -118,4 +117,4 @@ class ServiceBuilder(emews.base.baseobject.BaseObject):
             # there is no global id in local mode
             return local_service_id
 
-        return self._net_client.hub_query(emews.base.enums.hub_protocols.HUB_SERVICE_ID_REQ)
+        return self._net_client.next_service_id()
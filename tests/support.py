@@ -0,0 +1,170 @@
+"""
+Helpers shared by the unit tests.
+
+Run the tests from the repository root:
+  PYTHONPATH=src python -m unittest discover -s tests
+"""
+import logging
+import socket
+import struct
+import threading
+import time
+import unittest
+
+import emews.base.connectionmanager
+import emews.base.logger
+import emews.base.netclient
+import emews.base.sysprop
+import emews.base.thread_dispatcher
+
+# communication config (see base/conf.yml), port excluded
+COMM_CONFIG = {
+    'connect_timeout': 2,
+    'response_timeout': 30,
+    'connect_max_attempts': 3,
+    'reconnect_backoff_base': 0.1,
+    'reconnect_backoff_max': 10,
+    'circuit_failure_threshold': 10,
+    'circuit_reset_timeout': 30,
+    'service_id_lease_max': 64,
+    'listen_backlog': 1024,
+    'unix_socket_path': None,
+    'wire_protocol': 1,
+    'hub_multiplex': False,
+    'read_ahead_size': 65536,
+    'poll_backend': 'auto',
+    'session_idle_timeout': -1,
+    'session_read_timeout': 30,
+    'session_write_timeout': 30,
+    'session_buffer_limit': 1048576,
+    'global_buffer_limit': 67108864,
+    'max_field_size': 1048576,
+    'offload_threads': 4,
+    'offload_queue_size': 256,
+    'pool_max_idle': 4,
+    'pool_idle_timeout': 60,
+}
+
+SRC_ROOT = emews.base.__path__[0].rsplit('/', 1)[0]  # emews package directory
+
+
+def init_logger():
+    """Set up the base logger (log records of level ERROR and above are shown)."""
+    if emews.base.logger.get_logger() is None:
+        logger = logging.getLogger('emews.tests')
+        logger.addHandler(logging.StreamHandler())
+        logger.setLevel(logging.ERROR)
+        logger.propagate = False
+        emews.base.logger._base_logger = logging.LoggerAdapter(logger, {})
+
+
+def free_port():
+    """Return a TCP port currently free on the loopback interface."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def wait_for(predicate, timeout=2.0):
+    """Wait until predicate() returns True, return False if timeout seconds pass first."""
+    deadline = time.time() + timeout
+    while not predicate():
+        if time.time() >= deadline:
+            return False
+        time.sleep(0.01)
+
+    return True
+
+
+def recv_all(sock, num_bytes):
+    """Receive num_bytes from a (blocking) socket, fewer if the connection is closed."""
+    data = ''
+    while len(data) < num_bytes:
+        chunk = sock.recv(num_bytes - len(data))
+        if not chunk:
+            break
+        data += chunk
+
+    return data
+
+
+class HubTestCase(unittest.TestCase):
+    """Runs a hub ConnectionManager (in a thread) for each test."""
+
+    HUB_CONFIG = {}  # overrides of COMM_CONFIG for the hub
+
+    def setUp(self):
+        """Start the hub."""
+        init_logger()
+
+        self._hubs = []
+        self._clients = []
+        self.config = dict(COMM_CONFIG, port=free_port())
+        self.config.update(self.HUB_CONFIG)
+        self.conn_manager = self.start_hub(self.config)
+
+    def tearDown(self):
+        """Stop the hubs and the clients."""
+        for client in self._clients:
+            client.close_all_sockets()
+
+        for conn_manager, hub_thread, hub_client in self._hubs:
+            conn_manager.stop()
+            hub_thread.join(2)
+            self.assertFalse(hub_thread.is_alive())
+            hub_client.close_all_sockets()
+
+    def start_hub(self, config, hub_workers=None):
+        """Start a hub ConnectionManager in a thread (stopped on tearDown), and return it."""
+        hub_sys = emews.base.sysprop.SysProp(
+            node_name='hub', node_id=1, root_path=SRC_ROOT, is_hub=True, local=False)
+        dispatcher = emews.base.thread_dispatcher.ThreadDispatcher(
+            {'thread_shutdown_wait': 1, 'halt_on_service_exceptions': False,
+             'service_start_delay': -1}, _inject={'sys': hub_sys})
+        hub_config = dict(config, raise_on_servicebuilder_exceptions=False,
+                          halt_on_service_exceptions=False)
+        hub_client = emews.base.netclient.NetClient(
+            dict(config), '127.0.0.1', _inject={'sys': hub_sys})
+        conn_manager = emews.base.connectionmanager.ConnectionManager(
+            hub_config, dispatcher, hub_client, hub_workers, _inject={'sys': hub_sys})
+
+        hub_thread = threading.Thread(target=conn_manager.start)
+        hub_thread.daemon = True
+        hub_thread.start()
+        self._hubs.append((conn_manager, hub_thread, hub_client))
+
+        # the listener is set up by the hub thread
+        self.assertTrue(wait_for(lambda: self._listening(config['port'])))
+        return conn_manager
+
+    @staticmethod
+    def _listening(port):
+        """Return True if the hub accepts connections on port."""
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+        except socket.error:
+            return False
+
+        return True
+
+    def new_client(self, node_id=1, hub_addr='127.0.0.1', **config):
+        """Return a NetClient of a (non-hub) node connecting to the hub."""
+        client_sys = emews.base.sysprop.SysProp(
+            node_name='node%d' % node_id, node_id=node_id, root_path=SRC_ROOT, is_hub=False,
+            local=False)
+        client = emews.base.netclient.NetClient(
+            dict(self.config, **config), hub_addr, _inject={'sys': client_sys})
+        self._clients.append(client)
+        return client
+
+    def connect(self, serv_proto, node_id=1, port=None, rcvbuf=None):
+        """Return a raw session socket to the hub (on port if given), its session header sent."""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if rcvbuf is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+        sock.connect(('127.0.0.1', port or self.config['port']))
+        sock.settimeout(2)
+        sock.sendall(struct.pack('>HL', serv_proto, node_id))
+        return sock
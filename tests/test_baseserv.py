@@ -0,0 +1,186 @@
+"""Tests of the protocol codecs (emews.base.baseserv)."""
+import struct
+import unittest
+
+from emews.base.baseserv import (
+    NetProto, BATCH_HEADER_STRUCT, BATCH_REQUEST_ID, FRAME_LEN_STRUCT, FRAME_SEQ_STRUCT,
+    STR_LEN_STRUCT, ARRAY_LEN_STRUCT, build_query, decode_array, encode_array,
+    encode_batch_frame, encode_frame)
+
+
+def decode_query(protocol, data):
+    """Return (request id, values) of an encoded query, as decoded by the server side."""
+    request_id = struct.unpack_from('>H', data)[0]
+    vals, offset = protocol.decode(memoryview(data), 2, len(data))
+    assert offset == len(data)
+    return (request_id, vals)
+
+
+class TestArrays(unittest.TestCase):
+    """Packed arrays of unsigned ints."""
+
+    def test_round_trip(self):
+        vals = [0, 1, 255, 65536, 2 ** 32 - 1]
+        data = encode_array(vals)
+        self.assertEqual(len(data), 4 * len(vals))
+        self.assertEqual(list(decode_array(data)), vals)
+
+    def test_big_endian(self):
+        self.assertEqual(encode_array([1, 0x01020304]), '\x00\x00\x00\x01\x01\x02\x03\x04')
+
+    def test_empty(self):
+        self.assertEqual(encode_array([]), '')
+        self.assertEqual(list(decode_array('')), [])
+
+
+class TestNetProto(unittest.TestCase):
+    """Query and response codecs of NetProto."""
+
+    def test_fixed_query(self):
+        protocol = NetProto('LH', request_id=7)
+        data = protocol.encode_query([70000, 3])
+        self.assertEqual(data, struct.pack('>HLH', 7, 70000, 3))
+        self.assertEqual(decode_query(protocol, data), (7, [70000, 3]))
+
+    def test_string_query(self):
+        protocol = NetProto('LsHs', request_id=2)
+        data = protocol.encode_query([5, 'abc', 9, ''])
+        self.assertEqual(data, struct.pack('>HLL3sHL', 2, 5, 3, 'abc', 9, 0))
+        self.assertEqual(decode_query(protocol, data), (2, [5, 'abc', 9, '']))
+
+    def test_string_first(self):
+        protocol = NetProto('sL', request_id=1)
+        data = protocol.encode_query(['xy', 4])
+        self.assertEqual(data, struct.pack('>HL2sL', 1, 2, 'xy', 4))
+        self.assertEqual(decode_query(protocol, data), (1, ['xy', 4]))
+
+    def test_array_query(self):
+        protocol = NetProto('aL', request_id=3)
+        data = protocol.encode_query([[1, 2, 3], 4])
+        self.assertEqual(data, struct.pack('>HL3IL', 3, 3, 1, 2, 3, 4))
+        request_id, vals = decode_query(protocol, data)
+        self.assertEqual(request_id, 3)
+        self.assertEqual(list(vals[0]), [1, 2, 3])
+        self.assertEqual(vals[1], 4)
+
+    def test_query_matches_build_query(self):
+        protocol = NetProto('Lsa', request_id=1)
+        vals = [10, 'xyz', [4, 5]]
+        type_str, query_vals = build_query(protocol.format_string, vals)
+        self.assertEqual(protocol.encode_query(vals),
+                         struct.pack('>H', 1) + struct.pack(type_str, *query_vals))
+
+    def test_query_len_mismatch(self):
+        with self.assertRaises(AttributeError):
+            NetProto('Ls', request_id=0).encode_query([1])
+
+    def test_fixed_return(self):
+        protocol = NetProto('', type_return='L')
+        self.assertEqual(protocol.encode_return(12), struct.pack('>L', 12))
+        self.assertEqual(protocol.return_struct.unpack(protocol.encode_return(12)), (12,))
+
+    def test_string_return(self):
+        protocol = NetProto('', type_return='s')
+        self.assertIsNone(protocol.return_struct)
+        self.assertEqual(protocol.encode_return('hello'), STR_LEN_STRUCT.pack(5) + 'hello')
+
+
+class TestFraming(unittest.TestCase):
+    """v2 frames."""
+
+    def test_frame(self):
+        self.assertEqual(encode_frame('abc'), '\x00\x00\x00\x03abc')
+
+    def test_frame_seq_id(self):
+        # the frame length counts the sequence id
+        self.assertEqual(encode_frame('abc', seq_id=5), FRAME_SEQ_STRUCT.pack(7, 5) + 'abc')
+
+    def test_query_frame(self):
+        protocol = NetProto('Hs', request_id=4)
+        self.assertEqual(protocol.encode_query_frame([1, 'ab']),
+                         encode_frame(protocol.encode_query([1, 'ab'])))
+
+    def test_seq_frames(self):
+        # the frame length counts the sequence id
+        protocol = NetProto('H', type_return='L', request_id=4)
+        self.assertEqual(protocol.encode_query_frame([1], seq_id=5),
+                         FRAME_SEQ_STRUCT.pack(8, 5) + protocol.encode_query([1]))
+        self.assertEqual(protocol.encode_return_frame(12, seq_id=6),
+                         FRAME_SEQ_STRUCT.pack(8, 6) + struct.pack('>L', 12))
+
+    def test_decode(self):
+        protocol = NetProto('LsHs', request_id=2)
+        data = 'xx' + protocol.encode_query([5, 'abc', 9, ''])
+        # the fields start after the request id
+        vals, offset = protocol.decode(memoryview(data), 4, len(data))
+        self.assertEqual(vals, [5, 'abc', 9, ''])
+        self.assertEqual(offset, len(data))
+
+    def test_decode_truncated(self):
+        protocol = NetProto('Ls', request_id=0)
+        data = protocol.encode_query([1, 'abcdef'])
+        with self.assertRaises(struct.error):
+            protocol.decode(memoryview(data), 2, len(data) - 1)
+        with self.assertRaises(struct.error):
+            protocol.decode(memoryview(data), 2, 4)
+
+    def test_fixed_return_frame(self):
+        protocol = NetProto('', type_return='L')
+        self.assertEqual(protocol.encode_return_frame(12),
+                         FRAME_LEN_STRUCT.pack(4) + struct.pack('>L', 12))
+
+    def test_string_return_frame(self):
+        # v2 string responses are not prefixed by their length
+        protocol = NetProto('', type_return='s')
+        frame = protocol.encode_return_frame('hello')
+        self.assertEqual(frame, FRAME_LEN_STRUCT.pack(5) + 'hello')
+        self.assertEqual(protocol.decode_return(frame[4:]), 'hello')
+
+    def test_array_return(self):
+        protocol = NetProto('', type_return='a')
+        self.assertEqual(protocol.encode_return([1, 2]),
+                         ARRAY_LEN_STRUCT.pack(2) + encode_array([1, 2]))
+        frame = protocol.encode_return_frame([1, 2], seq_id=9)
+        self.assertEqual(frame[:8], FRAME_SEQ_STRUCT.pack(12, 9))
+        self.assertEqual(list(protocol.decode_return(frame[8:])), [1, 2])
+        with self.assertRaises(struct.error):
+            protocol.decode_return('\x00\x00\x01')
+
+    def test_decode_return(self):
+        protocol = NetProto('', type_return='L')
+        self.assertEqual(protocol.decode_return(protocol.encode_return_frame(12)[4:]), 12)
+        with self.assertRaises(struct.error):
+            protocol.decode_return('\x00\x00\x01')
+
+    def test_decode_return_view(self):
+        for type_return, ret_val in (('L', 12), ('s', 'hello')):
+            protocol = NetProto('', type_return=type_return)
+            frame = protocol.encode_return_frame(ret_val)
+            self.assertEqual(protocol.decode_return(memoryview(frame)[4:]), ret_val)
+
+        protocol = NetProto('', type_return='a')
+        frame = protocol.encode_return_frame([1, 2])
+        self.assertEqual(list(protocol.decode_return(memoryview(frame)[4:])), [1, 2])
+
+    def test_batch_frame(self):
+        first = NetProto('L', request_id=1)
+        second = NetProto('s', request_id=2)
+        frame = encode_batch_frame([(first, [8]), (second, ['ab'])])
+
+        self.assertEqual(FRAME_LEN_STRUCT.unpack_from(frame)[0], len(frame) - 4)
+        self.assertEqual(BATCH_HEADER_STRUCT.unpack_from(frame, 4), (BATCH_REQUEST_ID, 2))
+
+        offset = 4 + BATCH_HEADER_STRUCT.size
+        queries = []
+        for protocol in (first, second):
+            query_len = FRAME_LEN_STRUCT.unpack_from(frame, offset)[0]
+            offset += 4
+            queries.append(decode_query(protocol, frame[offset:offset + query_len]))
+            offset += query_len
+
+        self.assertEqual(offset, len(frame))
+        self.assertEqual(queries, [(1, [8]), (2, ['ab'])])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,672 @@
+"""Tests of the hub reactor (emews.base.connectionmanager)."""
+import collections
+import errno
+import logging
+import os
+import socket
+import struct
+import tempfile
+import threading
+import time
+import unittest
+
+import emews.base.baseserv
+import emews.base.enums
+import emews.base.serv_agent
+from emews.base.connectionmanager import ConnectionManager
+from emews.base.netserv import TrafficStats
+
+import support
+
+
+class AgentHubTestCase(support.HubTestCase):
+    """
+    Hub whose agent handlers are replaced by the test.
+
+    Env ids are the lengths of the service names, and evidence is the first character of the key
+    repeated env id times (its ordinal, for packed array evidence).
+    """
+
+    def setUp(self):
+        self.tells = []
+        self._patched = {}
+        self._patch('_agent_env_id_req', self._env_id_req)
+        self._patch('_agent_tell_env_req', self._tell_req)
+        self._patch('_agent_ask_env_req', self._ask_req)
+        self._patch('_agent_ask_array_env_req', self._ask_array_req)
+
+        super(AgentHubTestCase, self).setUp()
+
+    def tearDown(self):
+        super(AgentHubTestCase, self).tearDown()
+
+        for name, method in self._patched.iteritems():
+            setattr(emews.base.serv_agent.ServAgent, name, method)
+
+    def _patch(self, name, fn):
+        """Replace a handler of ServAgent (handlers are bound when the server is built)."""
+        self._patched[name] = emews.base.serv_agent.ServAgent.__dict__[name]
+        setattr(emews.base.serv_agent.ServAgent, name,
+                lambda serv, session_id, *args: fn(serv, session_id, *args))
+
+    def _env_id_req(self, serv, session_id, service_name):
+        return (len(service_name), serv.query_handler)
+
+    def _tell_req(self, serv, session_id, env_id, ev_key, ev_val):
+        self.tells.append((env_id, ev_key, ev_val))
+        return (0, serv.query_handler)
+
+    def _ask_req(self, serv, session_id, env_id, ev_key):
+        return (ev_key[0] * env_id, serv.query_handler)
+
+    def _ask_array_req(self, serv, session_id, env_id, ev_key):
+        return ([ord(ev_key[0])] * env_id, serv.query_handler)
+
+    @staticmethod
+    def env_id_query(service_name='Test'):
+        """Return an AGENT_ENV_ID request."""
+        return struct.pack('>HL', emews.base.enums.agent_protocols.AGENT_ENV_ID,
+                           len(service_name)) + service_name
+
+    @staticmethod
+    def tell_query(ev_val, env_id=4):
+        """Return an AGENT_TELL request."""
+        return struct.pack('>HLL3sL', emews.base.enums.agent_protocols.AGENT_TELL, env_id, 3,
+                           'key', ev_val)
+
+    @staticmethod
+    def ask_query(ev_len, ev_key='key'):
+        """Return an AGENT_ASK request (for evidence of ev_len bytes)."""
+        return struct.pack('>HLL', emews.base.enums.agent_protocols.AGENT_ASK, ev_len,
+                           len(ev_key)) + ev_key
+
+    def agent_session(self, **kwargs):
+        """Return a raw agent session socket."""
+        return self.connect(emews.base.enums.net_protocols.NET_AGENT, **kwargs)
+
+
+class TestReceive(AgentHubTestCase):
+    """Requests received in pieces."""
+
+    def test_fragmented(self):
+        sock = self.agent_session()
+        for byte in self.env_id_query('Fragmented') + self.tell_query(3):
+            sock.sendall(byte)
+
+        self.assertEqual(struct.unpack('>LH', support.recv_all(sock, 6)), (10, 0))
+        self.assertEqual(self.tells, [(4, 'key', 3)])
+        sock.close()
+
+    def test_large_field(self):
+        # the receive buffer grows for a large field, and the session goes on afterwards
+        sock = self.agent_session()
+        sock.sendall(self.env_id_query('x' * 300000))
+        self.assertEqual(struct.unpack('>L', support.recv_all(sock, 4)), (300000,))
+
+        sock.sendall(self.env_id_query())
+        self.assertEqual(struct.unpack('>L', support.recv_all(sock, 4)), (4,))
+        sock.close()
+
+    def test_many_per_recv(self):
+        # requests sent together are all handled, and answered in order
+        sock = self.agent_session()
+        sock.sendall(self.env_id_query() + ''.join(self.tell_query(val) for val in xrange(50)))
+
+        self.assertEqual(struct.unpack('>L50H', support.recv_all(sock, 104)), (4,) + (0,) * 50)
+        self.assertEqual(self.tells, [(4, 'key', val) for val in xrange(50)])
+        sock.close()
+
+
+class TestReceiveSmallReadAhead(TestReceive):
+    """Requests spanning several reads of the read-ahead buffer."""
+
+    HUB_CONFIG = {'read_ahead_size': 7}
+
+
+class TestSend(AgentHubTestCase):
+    """Responses queued while the client is slow to read them."""
+
+    HUB_CONFIG = {'session_buffer_limit': 67108864}
+
+    def test_slow_reader(self):
+        # requests keep being handled while responses are queued
+        sock = self.agent_session(rcvbuf=4096)
+        sock.sendall(''.join(self.ask_query(60000, chr(ord('a') + index % 26))
+                             for index in xrange(200)))
+        time.sleep(0.1)
+        sock.sendall(self.tell_query(1))
+        self.assertTrue(support.wait_for(lambda: self.tells == [(4, 'key', 1)]))
+
+        for index in xrange(200):
+            self.assertEqual(struct.unpack('>H', support.recv_all(sock, 2)), (60000,))
+            self.assertEqual(support.recv_all(sock, 60000), chr(ord('a') + index % 26) * 60000)
+        self.assertEqual(struct.unpack('>H', support.recv_all(sock, 2)), (0,))
+        sock.close()
+
+    def test_send_buffers(self):
+        # queued buffers are sent in place, the first one from the send offset
+        sock, peer = socket.socketpair()
+        send_queue = collections.deque(['abcd', bytearray('ef'), 'ghi'])
+        self.assertEqual(ConnectionManager._send_buffers(sock, send_queue, 2), 7)
+        self.assertEqual(support.recv_all(peer, 7), 'cdefghi')
+
+        # sending stops at the first partial send
+        sock.setblocking(0)
+        send_queue = collections.deque(['x' * 4194304, 'y'])
+        bytes_sent = ConnectionManager._send_buffers(sock, send_queue, 0)
+        self.assertTrue(0 < bytes_sent < 4194304)
+        sock.close()
+        peer.close()
+
+
+class TestAccept(AgentHubTestCase):
+    """Accepting connections."""
+
+    HUB_CONFIG = {'listen_backlog': 512}
+
+    def test_burst(self):
+        # many nodes connecting at once are all served
+        socks = [self.agent_session() for _ in xrange(200)]
+        for sock in socks:
+            sock.sendall(self.env_id_query())
+        for sock in socks:
+            self.assertEqual(struct.unpack('>L', support.recv_all(sock, 4)), (4,))
+            sock.close()
+
+    def test_drain(self):
+        # connections are accepted until the accept queue is empty
+        class Listener(object):
+            """Accept queue of two connections, one aborted."""
+
+            def __init__(self):
+                self.results = [('sock1', 'addr1'), errno.ECONNABORTED, ('sock2', 'addr2'),
+                                errno.EAGAIN, ('sock3', 'addr3')]
+
+            def accept(self):
+                result = self.results.pop(0)
+                if isinstance(result, int):
+                    raise socket.error(result, 'error')
+                return (Sock(result[0]), result[1])
+
+        class Sock(str):
+            """Accepted socket."""
+
+            def setblocking(self, _):
+                pass
+
+        class Manager(object):
+            """Records accepted connections."""
+
+            logger = self.conn_manager.logger
+
+            def __init__(self):
+                self.accepted = []
+
+            def _accept_connection(self, acc_sock, src_addr):
+                self.accepted.append((acc_sock, src_addr))
+
+        manager = Manager()
+        listener = Listener()
+        ConnectionManager._accept_connections.__func__(manager, listener)
+        self.assertEqual(manager.accepted, [('sock1', 'addr1'), ('sock2', 'addr2')])
+        self.assertEqual(len(listener.results), 1)
+
+
+class TestUnixListener(support.HubTestCase):
+    """AF_UNIX listener of node-local clients."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.unix_path = os.path.join(self.tmp_dir, 'emews.sock')
+        self.HUB_CONFIG = {'unix_socket_path': self.unix_path}
+
+        # a socket file left behind by an earlier run is replaced
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(self.unix_path)
+        stale.close()
+
+        super(TestUnixListener, self).setUp()
+
+    def tearDown(self):
+        super(TestUnixListener, self).tearDown()
+        os.rmdir(self.tmp_dir)
+
+    def test_hub_query(self):
+        client = self.new_client(hub_addr=self.unix_path)
+        service_ids = [client.hub_query(emews.base.enums.hub_protocols.HUB_SERVICE_ID_REQ)
+                       for _ in xrange(3)]
+        self.assertEqual(len(set(service_ids)), 3)
+
+    def test_path_removed(self):
+        self.conn_manager.stop()
+        self.assertTrue(support.wait_for(lambda: not os.path.exists(self.unix_path)))
+
+
+class TestBufferLimits(AgentHubTestCase):
+    """Session buffer caps, and backpressure."""
+
+    HUB_CONFIG = {'max_field_size': 1000, 'session_buffer_limit': 100000,
+                  'global_buffer_limit': 1000000}
+
+    def _stats(self, name):
+        return self.conn_manager.stats()[name]
+
+    def test_field_too_large(self):
+        sock = self.agent_session()
+        sock.sendall(self.env_id_query('x' * 1000))
+        self.assertEqual(struct.unpack('>L', support.recv_all(sock, 4)), (1000,))
+
+        sock.sendall(self.env_id_query('x' * 1001))
+        self.assertEqual(sock.recv(4), '')
+        self.assertEqual(self._stats('closed_over_limit'), 1)
+        sock.close()
+
+    def test_session_limit(self):
+        # a session not reading its responses stops being read
+        sock = self.agent_session(rcvbuf=4096)
+        sock.sendall(''.join(self.ask_query(60000) for _ in xrange(100)))
+        self.assertTrue(support.wait_for(lambda: self._stats('paused_sessions') == 1))
+        sock.sendall(self.tell_query(1))
+        time.sleep(0.1)
+        self.assertEqual(self.tells, [])
+
+        # reading resumes as the responses are sent
+        for _ in xrange(100):
+            self.assertEqual(len(support.recv_all(sock, 60002)), 60002)
+        self.assertEqual(struct.unpack('>H', support.recv_all(sock, 2)), (0,))
+        self.assertEqual(self.tells, [(4, 'key', 1)])
+        self.assertEqual(self._stats('paused_sessions'), 0)
+        self.assertEqual(self._stats('buffered_bytes'), 0)
+        sock.close()
+
+    def test_global_limit(self):
+        # sessions together buffering over the global limit pause the others as well
+        sock = self.agent_session(rcvbuf=4096)
+        sock.sendall(''.join(self.ask_query(60000) for _ in xrange(100)))
+        self.assertTrue(support.wait_for(lambda: self._stats('buffered_bytes') > 1000000))
+
+        other = self.agent_session()
+        other.sendall(self.tell_query(1))
+        self.assertEqual(struct.unpack('>H', support.recv_all(other, 2)), (0,))
+        other.sendall(self.tell_query(2))
+        time.sleep(0.1)
+        self.assertEqual(self.tells, [(4, 'key', 1)])
+
+        for _ in xrange(100):
+            self.assertEqual(len(support.recv_all(sock, 60002)), 60002)
+        self.assertEqual(struct.unpack('>H', support.recv_all(other, 2)), (0,))
+        self.assertEqual(self.tells, [(4, 'key', 1), (4, 'key', 2)])
+        other.close()
+        sock.close()
+
+
+class TimeoutTestCase(AgentHubTestCase):
+    """Hub with short session timeouts (and timer ticks)."""
+
+    def setUp(self):
+        self._timer_tick = ConnectionManager.TIMER_TICK
+        ConnectionManager.TIMER_TICK = 0.05
+        super(TimeoutTestCase, self).setUp()
+
+    def tearDown(self):
+        super(TimeoutTestCase, self).tearDown()
+        ConnectionManager.TIMER_TICK = self._timer_tick
+
+    @staticmethod
+    def closed(sock, timeout=2.0):
+        """Return True if the hub closes the session (any data pending is discarded)."""
+        sock.settimeout(timeout)
+        try:
+            while sock.recv(65536):
+                pass
+        except socket.timeout:
+            return False
+        except socket.error:
+            # reset, as data was pending
+            pass
+
+        return True
+
+
+class TestIdleTimeout(TimeoutTestCase):
+    """Idle sessions."""
+
+    HUB_CONFIG = {'session_idle_timeout': 0.3, 'session_read_timeout': -1,
+                  'session_write_timeout': -1}
+
+    def test_idle(self):
+        sock = self.agent_session()
+        sock.sendall(self.env_id_query())
+        self.assertEqual(struct.unpack('>L', support.recv_all(sock, 4)), (4,))
+        self.assertTrue(self.closed(sock))
+        sock.close()
+
+    def test_active(self):
+        # traffic keeps the session open past the idle timeout
+        sock = self.agent_session()
+        for val in xrange(8):
+            sock.sendall(self.tell_query(val))
+            self.assertEqual(struct.unpack('>H', support.recv_all(sock, 2)), (0,))
+            time.sleep(0.1)
+
+        self.assertEqual(len(self.tells), 8)
+        sock.close()
+
+
+class TestStallTimeouts(TimeoutTestCase):
+    """Sessions stalled receiving a request, or sending a response."""
+
+    HUB_CONFIG = {'session_idle_timeout': -1, 'session_read_timeout': 0.3,
+                  'session_write_timeout': 0.3}
+
+    def test_not_idle(self):
+        sock = self.agent_session()
+        time.sleep(0.6)
+        sock.sendall(self.env_id_query())
+        self.assertEqual(struct.unpack('>L', support.recv_all(sock, 4)), (4,))
+        sock.close()
+
+    def test_partial_request(self):
+        sock = self.agent_session()
+        sock.sendall(self.env_id_query()[:5])
+        self.assertTrue(self.closed(sock))
+        sock.close()
+
+    def test_stalled_reader(self):
+        # the client doesn't read its responses
+        sock = self.agent_session(rcvbuf=4096)
+        sock.sendall(''.join(self.ask_query(60000) for _ in xrange(200)))
+        time.sleep(0.8)
+        self.assertTrue(self.closed(sock))
+        sock.close()
+
+
+class TestPipeline(AgentHubTestCase):
+    """Pipelined (sequenced v2) sessions."""
+
+    @staticmethod
+    def _frame(seq_id, query):
+        return struct.pack('>LL', len(query) + 4, seq_id) + query
+
+    def test_sequence_ids(self):
+        # responses are tagged with the sequence id of their request, and sent in order
+        sock = self.connect(emews.base.enums.net_protocols.NET_AGENT |
+                            emews.base.enums.net_flags.NET_FLAG_V2 |
+                            emews.base.enums.net_flags.NET_FLAG_SEQ)
+        sock.sendall(self._frame(7, self.env_id_query()) + self._frame(3, self.tell_query(1)) +
+                     self._frame(9, self.ask_query(4, 'b')))
+
+        self.assertEqual(struct.unpack('>LLL', support.recv_all(sock, 12)), (8, 7, 4))
+        self.assertEqual(struct.unpack('>LLH', support.recv_all(sock, 10)), (6, 3, 0))
+        self.assertEqual(struct.unpack('>LL', support.recv_all(sock, 8)), (8, 9))
+        self.assertEqual(support.recv_all(sock, 4), 'bbbb')
+        sock.close()
+
+    def test_sequence_without_v2(self):
+        sock = self.connect(emews.base.enums.net_protocols.NET_AGENT |
+                            emews.base.enums.net_flags.NET_FLAG_SEQ)
+        self.assertEqual(support.recv_all(sock, 1), '')
+        sock.close()
+
+    def test_client(self):
+        protocols = emews.base.baseserv.BaseServ.protocols[
+            emews.base.enums.net_protocols.NET_AGENT]
+        for wire_protocol in (1, 2):
+            client = self.new_client(wire_protocol=wire_protocol)
+            session_id = client.create_client_session(
+                emews.base.enums.net_protocols.NET_AGENT, pipelined=True)
+            results = client.client_session_pipeline(session_id, [
+                (protocols[emews.base.enums.agent_protocols.AGENT_ENV_ID], ['Pipelined']),
+                (protocols[emews.base.enums.agent_protocols.AGENT_TELL], [9, 'key', 2]),
+                (protocols[emews.base.enums.agent_protocols.AGENT_ASK], [3, 'cat'])])
+
+            self.assertEqual(results, [9, 0, 'ccc'])
+            client.close_connection(session_id)
+
+        self.assertEqual(self.tells, [(9, 'key', 2)] * 2)
+
+
+class TestBatch(AgentHubTestCase):
+    """Batch requests."""
+
+    def _session(self):
+        return self.connect(emews.base.enums.net_protocols.NET_AGENT |
+                            emews.base.enums.net_flags.NET_FLAG_V2)
+
+    def test_batch(self):
+        # all responses are sent back in a single frame
+        sock = self._session()
+        sock.sendall(emews.base.baseserv.encode_frame(
+            struct.pack('>HH', emews.base.baseserv.BATCH_REQUEST_ID, 3) +
+            ''.join(emews.base.baseserv.encode_frame(query) for query in (
+                self.env_id_query(), self.tell_query(1), self.ask_query(4, 'b')))))
+
+        self.assertEqual(struct.unpack('>LH', support.recv_all(sock, 6)), (24, 3))
+        self.assertEqual(struct.unpack('>LLLHL', support.recv_all(sock, 18)), (4, 4, 2, 0, 4))
+        self.assertEqual(support.recv_all(sock, 4), 'bbbb')
+        self.assertEqual(self.tells, [(4, 'key', 1)])
+
+        # the session goes on
+        sock.sendall(emews.base.baseserv.encode_frame(self.env_id_query('Next')))
+        self.assertEqual(struct.unpack('>LL', support.recv_all(sock, 8)), (4, 4))
+        sock.close()
+
+    def test_truncated(self):
+        # a batch holding less requests than announced ends the session
+        sock = self._session()
+        sock.sendall(emews.base.baseserv.encode_frame(
+            struct.pack('>HH', emews.base.baseserv.BATCH_REQUEST_ID, 2) +
+            emews.base.baseserv.encode_frame(self.tell_query(1))))
+        self.assertEqual(support.recv_all(sock, 1), '')
+        sock.close()
+
+    def test_client(self):
+        protocols = emews.base.baseserv.BaseServ.protocols[
+            emews.base.enums.net_protocols.NET_AGENT]
+        for wire_protocol, pipelined in ((1, False), (2, False), (2, True)):
+            client = self.new_client(wire_protocol=wire_protocol)
+            session_id = client.create_client_session(
+                emews.base.enums.net_protocols.NET_AGENT, pipelined=pipelined)
+            results = client.client_session_batch(session_id, [
+                (protocols[emews.base.enums.agent_protocols.AGENT_ENV_ID], ['Batch']),
+                (protocols[emews.base.enums.agent_protocols.AGENT_ASK], [2, 'dog'])])
+
+            self.assertEqual(results, [5, 'dd'])
+            client.close_connection(session_id)
+
+
+class TestSuspendedSession(AgentHubTestCase):
+    """Sessions waiting on an offloaded handler (env id requests are offloaded)."""
+
+    def setUp(self):
+        # the env id handler blocks until released
+        self.release = threading.Event()
+        super(TestSuspendedSession, self).setUp()
+
+    def tearDown(self):
+        self.release.set()
+        super(TestSuspendedSession, self).tearDown()
+
+    def _env_id_req(self, serv, session_id, service_name):
+        self.release.wait(5)
+        return super(TestSuspendedSession, self)._env_id_req(serv, session_id, service_name)
+
+    def _suspended(self):
+        return self.conn_manager.stats()['suspended_sessions'] == 1
+
+    def _agent_stats(self):
+        return self.conn_manager._net_serv._net_cache.traffic()[0][
+            emews.base.enums.net_protocols.NET_AGENT]
+
+    def test_not_read(self):
+        sock = self.agent_session()
+        sock.sendall(self.env_id_query())
+        self.assertTrue(support.wait_for(self._suspended))
+
+        # requests arriving while suspended stay in the socket buffer
+        sock.sendall(self.tell_query(1))
+        time.sleep(0.2)
+        self.assertEqual(self.tells, [])
+        self.assertEqual(self.conn_manager.stats()['recv_buffered_bytes'], 0)
+
+        self.release.set()
+        self.assertEqual(struct.unpack('>LH', support.recv_all(sock, 6)), (4, 0))
+        self.assertEqual(self.tells, [(4, 'key', 1)])
+        self.assertTrue(support.wait_for(lambda: not self._suspended()))
+        sock.close()
+
+    def test_buffered_requests_order(self):
+        # requests read along with the offloaded one are handled once it completes
+        sock = self.agent_session()
+        sock.sendall(self.env_id_query() + self.tell_query(1) + self.tell_query(2))
+        self.assertTrue(support.wait_for(self._suspended))
+        time.sleep(0.1)
+        self.assertEqual(self.tells, [])
+
+        self.release.set()
+        self.assertEqual(struct.unpack('>LHH', support.recv_all(sock, 8)), (4, 0, 0))
+        self.assertEqual(self.tells, [(4, 'key', 1), (4, 'key', 2)])
+        sock.close()
+
+    def test_other_sessions_served(self):
+        # a suspended session does not hold up the reactor
+        sock = self.agent_session()
+        sock.sendall(self.env_id_query())
+        self.assertTrue(support.wait_for(self._suspended))
+
+        other = self.agent_session()
+        other.sendall(self.tell_query(5))
+        self.assertEqual(struct.unpack('>H', support.recv_all(other, 2)), (0,))
+        self.assertEqual(self.tells, [(4, 'key', 5)])
+
+        self.release.set()
+        self.assertEqual(struct.unpack('>L', support.recv_all(sock, 4)), (4,))
+        other.close()
+        sock.close()
+
+    def test_hang_up(self):
+        # a peer closing a suspended session doesn't affect the handler, the session is closed
+        # once resumed
+        sock = self.agent_session()
+        sock.sendall(self.env_id_query())
+        self.assertTrue(support.wait_for(self._suspended))
+        sock.close()
+        time.sleep(0.1)
+        self.assertEqual(self.conn_manager.stats()['sessions'], 1)
+
+        self.release.set()
+        self.assertTrue(support.wait_for(lambda: self.conn_manager.stats()['sessions'] == 0))
+
+    def test_handler_stats(self):
+        # offloaded handler calls are counted (by the reactor) once they complete
+        sock = self.agent_session()
+        sock.sendall(self.env_id_query())
+        self.assertTrue(support.wait_for(self._suspended))
+        num_calls = self._agent_stats()[TrafficStats.STAT_HANDLER_CALLS]
+        time.sleep(0.1)
+
+        self.release.set()
+        self.assertEqual(struct.unpack('>L', support.recv_all(sock, 4)), (4,))
+        stats = self._agent_stats()
+        self.assertEqual(stats[TrafficStats.STAT_HANDLER_CALLS], num_calls + 1)
+        self.assertGreaterEqual(stats[TrafficStats.STAT_HANDLER_TIME], 0.1)
+        sock.close()
+
+    def test_v2(self):
+        sock = self.connect(emews.base.enums.net_protocols.NET_AGENT |
+                            emews.base.enums.net_flags.NET_FLAG_V2)
+        sock.sendall(emews.base.baseserv.encode_frame(self.env_id_query()) +
+                     emews.base.baseserv.encode_frame(self.tell_query(3)))
+        self.assertTrue(support.wait_for(self._suspended))
+
+        self.release.set()
+        self.assertEqual(struct.unpack('>LLLH', support.recv_all(sock, 14)), (4, 4, 2, 0))
+        sock.close()
+
+
+class TestHandlerException(AgentHubTestCase):
+    """Handlers raising an exception (env ids of 'Fail' and tells of 0 raise)."""
+
+    def setUp(self):
+        super(TestHandlerException, self).setUp()
+        # the exceptions are logged as errors
+        logger = logging.getLogger('emews.tests')
+        self.addCleanup(logger.setLevel, logger.level)
+        logger.setLevel(logging.CRITICAL)
+
+    def _env_id_req(self, serv, session_id, service_name):
+        if service_name == 'Fail':
+            raise ValueError("env id")
+        return super(TestHandlerException, self)._env_id_req(serv, session_id, service_name)
+
+    def _tell_req(self, serv, session_id, env_id, ev_key, ev_val):
+        if not ev_val:
+            raise ValueError("tell")
+        return super(TestHandlerException, self)._tell_req(serv, session_id, env_id, ev_key, ev_val)
+
+    def test_inline(self):
+        # the session ends, others go on
+        sock = self.agent_session()
+        other = self.agent_session()
+        sock.sendall(self.tell_query(0))
+        self.assertEqual(sock.recv(1), '')
+
+        other.sendall(self.tell_query(5))
+        self.assertEqual(struct.unpack('>H', support.recv_all(other, 2)), (0,))
+        self.assertEqual(self.tells, [(4, 'key', 5)])
+        other.close()
+        sock.close()
+
+    def test_offloaded(self):
+        sock = self.agent_session()
+        sock.sendall(self.env_id_query('Fail'))
+        self.assertEqual(sock.recv(1), '')
+        sock.close()
+
+        sock = self.agent_session()
+        sock.sendall(self.env_id_query())
+        self.assertEqual(struct.unpack('>L', support.recv_all(sock, 4)), (4,))
+        sock.close()
+
+    def test_v2(self):
+        sock = self.connect(emews.base.enums.net_protocols.NET_AGENT |
+                            emews.base.enums.net_flags.NET_FLAG_V2)
+        sock.sendall(emews.base.baseserv.encode_frame(self.tell_query(0)))
+        self.assertEqual(sock.recv(1), '')
+        sock.close()
+
+
+class TestArrayEvidence(AgentHubTestCase):
+    """Packed array (AGENT_ASK_ARRAY) responses."""
+
+    def test_v1(self):
+        sock = self.agent_session()
+        sock.sendall(struct.pack('>HLL3s', emews.base.enums.agent_protocols.AGENT_ASK_ARRAY, 2, 3,
+                                 'key'))
+        self.assertEqual(struct.unpack('>LLL', support.recv_all(sock, 12)), (2, 107, 107))
+        sock.close()
+
+    def test_client(self):
+        protocols = emews.base.baseserv.BaseServ.protocols[
+            emews.base.enums.net_protocols.NET_AGENT]
+        for wire_protocol in (1, 2):
+            client = self.new_client(wire_protocol=wire_protocol)
+            session_id = client.create_client_session(emews.base.enums.net_protocols.NET_AGENT)
+            for env_id in (0, 3):
+                evidence = client.client_session_get(
+                    session_id, protocols[emews.base.enums.agent_protocols.AGENT_ASK_ARRAY],
+                    [env_id, 'a'])
+                self.assertEqual(list(evidence), [97] * env_id)
+            client.close_connection(session_id)
+
+    def test_async(self):
+        protocol = emews.base.baseserv.BaseServ.protocols[
+            emews.base.enums.net_protocols.NET_AGENT][
+                emews.base.enums.agent_protocols.AGENT_ASK_ARRAY]
+        future = self.new_client().node_query_async(
+            emews.base.enums.net_protocols.NET_AGENT, protocol, [3, 'a'], idempotent=True)
+        self.assertEqual(list(future.result(2)), [97] * 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+"""Tests of the multi-process hub support (emews.base.hub_workers)."""
+import os
+import struct
+import unittest
+
+import emews.base.enums
+import emews.base.serv_agent
+from emews.base.hub_workers import HubWorkers, IdCounters, SharedIdCounters
+
+import support
+
+
+def read_ids(fd):
+    """Return the ids written to a pipe (as unsigned longs) until closed."""
+    data = ''
+    while True:
+        chunk = os.read(fd, 4096)
+        if not chunk:
+            break
+        data += chunk
+
+    os.close(fd)
+    return list(struct.unpack('>%dL' % (len(data) / 4), data))
+
+
+class TestIdCounters(unittest.TestCase):
+    """IdCounters."""
+
+    def test_next_id(self):
+        counters = IdCounters(first_node_id=5)
+        self.assertEqual([counters.next_id(IdCounters.NODE_ID) for _ in xrange(3)], [5, 6, 7])
+        self.assertEqual(counters.next_id(IdCounters.SERVICE_ID), 2)
+
+    def test_next_id_count(self):
+        for counters in (IdCounters(), SharedIdCounters()):
+            self.assertEqual(counters.next_id(IdCounters.SERVICE_ID, 8), 2)
+            self.assertEqual(counters.next_id(IdCounters.SERVICE_ID), 10)
+            self.assertTrue(counters.issued(IdCounters.SERVICE_ID, 9))
+
+    def test_issued(self):
+        counters = IdCounters()
+        node_id = counters.next_id(IdCounters.NODE_ID)
+        self.assertTrue(counters.issued(IdCounters.NODE_ID, node_id))
+        self.assertFalse(counters.issued(IdCounters.NODE_ID, node_id + 1))
+        self.assertFalse(counters.issued(IdCounters.NODE_ID, 0))
+        self.assertFalse(counters.issued(IdCounters.SERVICE_ID, 2))
+
+
+class TestSharedIdCounters(unittest.TestCase):
+    """SharedIdCounters."""
+
+    def test_fork(self):
+        # both processes assign ids at the same time, each id is assigned once
+        counters = SharedIdCounters()
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            ids = [counters.next_id(IdCounters.SERVICE_ID) for _ in xrange(2000)]
+            os.write(write_fd, struct.pack('>%dL' % len(ids), *ids))
+            os._exit(0)
+
+        os.close(write_fd)
+        ids = [counters.next_id(IdCounters.SERVICE_ID) for _ in xrange(2000)]
+        child_ids = read_ids(read_fd)
+        os.waitpid(pid, 0)
+
+        self.assertEqual(len(child_ids), 2000)
+        self.assertEqual(sorted(ids + child_ids), range(2, 4002))
+        self.assertTrue(counters.issued(IdCounters.SERVICE_ID, max(ids + child_ids)))
+
+
+class TestHubWorkers(unittest.TestCase):
+    """HubWorkers."""
+
+    def setUp(self):
+        support.init_logger()
+
+    def test_too_few(self):
+        self.assertRaises(ValueError, HubWorkers, 1)
+
+    def test_spawn(self):
+        hub_workers = HubWorkers(3)
+        read_fd, write_fd = os.pipe()
+        worker_index = hub_workers.spawn_workers()
+        if worker_index != 0:
+            # worker process: report what it sees, and exit
+            os.close(read_fd)
+            os.write(write_fd, struct.pack(
+                '>3L', worker_index, hub_workers.is_owner, hub_workers.owner_listener is None))
+            os._exit(0)
+
+        os.close(write_fd)
+        reports = read_ids(read_fd)
+        hub_workers.stop_workers()
+
+        self.assertTrue(hub_workers.is_owner)
+        self.assertIsNotNone(hub_workers.owner_listener)
+        self.assertEqual(sorted(zip(reports[::3], reports[1::3], reports[2::3])),
+                         [(1, 0, 1), (2, 0, 1)])
+        hub_workers.owner_listener.close()
+
+
+class TestWorkerHub(support.HubTestCase):
+    """An owner hub, and a worker hub (on its own port here) relaying agent requests to it."""
+
+    def setUp(self):
+        # the owner agent handler returns the node id it sees
+        self._env_id_req = emews.base.serv_agent.ServAgent.__dict__['_agent_env_id_req']
+        emews.base.serv_agent.ServAgent._agent_env_id_req = \
+            lambda serv, session_id, service_name: (
+                serv._net_cache.session[session_id].node_id, serv.query_handler)
+
+        self.owner_workers = HubWorkers(2)
+        worker_workers = HubWorkers(2)
+        worker_workers.owner_listener.close()
+        worker_workers.worker_index = 1
+        worker_workers.id_counters = self.owner_workers.id_counters
+        worker_workers.owner_addr = self.owner_workers.owner_addr
+
+        super(TestWorkerHub, self).setUp()
+
+        self.worker_config = dict(self.config, port=support.free_port())
+        self.start_hub(self.worker_config, worker_workers)
+
+    def tearDown(self):
+        super(TestWorkerHub, self).tearDown()
+        emews.base.serv_agent.ServAgent._agent_env_id_req = self._env_id_req
+
+    def start_hub(self, config, hub_workers=None):
+        """@Override The first hub started is the owner."""
+        if not self._hubs:
+            hub_workers = self.owner_workers
+
+        return super(TestWorkerHub, self).start_hub(config, hub_workers)
+
+    def _node_id(self, port):
+        """Return a new node id, requested from the hub on port."""
+        sock = self.connect(emews.base.enums.net_protocols.NET_HUB, port=port)
+        sock.sendall(struct.pack('>H', emews.base.enums.hub_protocols.HUB_NODE_ID_REQ))
+        node_id = struct.unpack('>L', support.recv_all(sock, 4))[0]
+        sock.close()
+        return node_id
+
+    def test_shared_node_ids(self):
+        # node ids assigned by either hub are unique, and accepted by the other
+        node_ids = [self._node_id(port) for port in (self.config['port'],
+                                                     self.worker_config['port'])]
+        self.assertEqual(len(set(node_ids)), 2)
+
+        sock = self.connect(emews.base.enums.net_protocols.NET_AGENT, node_ids[1])
+        sock.sendall(struct.pack('>HL4s', emews.base.enums.agent_protocols.AGENT_ENV_ID, 4, 'Test'))
+        self.assertEqual(struct.unpack('>L', support.recv_all(sock, 4)), (node_ids[1],))
+        sock.close()
+
+    def test_agent_relay(self):
+        # the worker relays agent requests to the owner, using the node id of the agent
+        node_id = self._node_id(self.worker_config['port'])
+        sock = self.connect(emews.base.enums.net_protocols.NET_AGENT, node_id,
+                            port=self.worker_config['port'])
+        for _ in xrange(3):
+            sock.sendall(struct.pack(
+                '>HL4s', emews.base.enums.agent_protocols.AGENT_ENV_ID, 4, 'Test'))
+            self.assertEqual(struct.unpack('>L', support.recv_all(sock, 4)), (node_id,))
+        sock.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
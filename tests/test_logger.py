@@ -0,0 +1,129 @@
+"""Tests of log record shipping (emews.base.logger) and decoding (emews.base.serv_logging)."""
+import cPickle
+import logging
+import socket
+import struct
+import threading
+import unittest
+import zlib
+
+import emews.base.enums
+import emews.base.logger
+import emews.base.serv_logging
+
+import support
+
+NODE_ID = 4
+
+
+class TestDistLogger(unittest.TestCase):
+    """DistLogger shipping to a hub played by the test."""
+
+    def setUp(self):
+        support.init_logger()
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(1)
+        self.received = []
+        self._hub_thread = threading.Thread(target=self._hub)
+        self._hub_thread.start()
+
+    def tearDown(self):
+        self.listener.close()
+
+    def _hub(self):
+        """Receive everything shipped, until the connection is closed."""
+        self.listener.settimeout(5)
+        try:
+            sock = self.listener.accept()[0]
+        except socket.error:
+            return
+
+        sock.settimeout(5)
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            self.received.append(chunk)
+
+        sock.close()
+
+    def _handler(self, **kwargs):
+        handler = emews.base.logger.DistLogger(
+            '127.0.0.1', self.listener.getsockname()[1], NODE_ID, **kwargs)
+        logger = logging.Logger('emews.tests.remote')
+        logger.addHandler(handler)
+        return (handler, logger)
+
+    def _messages(self):
+        """Return the session header and the log messages received by the hub."""
+        self._hub_thread.join(5)
+        data = ''.join(self.received)
+        header = struct.unpack_from('>HL', data)
+        offset = 6
+        messages = []
+        while offset < len(data):
+            msg_len = struct.unpack_from('>L', data, offset)[0]
+            offset += 4
+            messages.append(data[offset:offset + msg_len])
+            offset += msg_len
+
+        self.assertEqual(offset, len(data))
+        return (header, messages)
+
+    def test_batches(self):
+        handler, logger = self._handler(batch_max_records=8, batch_max_delay=10)
+        for index in xrange(20):
+            logger.warning('record %d of %s', index, 'batch')
+        handler.close()
+
+        header, messages = self._messages()
+        self.assertEqual(header, (emews.base.enums.net_protocols.NET_LOGGING, NODE_ID))
+
+        # batches fill up, the last one is shipped on close
+        serv = emews.base.serv_logging.ServLogging()
+        batches = []
+        for msg in messages:
+            self.assertEqual(msg[:1], emews.base.logger.LOG_BATCH_TAG)
+            batches.append([record.getMessage() for record in serv._decode_batch(msg)])
+
+        self.assertEqual([len(batch) for batch in batches], [8, 8, 4])
+        self.assertEqual(sum(batches, []), ['record %d of batch' % index for index in xrange(20)])
+        self.assertEqual(handler.stats(), {'queued': 20, 'shipped': 20, 'dropped': 0, 'unsent': 0})
+
+    def test_single_records(self):
+        handler, logger = self._handler()
+        logger.error('first')
+        logger.error('second')
+        handler.close()
+
+        messages = self._messages()[1]
+        self.assertEqual([logging.makeLogRecord(cPickle.loads(msg)).getMessage()
+                          for msg in messages], ['first', 'second'])
+
+    def test_closed(self):
+        # records logged once closed are counted as dropped
+        handler, logger = self._handler()
+        logger.error('shipped')
+        handler.close()
+        logger.error('dropped')
+
+        self.assertEqual(len(self._messages()[1]), 1)
+        self.assertEqual(handler.stats(), {'queued': 1, 'shipped': 1, 'dropped': 1, 'unsent': 0})
+
+
+class TestServLogging(unittest.TestCase):
+    """Batch decoding of ServLogging."""
+
+    def setUp(self):
+        support.init_logger()
+        self.serv = emews.base.serv_logging.ServLogging()
+
+    def test_truncated(self):
+        batch = struct.pack('>L', 10) + 'abc'
+        msg = emews.base.logger.LOG_BATCH_TAG + zlib.compress(batch)
+        self.assertRaises(ValueError, self.serv._decode_batch, msg)
+
+
+if __name__ == '__main__':
+    unittest.main()
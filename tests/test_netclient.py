@@ -0,0 +1,665 @@
+"""Tests of the client side (emews.base.netclient)."""
+import socket
+import struct
+import threading
+import time
+import unittest
+
+import emews.base.enums
+from emews.base.baseserv import (
+    CHANNEL_CLOSE_FLAG, CHANNEL_OPEN_FLAG, FRAME_LEN_STRUCT, FRAME_SEQ_STRUCT, HEADER_STRUCT,
+    MUX_HEADER_STRUCT, encode_frame)
+from emews.base.netclient import (
+    CircuitBreakers, ConnectionPool, HubMux, ReconnectBackoff, recv_exactly)
+
+import support
+
+
+class TestRecvExactly(unittest.TestCase):
+    """recv_exactly."""
+
+    def setUp(self):
+        self.sock, self.peer = socket.socketpair()
+        self.sock.settimeout(2)
+
+    def tearDown(self):
+        self.sock.close()
+        self.peer.close()
+
+    def test_chunks(self):
+        view = memoryview(bytearray(6))
+        sender = threading.Thread(target=lambda: [
+            (self.peer.sendall(chunk), time.sleep(0.01)) for chunk in ('ab', 'c', 'def')])
+        sender.start()
+        self.assertEqual(recv_exactly(self.sock, view), 6)
+        self.assertEqual(view.tobytes(), 'abcdef')
+        sender.join()
+
+    def test_closed(self):
+        self.peer.sendall('abc')
+        self.peer.close()
+        view = memoryview(bytearray(6))
+        self.assertEqual(recv_exactly(self.sock, view), 3)
+        self.assertEqual(view[:3].tobytes(), 'abc')
+
+    def test_interrupted(self):
+        self.peer.sendall('abc')
+        calls = []
+
+        def is_interrupted():
+            calls.append(None)
+            return len(calls) > 1
+
+        self.assertEqual(recv_exactly(self.sock, memoryview(bytearray(6)), is_interrupted), 3)
+
+    def test_timeout(self):
+        self.sock.settimeout(0.01)
+        self.assertRaises(socket.timeout, recv_exactly, self.sock, memoryview(bytearray(1)))
+
+
+class TestReconnectBackoff(unittest.TestCase):
+    """ReconnectBackoff."""
+
+    def test_bounds(self):
+        backoff = ReconnectBackoff(0.1, 2.0)
+        prev_delay = 0.1
+        delays = []
+        for _ in xrange(50):
+            delay = backoff.next_delay()
+            self.assertTrue(0.1 <= delay <= min(2.0, prev_delay * 3))
+            prev_delay = delay
+            delays.append(delay)
+
+        # delays grow towards the cap
+        self.assertTrue(max(delays[-10:]) > 1.0)
+
+
+class TestCircuitBreakers(unittest.TestCase):
+    """CircuitBreakers."""
+
+    ADDR = '10.0.0.1'
+
+    def setUp(self):
+        support.init_logger()
+        self.breakers = CircuitBreakers(3, 0.1)
+
+    def _fail(self, num_failures):
+        for _ in xrange(num_failures):
+            self.breakers.failure(self.ADDR)
+
+    def test_opens(self):
+        self._fail(2)
+        self.assertTrue(self.breakers.allow(self.ADDR))
+        self._fail(1)
+        self.assertFalse(self.breakers.allow(self.ADDR))
+        # other nodes are not affected
+        self.assertTrue(self.breakers.allow('10.0.0.2'))
+
+        stats = self.breakers.stats()
+        self.assertEqual(stats['open_circuits'], 1)
+        self.assertEqual(stats['circuit_opens'], 1)
+        self.assertEqual(stats['circuit_rejects'], 1)
+
+    def test_half_open(self):
+        self._fail(3)
+        time.sleep(0.12)
+        # a single attempt is let through
+        self.assertTrue(self.breakers.allow(self.ADDR))
+        self.assertFalse(self.breakers.allow(self.ADDR))
+
+        # failing again opens the circuit for reset_timeout
+        self._fail(1)
+        self.assertFalse(self.breakers.allow(self.ADDR))
+        self.assertEqual(self.breakers.stats()['circuit_opens'], 1)
+
+    def test_success(self):
+        self._fail(3)
+        self.breakers.success(self.ADDR)
+        self.assertTrue(self.breakers.allow(self.ADDR))
+        self.assertEqual(self.breakers.stats()['open_circuits'], 0)
+
+        # failures are consecutive ones
+        self._fail(2)
+        self.breakers.success(self.ADDR)
+        self._fail(2)
+        self.assertTrue(self.breakers.allow(self.ADDR))
+
+    def test_disabled(self):
+        breakers = CircuitBreakers(0, 0.1)
+        for _ in xrange(10):
+            breakers.failure(self.ADDR)
+        self.assertTrue(breakers.allow(self.ADDR))
+
+
+class TestHubMux(unittest.TestCase):
+    """HubMux, the hub side of the connection played by the test."""
+
+    NODE_ID = 9
+
+    def setUp(self):
+        support.init_logger()
+        self.hub_socks = []
+        self.mux = HubMux(self._connect, self.NODE_ID)
+
+    def tearDown(self):
+        self.mux.close()
+        for sock in self.hub_socks:
+            sock.close()
+
+    def _connect(self):
+        sock, hub_sock = socket.socketpair()
+        hub_sock.settimeout(2)
+        self.hub_socks.append(hub_sock)
+        return sock
+
+    def _hub_read(self):
+        """Return (channel id, body) of a multiplexed frame sent to the hub."""
+        frame_len, channel_id = MUX_HEADER_STRUCT.unpack(
+            support.recv_all(self.hub_socks[-1], MUX_HEADER_STRUCT.size))
+        return (channel_id, support.recv_all(self.hub_socks[-1], frame_len - 2))
+
+    def _hub_send(self, channel_id, body):
+        self.hub_socks[-1].sendall(MUX_HEADER_STRUCT.pack(len(body) + 2, channel_id) + body)
+
+    def _open(self, header):
+        """Return an open channel, its session header read by the hub."""
+        num_conns = len(self.hub_socks)
+        channel = self.mux.open_channel()
+        if len(self.hub_socks) > num_conns:
+            # new connection
+            self.assertEqual(
+                support.recv_all(self.hub_socks[-1], HEADER_STRUCT.size), HEADER_STRUCT.pack(
+                    emews.base.enums.net_protocols.NET_MUX |
+                    emews.base.enums.net_flags.NET_FLAG_V2, self.NODE_ID))
+
+        channel.sendall(header)
+        self.assertEqual(self._hub_read(), (channel.channel_id | CHANNEL_OPEN_FLAG, header))
+        return channel
+
+    def test_demux(self):
+        channels = [self._open('hdr%d' % index) for index in xrange(4)]
+        for index, channel in enumerate(channels):
+            channel.sendall(encode_frame('q%d' % index) + encode_frame('Q%d' % index))
+            self.assertEqual(self._hub_read(), (channel.channel_id, 'q%d' % index))
+            self.assertEqual(self._hub_read(), (channel.channel_id, 'Q%d' % index))
+
+        # each thread waits on the responses of its channel, sent in reverse order
+        results = {}
+
+        def wait_response(channel):
+            results[channel.channel_id] = support.recv_all(channel, 6)
+
+        threads = [threading.Thread(target=wait_response, args=(channel,))
+                   for channel in channels]
+        for thread in threads:
+            thread.start()
+        for index, channel in reversed(list(enumerate(channels))):
+            self._hub_send(channel.channel_id, 'r%d' % index)
+        for thread in threads:
+            thread.join(2)
+
+        self.assertEqual(results, dict((channel.channel_id, encode_frame('r%d' % index))
+                                       for index, channel in enumerate(channels)))
+
+    def test_empty_frame(self):
+        channel = self._open('hdr')
+        self._hub_send(channel.channel_id, '')
+        self.assertEqual(support.recv_all(channel, 4), encode_frame(''))
+
+    def test_recv_into(self):
+        channel = self._open('hdr')
+        self._hub_send(channel.channel_id, 'data')
+        view = memoryview(bytearray(8))
+        self.assertEqual(recv_exactly(channel, view), 8)
+        self.assertEqual(view.tobytes(), encode_frame('data'))
+
+        # closed channels return no bytes
+        self._hub_send(channel.channel_id | CHANNEL_CLOSE_FLAG, '')
+        self.assertEqual(channel.recv_into(view), 0)
+
+    def test_closed_by_hub(self):
+        first = self._open('hdr1')
+        second = self._open('hdr2')
+        self._hub_send(first.channel_id | CHANNEL_CLOSE_FLAG, '')
+        self._hub_send(second.channel_id, 'ok')
+
+        self.assertEqual(first.recv(4), '')
+        self.assertEqual(support.recv_all(second, 6), encode_frame('ok'))
+        self.assertRaises(socket.error, first.sendall, encode_frame('q'))
+
+    def test_close_channel(self):
+        channel = self._open('hdr')
+        channel.close()
+        self.assertEqual(self._hub_read(), (channel.channel_id, ''))
+        # closing twice is harmless
+        channel.close()
+
+    def test_connection_lost(self):
+        channel = self._open('hdr')
+        self.hub_socks[0].close()
+        self.assertEqual(channel.recv(4), '')
+
+        # the next channel reconnects
+        channel = self._open('hdr')
+        self.assertEqual(len(self.hub_socks), 2)
+
+
+class TestConnectionPool(unittest.TestCase):
+    """ConnectionPool."""
+
+    KEY = (('127.0.0.1', 32518), emews.base.enums.net_protocols.NET_HUB, 1, False)
+
+    def setUp(self):
+        support.init_logger()
+        self.pool = ConnectionPool(2, 60)
+        self.peers = []
+
+    def tearDown(self):
+        self.pool.close()
+        for peer in self.peers:
+            peer.close()
+
+    def _sock(self):
+        """Return a connected socket, its peer kept by the test."""
+        sock, peer = socket.socketpair()
+        self.peers.append(peer)
+        return sock
+
+    def test_reuse(self):
+        sock = self._sock()
+        self.assertIsNone(self.pool.checkout(self.KEY))
+        self.assertTrue(self.pool.checkin(self.KEY, sock, 3))
+
+        # keys differ by any part of the session header
+        self.assertIsNone(self.pool.checkout(self.KEY[:3] + (True,)))
+        self.assertEqual(self.pool.checkout(self.KEY), (sock, 3))
+        self.assertIsNone(self.pool.checkout(self.KEY))
+        sock.close()
+
+    def test_max_idle(self):
+        socks = [self._sock() for _ in xrange(3)]
+        self.assertEqual([self.pool.checkin(self.KEY, sock, None) for sock in socks],
+                         [True, True, False])
+        # newest first
+        self.assertIs(self.pool.checkout(self.KEY)[0], socks[1])
+        socks[2].close()
+
+    def test_stale(self):
+        closed, pending = self._sock(), self._sock()
+        self.assertTrue(self.pool.checkin(self.KEY, closed, None))
+        self.peers[0].close()
+        self.assertIsNone(self.pool.checkout(self.KEY))
+        self.assertEqual(closed.fileno(), -1)  # closed
+
+        # unexpected data pending
+        self.peers[1].sendall('x')
+        self.assertFalse(self.pool.checkin(self.KEY, pending, None))
+        pending.close()
+
+    def test_idle_timeout(self):
+        pool = ConnectionPool(2, 0.05)
+        sock = self._sock()
+        self.assertTrue(pool.checkin(self.KEY, sock, None))
+        time.sleep(0.1)
+        self.assertIsNone(pool.checkout(self.KEY))
+        self.assertEqual(sock.fileno(), -1)  # closed
+
+    def test_disabled(self):
+        sock = self._sock()
+        self.assertFalse(ConnectionPool(0, 60).checkin(self.KEY, sock, None))
+        sock.close()
+
+
+class TestNetClient(support.HubTestCase):
+    """NetClient sessions to a hub."""
+
+    def _node_client(self, **config):
+        """Return a NetClient of a new node (registered with the hub)."""
+        node_id = self.new_client(hub_multiplex=False).hub_query(
+            emews.base.enums.hub_protocols.HUB_NODE_ID_REQ)
+        return (node_id, self.new_client(node_id, **config))
+
+    def test_multiplexed(self):
+        client = self.new_client(wire_protocol=2, hub_multiplex=True)
+        self.assertTrue(client.hub_multiplexed)
+        service_ids = []
+
+        def query():
+            for _ in xrange(20):
+                service_ids.append(
+                    client.hub_query(emews.base.enums.hub_protocols.HUB_SERVICE_ID_REQ))
+
+        threads = [threading.Thread(target=query) for _ in xrange(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+
+        self.assertEqual(len(set(service_ids)), 160)
+        self.assertNotIn(None, service_ids)
+        # all sessions were carried by a single connection
+        self.assertTrue(support.wait_for(lambda: self.conn_manager.stats()['sessions'] == 1))
+
+    def test_service_id_lease(self):
+        service_ids = []
+        nodes = {}
+        for _ in xrange(2):
+            node_id, client = self._node_client(service_id_lease_max=8)
+            nodes[node_id] = [client.next_service_id() for _ in xrange(20)]
+            service_ids.extend(nodes[node_id])
+
+        self.assertEqual(len(set(service_ids)), 40)
+        self.assertNotIn(None, service_ids)
+
+        # ids given out are reported to the hub
+        node_cache = self.conn_manager._net_serv._net_cache.node
+        for node_id, node_service_ids in nodes.iteritems():
+            self.assertTrue(support.wait_for(
+                lambda: node_cache[node_id].services == set(node_service_ids)))
+
+    def test_service_id_lease_wait(self):
+        client = self._node_client(service_id_lease_max=8)[1]
+        hub_query = client.hub_query
+        leases = []
+        proceed = threading.Event()
+
+        def slow_hub_query(request_id, val_list=None):
+            if request_id == emews.base.enums.hub_protocols.HUB_SERVICE_ID_LEASE:
+                leases.append(val_list)
+                proceed.wait(2)
+            return hub_query(request_id, val_list)
+
+        client.hub_query = slow_hub_query
+        service_ids = []
+        threads = [threading.Thread(target=lambda: service_ids.append(client.next_service_id()))
+                   for _ in xrange(2)]
+        for thread in threads:
+            thread.start()
+
+        self.assertTrue(support.wait_for(lambda: leases))
+        # the lock is not held during the hub query
+        self.assertTrue(client._lease_lock.acquire(False))
+        client._lease_lock.release()
+
+        proceed.set()
+        for thread in threads:
+            thread.join(2)
+
+        # one lease at a time, the block of the first one was used up by its thread
+        self.assertEqual(leases, [[1], [2]])
+        self.assertEqual(len(set(service_ids)), 2)
+        self.assertNotIn(None, service_ids)
+
+    def test_service_id_no_lease(self):
+        client = self._node_client(service_id_lease_max=0)[1]
+        first_id = client.next_service_id()
+        self.assertEqual(client.next_service_id(), first_id + 1)
+
+    def test_report_not_issued(self):
+        client = self._node_client()[1]
+        self.assertEqual(client.hub_query(emews.base.enums.hub_protocols.HUB_SERVICE_ID_REPORT,
+                                          [[client.next_service_id() + 1000]]),
+                         emews.base.enums.net_state.STATE_NACK)
+
+    def test_not_multiplexed(self):
+        self.assertFalse(self.new_client(wire_protocol=2, hub_multiplex=False).hub_multiplexed)
+        self.assertFalse(self.new_client(wire_protocol=1, hub_multiplex=True).hub_multiplexed)
+
+    def _pooled_query(self, client):
+        """Return the service id given by the hub, and the pooled connection used."""
+        service_id = client.hub_query(emews.base.enums.hub_protocols.HUB_SERVICE_ID_REQ)
+        self.assertEqual(len(client._pool._idle), 1)
+        return (service_id, client._pool._idle.values()[0][-1][0])
+
+    def test_pooled(self):
+        client = self.new_client(wire_protocol=2, hub_multiplex=False)
+        service_id, sock = self._pooled_query(client)
+        for index in xrange(1, 5):
+            self.assertEqual(self._pooled_query(client), (service_id + index, sock))
+
+        # a single session carried all the requests
+        self.assertEqual(self.conn_manager.stats()['sessions'], 1)
+
+    def test_pooled_closed_by_hub(self):
+        client = self.new_client(wire_protocol=2, hub_multiplex=False)
+        sock = self._pooled_query(client)[1]
+        # the hub closes the session (as it would once idle)
+        sock.shutdown(socket.SHUT_WR)
+        self.assertTrue(support.wait_for(lambda: self.conn_manager.stats()['sessions'] == 0))
+
+        self.assertIsNot(self._pooled_query(client)[1], sock)
+
+    def test_pooled_reconnect(self):
+        # the hub closes the session after the connection is checked out
+        client = self.new_client(wire_protocol=2, hub_multiplex=False)
+        sock = self._pooled_query(client)[1]
+        sock.shutdown(socket.SHUT_WR)
+        self.assertTrue(support.wait_for(lambda: self.conn_manager.stats()['sessions'] == 0))
+
+        is_stale = ConnectionPool.__dict__['_is_stale']
+        ConnectionPool._is_stale = staticmethod(lambda sock: False)
+        try:
+            self.assertIsInstance(self._pooled_query(client)[0], int)
+        finally:
+            ConnectionPool._is_stale = is_stale
+
+    def test_interrupt_backoff(self):
+        client = self.new_client(hub_multiplex=False, reconnect_backoff_base=5,
+                                 reconnect_backoff_max=10, connect_max_attempts=5)
+        dead_addr = ('127.0.0.1', support.free_port())
+
+        threading.Timer(0.2, client.interrupt).start()
+        start_time = time.time()
+        self.assertIsNone(client._sock_connect(dead_addr))
+        self.assertLess(time.time() - start_time, 2)
+
+
+class TestSessionRetry(support.HubTestCase):
+    """Client sessions sending requests again once reconnected, a node played by the test."""
+
+    def setUp(self):
+        super(TestSessionRetry, self).setUp()
+        self.client = self.new_client(wire_protocol=2)
+        self.protocol = self.client.protocols[emews.base.enums.net_protocols.NET_HUB][
+            emews.base.enums.hub_protocols.HUB_SERVICE_ID_REQ]
+        self.node_listener = None
+        self.accepted = []
+        self.received = []  # number of request frames received per connection
+        self.batch = False  # responses are sent as a batch response
+
+    def tearDown(self):
+        super(TestSessionRetry, self).tearDown()
+        if self.node_listener is not None:
+            self.node_listener.close()
+        for sock in self.accepted:
+            sock.close()
+
+    def _node(self, connections):
+        """
+        Start the node, return the session id of a client session to it.
+
+        For each of connections, (number of request frames, responses, close), a connection is
+        accepted, the request frames received, and the responses (values) sent, as a single batch
+        response if self.batch.  The connection is then closed if close is True.
+        """
+        self.node_listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.node_listener.bind(('127.0.0.1', 0))
+        self.node_listener.listen(4)
+        self.node_listener.settimeout(2)
+
+        def serve():
+            for num_frames, responses, close in connections:
+                try:
+                    sock = self.node_listener.accept()[0]
+                except socket.error:
+                    return
+
+                sock.settimeout(2)
+                self.accepted.append(sock)
+                support.recv_all(sock, HEADER_STRUCT.size)
+                for _ in xrange(num_frames):
+                    frame_len = FRAME_LEN_STRUCT.unpack(
+                        support.recv_all(sock, FRAME_LEN_STRUCT.size))[0]
+                    support.recv_all(sock, frame_len)
+                self.received.append(num_frames)
+
+                frames = [encode_frame(struct.pack('>L', val)) for val in responses]
+                if self.batch and responses:
+                    frames = [encode_frame(struct.pack('>H', len(frames)) + ''.join(frames))]
+                sock.sendall(''.join(frames))
+                if close:
+                    sock.close()
+
+        threading.Thread(target=serve).start()
+        return self.client.create_client_session(
+            emews.base.enums.net_protocols.NET_HUB, addr=self.node_listener.getsockname())
+
+    def test_pipeline_resend(self):
+        # only the requests not answered are sent again
+        session_id = self._node([(3, [100], True), (2, [101, 102], False)])
+        results = self.client.client_session_pipeline(
+            session_id, [(self.protocol, [])] * 3, idempotent=True)
+        self.assertEqual(results, [100, 101, 102])
+        self.assertEqual(self.received, [3, 2])
+
+    def test_pipeline_not_idempotent(self):
+        session_id = self._node([(3, [100], True), (1, [101], False)])
+        self.assertRaises(socket.error, self.client.client_session_pipeline,
+                          session_id, [(self.protocol, [])] * 3)
+        self.assertEqual(self.received, [3])
+
+        # the session was reconnected
+        self.assertEqual(self.client.client_session_get(session_id, self.protocol, []), 101)
+        self.assertEqual(self.received, [3, 1])
+
+    def test_batch_resend(self):
+        self.batch = True
+        session_id = self._node([(1, [], True), (1, [100, 101], False)])
+        results = self.client.client_session_batch(
+            session_id, [(self.protocol, [])] * 2, idempotent=True)
+        self.assertEqual(results, [100, 101])
+        self.assertEqual(self.received, [1, 1])
+
+    def test_batch_not_idempotent(self):
+        self.batch = True
+        session_id = self._node([(1, [], True), (0, [], False)])
+        self.assertRaises(socket.error, self.client.client_session_batch,
+                          session_id, [(self.protocol, [])] * 2)
+        # reconnected, the batch is not sent again
+        self.assertTrue(support.wait_for(lambda: self.received == [1, 0]))
+
+
+class TestAsyncClient(support.HubTestCase):
+    """Asynchronous requests (see async_client)."""
+
+    RESPONSE = 77
+
+    def setUp(self):
+        super(TestAsyncClient, self).setUp()
+        self.client = self.new_client(wire_protocol=2)
+        self.protocol = self.client.protocols[emews.base.enums.net_protocols.NET_HUB][
+            emews.base.enums.hub_protocols.HUB_SERVICE_ID_REQ]
+        self.node_listener = None
+        self.accepted = []
+
+    def tearDown(self):
+        super(TestAsyncClient, self).tearDown()
+        if self.node_listener is not None:
+            self.node_listener.close()
+        for sock in self.accepted:
+            sock.close()
+
+    def _node(self, actions):
+        """
+        Start a node played by the test, return its address.
+
+        Each connection accepted reads a request, and responds ('respond'), closes ('close') or
+        does not respond ('silent'), as given by actions.
+        """
+        self.node_listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.node_listener.bind(('127.0.0.1', 0))
+        self.node_listener.listen(4)
+        self.node_listener.settimeout(2)
+
+        def serve():
+            for action in actions:
+                try:
+                    sock = self.node_listener.accept()[0]
+                except socket.error:
+                    # no further connection (or closed by tearDown)
+                    return
+
+                sock.settimeout(2)
+                self.accepted.append(sock)
+                support.recv_all(sock, HEADER_STRUCT.size)
+                frame_len, seq_id = FRAME_SEQ_STRUCT.unpack(
+                    support.recv_all(sock, FRAME_SEQ_STRUCT.size))
+                support.recv_all(sock, frame_len - 4)
+                if action == 'close':
+                    sock.close()
+                elif action == 'respond':
+                    sock.sendall(encode_frame(struct.pack('>L', self.RESPONSE), seq_id))
+
+        threading.Thread(target=serve).start()
+        return self.node_listener.getsockname()
+
+    def _query(self, addr, idempotent):
+        return self.client.node_query_async(
+            emews.base.enums.net_protocols.NET_HUB, self.protocol, [], addr=addr,
+            idempotent=idempotent)
+
+    def test_hub_query_async(self):
+        called = []
+        futures = [self.client.hub_query_async(emews.base.enums.hub_protocols.HUB_SERVICE_ID_REQ,
+                                               callback=called.append)
+                   for _ in xrange(50)]
+        service_ids = [future.result(2) for future in futures]
+        self.assertEqual(len(set(service_ids)), 50)
+        self.assertTrue(support.wait_for(lambda: len(called) == 50))
+
+    def test_resend_idempotent(self):
+        # the first connection is lost once the request was sent
+        future = self._query(self._node(['close', 'respond']), True)
+        self.assertEqual(future.result(2), self.RESPONSE)
+        self.assertEqual(len(self.accepted), 2)
+
+    def test_not_idempotent(self):
+        future = self._query(self._node(['close', 'respond']), False)
+        self.assertIsInstance(future.exception(2), socket.error)
+        self.assertEqual(len(self.accepted), 1)
+
+    def test_response_timeout(self):
+        client = self.new_client(wire_protocol=2, response_timeout=0.2)
+        start_time = time.time()
+        future = client.node_query_async(emews.base.enums.net_protocols.NET_HUB, self.protocol,
+                                         [], addr=self._node(['silent']))
+        self.assertIsInstance(future.exception(2), socket.timeout)
+        # (connect_timeout is longer)
+        self.assertLess(time.time() - start_time, 1)
+
+    def test_connect_failed(self):
+        # connecting does not hold up requests to other nodes
+        future = self._query(('127.0.0.1', support.free_port()), True)
+        hub_future = self.client.hub_query_async(
+            emews.base.enums.hub_protocols.HUB_SERVICE_ID_REQ)
+        self.assertIsInstance(hub_future.result(2), int)
+        self.assertIsInstance(future.exception(2), socket.error)
+
+    def test_circuit_open(self):
+        client = self.new_client(circuit_failure_threshold=1, connect_max_attempts=1)
+        dead_addr = ('127.0.0.1', support.free_port())
+        future = client.node_query_async(emews.base.enums.net_protocols.NET_HUB, self.protocol,
+                                         [], addr=dead_addr, idempotent=True)
+        self.assertIsInstance(future.exception(2), socket.error)
+
+        # the circuit is open once the connection failed
+        future = client.node_query_async(emews.base.enums.net_protocols.NET_HUB, self.protocol,
+                                         [], addr=dead_addr)
+        ex = future.exception(2)
+        self.assertIsInstance(ex, IOError)
+        self.assertNotIsInstance(ex, socket.error)
+        self.assertEqual(client.stats()['circuit_rejects'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
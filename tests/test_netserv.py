@@ -0,0 +1,201 @@
+"""Tests of the session protocol handling (emews.base.netserv) and the hub server."""
+import json
+import struct
+import time
+import unittest
+
+import emews.base.enums
+from emews.base.baseserv import CHANNEL_CLOSE_FLAG, CHANNEL_OPEN_FLAG
+from emews.base.netserv import NetCache, TrafficStats
+
+import support
+
+
+class TestNetCache(unittest.TestCase):
+    """Traffic accounting of NetCache."""
+
+    def test_traffic(self):
+        net_cache = NetCache()
+        net_cache.node[3] = NetCache.NodeData()
+        net_cache.node[3].stats[TrafficStats.STAT_BYTES_IN] = 10
+        net_cache.proto_stats[emews.base.enums.net_protocols.NET_HUB][
+            TrafficStats.STAT_BYTES_IN] = 10
+
+        # open sessions are included
+        session_data = NetCache.SessionData()
+        session_data.node_id = 3
+        session_data.proto_id = emews.base.enums.net_protocols.NET_HUB
+        session_data.stats[TrafficStats.STAT_BYTES_IN] = 5
+        net_cache.session[1] = session_data
+
+        proto_stats, node_stats = net_cache.traffic()
+        self.assertEqual(
+            proto_stats[emews.base.enums.net_protocols.NET_HUB][TrafficStats.STAT_BYTES_IN], 15)
+        self.assertEqual(node_stats[3][TrafficStats.STAT_BYTES_IN], 15)
+
+        # the totals kept are not changed
+        self.assertEqual(net_cache.node[3].stats[TrafficStats.STAT_BYTES_IN], 10)
+
+
+class TestHubStats(support.HubTestCase):
+    """HUB_STATS requests."""
+
+    def _stats(self):
+        sock = self.connect(emews.base.enums.net_protocols.NET_HUB)
+        sock.sendall(struct.pack('>H', emews.base.enums.hub_protocols.HUB_STATS))
+        stats_len = struct.unpack('>H', support.recv_all(sock, 2))[0]
+        stats = json.loads(support.recv_all(sock, stats_len))
+        sock.close()
+        return stats
+
+    def test_stats(self):
+        client = self.new_client(wire_protocol=2, hub_multiplex=False)
+        for _ in xrange(5):
+            client.hub_query(emews.base.enums.hub_protocols.HUB_SERVICE_ID_REQ)
+
+        # the client connection is pooled, its session is kept open along with this one
+        self.assertTrue(support.wait_for(lambda: self._stats()['sessions'] == 2))
+        stats = self._stats()
+        hub_stats = stats['protocols'][str(emews.base.enums.net_protocols.NET_HUB)]
+
+        # 5 service id requests and at least one earlier stats request
+        self.assertGreaterEqual(hub_stats['handler_calls'], 6)
+        self.assertGreaterEqual(hub_stats['frames_in'], 6)
+        self.assertGreaterEqual(hub_stats['frames_out'], 6)
+        self.assertGreaterEqual(hub_stats['bytes_in'], 6 * 2)
+        self.assertEqual(stats['nodes']['1']['handler_calls'], hub_stats['handler_calls'])
+        self.assertFalse(stats['nodes_truncated'])
+        self.assertEqual(stats['reactor']['sessions'], 2)
+
+
+class TestFraming(support.HubTestCase):
+    """v2 (length-prefixed) sessions."""
+
+    def _connect(self):
+        return self.connect(emews.base.enums.net_protocols.NET_HUB |
+                            emews.base.enums.net_flags.NET_FLAG_V2)
+
+    @staticmethod
+    def _query_frame(request_id, body=''):
+        return struct.pack('>LH', len(body) + 2, request_id) + body
+
+    def test_request(self):
+        # the frame arrives in pieces
+        sock = self._connect()
+        frame = self._query_frame(emews.base.enums.hub_protocols.HUB_SERVICE_ID_REQ)
+        for index in xrange(len(frame)):
+            sock.sendall(frame[index])
+            time.sleep(0.01)
+
+        self.assertEqual(struct.unpack('>L', support.recv_all(sock, 4)), (4,))
+        service_id = struct.unpack('>L', support.recv_all(sock, 4))[0]
+
+        # the session is kept open for further requests
+        sock.sendall(frame)
+        self.assertEqual(struct.unpack('>LL', support.recv_all(sock, 8)), (4, service_id + 1))
+        sock.close()
+
+    def test_v1_request(self):
+        # v1 sessions end with the response, as older clients expect
+        sock = self.connect(emews.base.enums.net_protocols.NET_HUB)
+        sock.sendall(struct.pack('>H', emews.base.enums.hub_protocols.HUB_SERVICE_ID_REQ))
+        self.assertEqual(len(support.recv_all(sock, 4)), 4)
+        self.assertEqual(support.recv_all(sock, 1), '')
+        sock.close()
+
+    def test_string_response(self):
+        sock = self._connect()
+        sock.sendall(self._query_frame(emews.base.enums.hub_protocols.HUB_STATS))
+        frame_len = struct.unpack('>L', support.recv_all(sock, 4))[0]
+        self.assertIn('protocols', json.loads(support.recv_all(sock, frame_len)))
+        sock.close()
+
+    def test_trailing_bytes(self):
+        sock = self._connect()
+        sock.sendall(self._query_frame(emews.base.enums.hub_protocols.HUB_SERVICE_ID_REQ, 'x'))
+        self.assertEqual(support.recv_all(sock, 1), '')
+        sock.close()
+
+    def test_clients(self):
+        for wire_protocol in (1, 2):
+            client = self.new_client(wire_protocol=wire_protocol)
+            self.assertIsInstance(
+                client.hub_query(emews.base.enums.hub_protocols.HUB_SERVICE_ID_REQ), int)
+
+
+class TestMux(support.HubTestCase):
+    """Multiplexed (NET_MUX) connections."""
+
+    def setUp(self):
+        super(TestMux, self).setUp()
+        self.sock = self.connect(emews.base.enums.net_protocols.NET_MUX |
+                                 emews.base.enums.net_flags.NET_FLAG_V2)
+
+    def tearDown(self):
+        self.sock.close()
+        super(TestMux, self).tearDown()
+
+    def _send(self, channel_id, body):
+        self.sock.sendall(struct.pack('>LH', len(body) + 2, channel_id) + body)
+
+    def _read(self):
+        frame_len, channel_id = struct.unpack('>LH', support.recv_all(self.sock, 6))
+        return (channel_id, support.recv_all(self.sock, frame_len - 2))
+
+    def test_channels(self):
+        # hub sessions on two channels, the second opened before the first is answered
+        header = struct.pack('>HL', emews.base.enums.net_protocols.NET_HUB |
+                             emews.base.enums.net_flags.NET_FLAG_V2, 1)
+        query = struct.pack('>LH', 2, emews.base.enums.hub_protocols.HUB_SERVICE_ID_REQ)
+        self._send(1 | CHANNEL_OPEN_FLAG, header)
+        self._send(2 | CHANNEL_OPEN_FLAG, header)
+        self._send(2, query[4:])
+        self._send(1, query[4:])
+
+        frames = [self._read() for _ in xrange(2)]
+        self.assertEqual([frame[0] for frame in frames], [2, 1])
+        self.assertNotEqual(frames[0][1], frames[1][1])
+
+        # closing a channel ends its session, the other channel is kept open
+        self._send(2, '')
+        self._send(1, query[4:])
+        self.assertEqual(self._read()[0], 1)
+
+        # the connection is still up
+        self._send(3 | CHANNEL_OPEN_FLAG, header)
+        self._send(3, query[4:])
+        self.assertEqual(self._read()[0], 3)
+
+    def test_not_open(self):
+        self._send(5, 'data')
+        self.assertEqual(self._read(), (5 | CHANNEL_CLOSE_FLAG, ''))
+
+
+class TestInvalidSessions(support.HubTestCase):
+    """Sessions the hub ends without stopping."""
+
+    def _served(self):
+        """Return True if the hub still answers service id requests."""
+        client = self.new_client(hub_multiplex=False)
+        return isinstance(client.hub_query(emews.base.enums.hub_protocols.HUB_SERVICE_ID_REQ), int)
+
+    def test_reserved_protocol(self):
+        for serv_proto in (emews.base.enums.net_protocols.NET_NONE,
+                           emews.base.enums.net_protocols.NET_CC_1):
+            sock = self.connect(serv_proto)
+            self.assertEqual(sock.recv(1), '')
+            sock.close()
+
+        self.assertTrue(self._served())
+
+    def test_malformed_log_record(self):
+        sock = self.connect(emews.base.enums.net_protocols.NET_LOGGING)
+        sock.sendall(struct.pack('>L', 5) + 'bogus')
+        self.assertEqual(sock.recv(1), '')
+        sock.close()
+
+        self.assertTrue(self._served())
+
+
+if __name__ == '__main__':
+    unittest.main()
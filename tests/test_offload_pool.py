@@ -0,0 +1,139 @@
+"""Tests of the offload pool (emews.base.offload_pool) and client futures."""
+import select
+import socket
+import threading
+import unittest
+
+from emews.base.async_client import ClientFuture
+from emews.base.offload_pool import OffloadJob, OffloadPool
+
+import support
+
+
+def collect(pool, num_jobs, timeout=2.0):
+    """Return num_jobs completed jobs of the pool, collected as the reactor does."""
+    jobs = []
+    while len(jobs) < num_jobs:
+        readable = select.select([pool.wakeup_fd], [], [], timeout)[0]
+        if not readable:
+            raise AssertionError("%d of %d jobs completed" % (len(jobs), num_jobs))
+        jobs.extend(pool.completed())
+
+    return jobs
+
+
+class TestOffloadPool(unittest.TestCase):
+    """OffloadPool."""
+
+    def setUp(self):
+        support.init_logger()
+        self.pool = OffloadPool(1, 4)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_completion_order(self):
+        # a single worker thread completes jobs in submission order
+        jobs = [OffloadJob(lambda val: val * 2, (index,)) for index in xrange(4)]
+        for job in jobs:
+            self.assertTrue(self.pool.submit(job))
+
+        completed = collect(self.pool, len(jobs))
+        self.assertEqual([job.result() for job in completed], [0, 2, 4, 6])
+        self.assertEqual(self.pool.num_pending, 0)
+
+    def test_bounded(self):
+        release = threading.Event()
+        jobs = [OffloadJob(release.wait, (2,)) for _ in xrange(5)]
+        self.assertTrue(all(self.pool.submit(job) for job in jobs[:4]))
+        # too many pending: the caller runs the job itself
+        self.assertFalse(self.pool.submit(jobs[4]))
+
+        release.set()
+        collect(self.pool, 4)
+        self.assertTrue(self.pool.submit(jobs[4]))
+        collect(self.pool, 1)
+
+    def test_exception(self):
+        job = OffloadJob(lambda: {}['missing'], ())
+        self.pool.submit(job)
+        self.assertIs(collect(self.pool, 1)[0], job)
+        self.assertRaises(KeyError, job.result)
+
+    def test_close(self):
+        # running jobs complete before the wakeup pipe is closed
+        pool = OffloadPool(2, 4)
+        release = threading.Event()
+        pool.submit(OffloadJob(release.wait, (2,)))
+        threading.Timer(0.05, release.set).start()
+        pool.close()
+        self.assertTrue(release.is_set())
+        self.assertFalse(any(thread.is_alive() for thread in pool._threads))
+
+    def test_defer(self):
+        future = ClientFuture()
+        job = OffloadJob(lambda fut: fut.result(0) + 1, (future,))
+        self.pool.defer(job, future)
+        self.assertEqual(self.pool.num_pending, 1)
+        self.assertEqual(select.select([self.pool.wakeup_fd], [], [], 0)[0], [])
+
+        future.set_result(41)
+        self.assertEqual(collect(self.pool, 1)[0].result(), 42)
+        self.assertEqual(self.pool.num_pending, 0)
+
+    def test_defer_done(self):
+        # a future already done completes the job right away
+        future = ClientFuture()
+        future.set_exception(ValueError('failed'))
+        job = OffloadJob(lambda fut: fut.result(0), (future,))
+        self.pool.defer(job, future)
+        self.assertRaises(ValueError, collect(self.pool, 1)[0].result)
+
+
+class TestClientFuture(unittest.TestCase):
+    """ClientFuture."""
+
+    def setUp(self):
+        support.init_logger()
+
+    def test_result(self):
+        future = ClientFuture()
+        self.assertFalse(future.done())
+        thread = threading.Timer(0.05, future.set_result, ('done',))
+        thread.start()
+        self.assertEqual(future.result(2), 'done')
+        self.assertIsNone(future.exception())
+        thread.join()
+
+    def test_timeout(self):
+        self.assertRaises(socket.timeout, ClientFuture().result, 0.01)
+
+    def test_complete_once(self):
+        future = ClientFuture()
+        future.set_result(1)
+        self.assertRaises(ValueError, future.set_result, 2)
+
+    def test_callbacks(self):
+        future = ClientFuture()
+        called = []
+        future.add_done_callback(lambda fut: called.append(('before', fut.result())))
+        future.set_result(3)
+        future.add_done_callback(lambda fut: called.append(('after', fut.result())))
+        self.assertEqual(called, [('before', 3), ('after', 3)])
+
+    def test_chain(self):
+        future = ClientFuture()
+        chained = future.chain(lambda result: result + 1)
+        failed = future.chain(lambda result: result / 0)
+        future.set_result(1)
+        self.assertEqual(chained.result(0), 2)
+        self.assertIsInstance(failed.exception(0), ZeroDivisionError)
+
+        future = ClientFuture()
+        chained = future.chain(lambda result: result + 1)
+        future.set_exception(ValueError('failed'))
+        self.assertIsInstance(chained.exception(0), ValueError)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+"""Tests of the socket readiness backends (emews.base.poller)."""
+import select
+import socket
+import unittest
+
+import emews.base.enums
+from emews.base.poller import EpollPoller, PollEvents, SelectPoller, get_poller
+
+import support
+
+
+class PollerTests(object):
+    """Tests run against each backend (mixed into a TestCase with POLLER set)."""
+
+    POLLER = None
+
+    def setUp(self):
+        self.poller = self.POLLER()
+        self.sock, self.peer = socket.socketpair()
+
+    def tearDown(self):
+        self.poller.close()
+        self.sock.close()
+        self.peer.close()
+
+    def _ready(self, timeout=0.05):
+        return dict(self.poller.poll(timeout))
+
+    def test_readable(self):
+        self.poller.register(self.sock.fileno(), PollEvents.POLL_READ)
+        self.assertEqual(self._ready(), {})
+
+        self.peer.sendall('x')
+        self.assertEqual(self._ready(), {self.sock.fileno(): PollEvents.POLL_READ})
+
+    def test_writable(self):
+        self.poller.register(self.sock.fileno(), PollEvents.POLL_WRITE)
+        self.assertEqual(self._ready(), {self.sock.fileno(): PollEvents.POLL_WRITE})
+
+    def test_modify(self):
+        fd = self.sock.fileno()
+        self.poller.register(fd, PollEvents.POLL_READ)
+        self.poller.modify(fd, PollEvents.POLL_READ | PollEvents.POLL_WRITE)
+        self.peer.sendall('x')
+        self.assertEqual(self._ready(), {fd: PollEvents.POLL_READ | PollEvents.POLL_WRITE})
+
+        self.poller.modify(fd, PollEvents.POLL_WRITE)
+        self.assertEqual(self._ready(), {fd: PollEvents.POLL_WRITE})
+
+    def test_unregister(self):
+        self.poller.register(self.sock.fileno(), PollEvents.POLL_READ)
+        self.peer.sendall('x')
+        self.poller.unregister(self.sock.fileno())
+        self.assertEqual(self._ready(), {})
+
+    def test_hang_up(self):
+        # a closed peer is reported as readable (recv() then returns zero bytes)
+        self.poller.register(self.sock.fileno(), PollEvents.POLL_READ)
+        self.peer.close()
+        self.assertTrue(self._ready()[self.sock.fileno()] & PollEvents.POLL_READ)
+        self.assertEqual(self.sock.recv(1), '')
+
+
+class TestSelectPoller(PollerTests, unittest.TestCase):
+    """SelectPoller."""
+
+    POLLER = SelectPoller
+
+    def test_fd_setsize(self):
+        self.assertRaises(ValueError, self.poller.register, SelectPoller.FD_SETSIZE,
+                          PollEvents.POLL_READ)
+
+
+@unittest.skipUnless(hasattr(select, 'epoll'), "epoll not available")
+class TestEpollPoller(PollerTests, unittest.TestCase):
+    """EpollPoller."""
+
+    POLLER = EpollPoller
+
+
+class TestGetPoller(unittest.TestCase):
+    """get_poller."""
+
+    def test_backends(self):
+        self.assertIsInstance(get_poller('select'), SelectPoller)
+        self.assertEqual(get_poller('auto').name,
+                         'epoll' if hasattr(select, 'epoll') else 'select')
+        self.assertRaises(ValueError, get_poller, 'kqueue')
+
+
+class HubQueryTests(object):
+    """Hub queries served by the ConnectionManager (mixed into a HubTestCase)."""
+
+    def test_service_ids(self):
+        client = self.new_client()
+        service_ids = [client.hub_query(emews.base.enums.hub_protocols.HUB_SERVICE_ID_REQ)
+                       for _ in xrange(10)]
+        self.assertEqual(len(set(service_ids)), 10)
+        self.assertNotIn(None, service_ids)
+
+
+class TestSelectHub(HubQueryTests, support.HubTestCase):
+    """Hub using the select backend."""
+
+    HUB_CONFIG = {'poll_backend': 'select'}
+
+
+@unittest.skipUnless(hasattr(select, 'epoll'), "epoll not available")
+class TestEpollHub(HubQueryTests, support.HubTestCase):
+    """Hub using the epoll backend."""
+
+    HUB_CONFIG = {'poll_backend': 'epoll'}
+
+
+if __name__ == '__main__':
+    unittest.main()
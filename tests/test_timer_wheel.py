@@ -0,0 +1,67 @@
+"""Tests of the hashed timer wheel (emews.base.timer_wheel)."""
+import unittest
+
+from emews.base.timer_wheel import TimerWheel
+
+
+class TestTimerWheel(unittest.TestCase):
+    """TimerWheel."""
+
+    def setUp(self):
+        self.wheel = TimerWheel(tick_duration=1.0, num_slots=8, now=100.0)
+
+    def test_expire(self):
+        self.assertEqual(self.wheel.schedule('a', 102.5), 103)
+        self.wheel.schedule('b', 101.0)
+        self.assertEqual(len(self.wheel), 2)
+
+        self.assertEqual(self.wheel.expire(100.9), [])
+        self.assertEqual(self.wheel.expire(101.0), [(101, 'b')])
+        self.assertEqual(self.wheel.expire(102.9), [])
+        self.assertEqual(self.wheel.expire(103.0), [(103, 'a')])
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_past_deadline(self):
+        # timers due already expire on the next tick
+        self.assertEqual(self.wheel.schedule('a', 50.0), 101)
+        self.assertEqual(self.wheel.expire(101.0), [(101, 'a')])
+
+    def test_later_rotation(self):
+        # timers hashed to the same slot expire on their own rotation
+        self.wheel.schedule('near', 102.0)
+        self.wheel.schedule('far', 110.0)
+        self.assertEqual(self.wheel.expire(105.0), [(102, 'near')])
+        self.assertEqual(len(self.wheel), 1)
+        self.assertEqual(self.wheel.expire(110.0), [(110, 'far')])
+
+    def test_full_rotations(self):
+        # more than a full rotation passed since the last expiry
+        keys = ['k%d' % index for index in xrange(20)]
+        for index, key in enumerate(keys):
+            self.wheel.schedule(key, 101.0 + index)
+
+        expired = self.wheel.expire(200.0)
+        self.assertEqual(sorted(key for _, key in expired), sorted(keys))
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_next_timeout(self):
+        self.assertIsNone(self.wheel.next_timeout(100.0))
+        self.wheel.schedule('a', 105.0)
+        # the poll loop sleeps until the earliest timer, not the next tick
+        self.assertAlmostEqual(self.wheel.next_timeout(100.25), 4.75)
+        self.wheel.schedule('b', 102.5)
+        self.wheel.schedule('c', 102.2)
+        self.assertAlmostEqual(self.wheel.next_timeout(100.25), 2.75)
+
+        self.wheel.expire(103.0)
+        self.assertAlmostEqual(self.wheel.next_timeout(103.0), 2.0)
+        self.wheel.expire(105.0)
+        self.assertIsNone(self.wheel.next_timeout(105.0))
+
+    def test_next_timeout_due(self):
+        self.wheel.schedule('a', 101.0)
+        self.assertEqual(self.wheel.next_timeout(101.5), 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()